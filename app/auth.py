@@ -1,24 +1,45 @@
+import secrets
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import case, or_, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
 from app.models import User
 from app.config import get_settings
+from app.passwords import PasswordHasher, crypt_context
+from app.user_cache import UserCache
+from study_buddy_tracing import span
 
 settings = get_settings()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = crypt_context(settings.BCRYPT_ROUNDS)
+password_hasher = PasswordHasher(
+    rounds=settings.BCRYPT_ROUNDS,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE,
+    niceness=settings.PASSWORD_HASH_NICENESS,
+)
+# Call user_cache.invalidate(email) after committing any change to a user
+user_cache = UserCache(ttl=settings.USER_CACHE_TTL_SECONDS, max_entries=settings.USER_CACHE_SIZE)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with span("bcrypt.verify"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    with span("bcrypt.hash"):
+        return pwd_context.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -27,30 +48,102 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    with span("jwt.encode", algorithm=settings.ALGORITHM):
+        encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    with span("db.get_user_by_email") as s:
+        result = await db.execute(select(User).where(User.email == email).limit(1))
+        user = result.scalars().first()
+        s.set(found=user is not None)
+        return user
+
+async def get_user_by_google_id(db: AsyncSession, google_id: str):
+    with span("db.get_user_by_google_id") as s:
+        result = await db.execute(select(User).where(User.google_id == google_id).limit(1))
+        user = result.scalars().first()
+        s.set(found=user is not None)
+        return user
+
+async def get_user_for_google(db: AsyncSession, google_id: str, email: str):
+    # One query for both ways a Google login can match; a row already
+    # linked to this Google account wins over one that only shares the email
+    with span("db.get_user_for_google") as s:
+        result = await db.execute(
+            select(User)
+            .where(or_(User.google_id == google_id, User.email == email))
+            .order_by(case((User.google_id == google_id, 0), else_=1))
+            .limit(1)
+        )
+        user = result.scalars().first()
+        s.set(found=user is not None)
+        return user
 
-def get_user_by_google_id(db: Session, google_id: str):
-    return db.query(User).filter(User.google_id == google_id).first()
+# Dialects with INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+_UPSERT_DIALECTS = {"sqlite": sqlite, "postgresql": postgresql}
+
+async def upsert_google_user(db: AsyncSession, google_id: str, email: str, full_name=None, avatar_url=None):
+    # Creates the user, or links Google to the existing account with this
+    # email, in one statement that returns the row; safe against two first
+    # logins racing.  Commits.
+    dialect = db.bind.dialect.name
+    values = dict(
+        email=email,
+        full_name=full_name,
+        google_id=google_id,
+        auth_provider="google",
+        avatar_url=avatar_url,
+        is_verified=True,
+    )
+    link = dict(google_id=google_id, auth_provider="google", avatar_url=avatar_url, is_verified=True)
+    with span("db.upsert_google_user", dialect=dialect):
+        if dialect == "mysql":
+            # No RETURNING on MySQL: read the row back in the same transaction
+            await db.execute(mysql.insert(User).values(**values).on_duplicate_key_update(**link))
+            user = (await db.execute(select(User).where(User.email == email).limit(1))).scalars().one()
+        else:
+            stmt = (
+                _UPSERT_DIALECTS[dialect].insert(User)
+                .values(**values)
+                .on_conflict_do_update(index_elements=[User.email], set_=link)
+                .returning(User)
+            )
+            result = await db.execute(stmt, execution_options={"populate_existing": True})
+            user = result.scalars().one()
+        await db.commit()
+    return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def _load_user(email: str):
+    async with AsyncSessionLocal() as db:
+        user = await get_user_by_email(db, email=email)
+        if user is not None:
+            db.expunge(user)
+        return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = get_user_by_email(db, email=email)
+    # A cached token was verified before and its entry expires no later
+    # than the token, so a hit skips both the JWT check and the query
+    user = user_cache.get(token)
     if user is None:
-        raise credentials_exception
+        try:
+            with span("jwt.decode", algorithm=settings.ALGORITHM):
+                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+        except JWTError:
+            raise credentials_exception
+        
+        user = await _load_user(email)
+        if user is None:
+            raise credentials_exception
+        user_cache.put(token, email, user, payload.get("exp"))
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
     return user
\ No newline at end of file
@@ -0,0 +1,158 @@
+import csv
+import io
+import json
+import time
+from typing import Dict, List, Set
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal
+from app.models import User
+from app.passwords import PasswordHasher
+from app.schemas import UserCreate
+from study_buddy_metrics import Counter
+from study_buddy_tracing import span
+
+# Cohort onboarding: one existence query per chunk of emails instead of one
+# per row, hashing spread over the password pool and one INSERT ... VALUES
+# executemany and commit per batch of rows.
+
+IMPORT_ROWS = Counter("auth_bulk_import_rows_total", "Rows processed by bulk user import, by status.", ["status"])
+
+# Keeps IN (...) lists under every driver's bound parameter limit
+EMAIL_QUERY_CHUNK = 5000
+
+
+def parse_rows(body: bytes, content_type: str) -> List[dict]:
+    # CSV needs a header row: email,password[,username,full_name].  JSON is
+    # a list of objects, or {"users": [...]}
+    media_type = content_type.split(";")[0].strip().lower()
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Import file must be UTF-8")
+    if media_type in ("text/csv", "application/csv"):
+        rows = [dict(row) for row in csv.DictReader(io.StringIO(text))]
+    elif media_type == "application/json":
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if isinstance(rows, dict):
+            rows = rows.get("users")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail='Expected a list of users or {"users": [...]}')
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send the users as text/csv or application/json",
+        )
+    return rows
+
+
+async def existing_emails(emails: List[str]) -> Set[str]:
+    found = set()
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(emails), EMAIL_QUERY_CHUNK):
+            chunk = emails[start:start + EMAIL_QUERY_CHUNK]
+            with span("db.existing_emails", emails=len(chunk)):
+                result = await db.execute(select(User.email).where(User.email.in_(chunk)))
+            found.update(result.scalars())
+    return found
+
+
+async def _insert(values: List[dict]) -> Dict[str, str]:
+    # Returns email -> error for rows that could not be inserted.  A batch
+    # that hits a unique constraint (someone registered meanwhile) is
+    # retried row by row so only the conflicting rows fail.
+    async with AsyncSessionLocal() as db:
+        try:
+            with span("db.insert_users", rows=len(values)):
+                await db.execute(insert(User), values)
+                await db.commit()
+            return {}
+        except IntegrityError:
+            await db.rollback()
+        errors = {}
+        for value in values:
+            try:
+                await db.execute(insert(User), [value])
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+                errors[value["email"]] = "Email already registered"
+        return errors
+
+
+async def import_users(rows: List[dict], hasher: PasswordHasher, batch_size: int = 500) -> dict:
+    started = time.time()
+    results = []
+    pending = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        email = row.get("email") if isinstance(row, dict) else None
+        result = {"row": number, "email": email, "status": "created", "error": None}
+        results.append(result)
+        try:
+            if not isinstance(row, dict):
+                raise TypeError("Row must be an object")
+            user = UserCreate(**{k: v for k, v in row.items() if v not in (None, "") and k})
+        except (ValidationError, TypeError) as e:
+            result.update(status="invalid", error=str(e).replace("\n", " "))
+            continue
+        result["email"] = user.email
+        if user.email in seen:
+            result.update(status="duplicate", error="Email appears earlier in the file")
+            continue
+        seen.add(user.email)
+        pending.append((result, user))
+
+    existing = await existing_emails([user.email for _, user in pending])
+    new = []
+    for result, user in pending:
+        if user.email in existing:
+            result.update(status="exists", error="Email already registered")
+        else:
+            new.append((result, user))
+
+    for start in range(0, len(new), batch_size):
+        batch = new[start:start + batch_size]
+        try:
+            hashes = await hasher.hash_many([user.password for _, user in batch])
+        except HTTPException as e:
+            # Hasher queue full: earlier batches are committed, so report
+            # this batch's rows and carry on with the next
+            for result, _ in batch:
+                result.update(status="failed", error=str(e.detail))
+            continue
+        errors = await _insert([
+            {
+                "email": user.email,
+                "username": user.username,
+                "full_name": user.full_name,
+                "hashed_password": hashed,
+                "auth_provider": "local",
+                "is_verified": False,
+            }
+            for (_, user), hashed in zip(batch, hashes)
+        ])
+        for result, user in batch:
+            if user.email in errors:
+                result.update(status="exists", error=errors[user.email])
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    for name, count in counts.items():
+        IMPORT_ROWS.inc(count, status=name)
+    return {
+        "total": len(results),
+        "created": counts.get("created", 0),
+        "skipped": counts.get("exists", 0) + counts.get("duplicate", 0),
+        "failed": counts.get("invalid", 0) + counts.get("failed", 0),
+        "seconds": round(time.time() - started, 3),
+        "rows": results,
+    }
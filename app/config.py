@@ -1,16 +1,48 @@
 from pydantic import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Defaults to DATABASE_URL with its async driver (aiosqlite, aiomysql, asyncpg)
+    ASYNC_DATABASE_URL: Optional[str] = None
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    # Turn off in production and run `python -m app.migrate` on deploy
+    CREATE_SCHEMA_ON_STARTUP: bool = True
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 256
+    PASSWORD_HASH_NICENESS: int = 10
+
+    USER_CACHE_TTL_SECONDS: float = 60
+    USER_CACHE_SIZE: int = 10000
+
+    # Admin endpoints (bulk import) are disabled unless a token is set;
+    # send it in the X-Admin-Token header
+    ADMIN_TOKEN: Optional[str] = None
+    BULK_IMPORT_MAX_ROWS: int = 20000
+    BULK_IMPORT_BATCH_SIZE: int = 500
+
     GOOGLE_CLIENT_ID: str
     GOOGLE_CLIENT_SECRET: str
     GOOGLE_REDIRECT_URI: str
+    GOOGLE_DISCOVERY_URL: str = "https://accounts.google.com/.well-known/openid-configuration"
+    # Discovery document and JWKS cache; TTL applies when the response has
+    # no Cache-Control max-age
+    OIDC_CACHE_PATH: Optional[str] = None
+    OIDC_CACHE_TTL_SECONDS: float = 3600
+    OIDC_REFRESH_AHEAD_SECONDS: float = 300
+    OIDC_FETCH_TIMEOUT: float = 5
+    OIDC_PRELOAD_TIMEOUT: float = 10
 
     FRONTEND_URL: str
 
@@ -17,34 +17,44 @@ except Exception:
 
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse, RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from authlib.integrations.starlette_client import OAuth
 from starlette.config import Config
 from starlette.middleware.sessions import SessionMiddleware
 import httpx
+import os
+import tempfile
 
-from app.database import engine, get_db, Base
+from app.database import get_async_db
+from app.migrate import create_schema
 from app.models import User
-from app.schemas import UserCreate, UserLogin, Token, User as UserSchema, GoogleAuth
+from app.schemas import UserCreate, UserLogin, Token, User as UserSchema, GoogleAuth, ImportReport
 from app.auth import (
-    get_password_hash,
-    verify_password,
+    password_hasher,
+    user_cache,
     create_access_token,
     get_user_by_email,
-    get_user_by_google_id,
-    get_current_user
+    get_user_for_google,
+    upsert_google_user,
+    get_current_user,
+    require_admin
 )
+from app.bulk_import import import_users, parse_rows
 from app.config import get_settings
+from app.oidc import CachedDiscoveryOAuth2App, OIDCDiscovery
+from study_buddy_metrics import CONTENT_TYPE, REGISTRY
+from study_buddy_tracing import Tracer, span
 
 settings = get_settings()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(title="Hybrid Auth API")
 
+# Per-request span tracing (bcrypt, DB and JWT spans), enabled with
+# STUDY_BUDDY_TRACE_SAMPLE_RATE; see study_buddy_tracing.py
+tracer = Tracer.from_env(service="auth")
+
 # Add session middleware for OAuth
 app.add_middleware(SessionMiddleware, secret_key=settings.SECRET_KEY)
 
@@ -73,23 +83,84 @@ config_data = {
 starlette_config = Config(environ=config_data)
 oauth = OAuth(starlette_config)
 
+# Discovery document and JWKS are preloaded at startup and refreshed in the
+# background, so the login and callback never wait on Google's metadata
+google_discovery = OIDCDiscovery(
+    settings.GOOGLE_DISCOVERY_URL,
+    cache_path=settings.OIDC_CACHE_PATH or os.path.join(tempfile.gettempdir(), "auth-oidc-google.json"),
+    ttl=settings.OIDC_CACHE_TTL_SECONDS,
+    refresh_ahead=settings.OIDC_REFRESH_AHEAD_SECONDS,
+    timeout=settings.OIDC_FETCH_TIMEOUT,
+    preload_timeout=settings.OIDC_PRELOAD_TIMEOUT,
+)
+
 oauth.register(
     name='google',
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+    client_cls=CachedDiscoveryOAuth2App,
+    discovery=google_discovery,
     client_kwargs={'scope': 'openid email profile'}
 )
 
+# Added after the other middleware so its root span covers the whole request
+app.middleware("http")(tracer.middleware)
+
+# Schema creation is an explicit step: `python -m app.migrate`, or at
+# startup while CREATE_SCHEMA_ON_STARTUP is on (the development default)
+@app.on_event("startup")
+def create_database_schema():
+    if settings.CREATE_SCHEMA_ON_STARTUP:
+        create_schema()
+
+@app.on_event("startup")
+def start_password_hasher():
+    password_hasher.start()
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("startup")
+async def preload_google_discovery():
+    await google_discovery.start()
+
+@app.on_event("shutdown")
+async def stop_google_discovery():
+    await google_discovery.stop()
+
+async def _find_user(db: AsyncSession, email: str):
+    # Detach the user and end the read transaction so the connection goes
+    # back to the pool while bcrypt runs
+    user = await get_user_by_email(db, email=email)
+    if user is not None:
+        db.expunge(user)
+    await db.rollback()
+    return user
+
+async def _add_user(db: AsyncSession, user: User):
+    db.add(user)
+    with span("db.commit"):
+        await db.commit()
+        await db.refresh(user)
+    return user
+
 # ============ TRADITIONAL AUTH ENDPOINTS ============
 
+# Tokens carry the user id ("uid") next to the email ("sub") so the study
+# buddy API can verify them locally without looking the user up.
+
+# Password hashing runs on the hasher's process pool and queries use the
+# async engine, so a burst of registrations or logins holds neither the
+# event loop nor threadpool workers while bcrypt runs.
+
 @app.post("/auth/register", response_model=Token)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user exists
-    db_user = get_user_by_email(db, email=user.email)
+    db_user = await _find_user(db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     new_user = User(
         email=user.email,
         username=user.username,
@@ -98,14 +169,12 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         auth_provider="local",
         is_verified=False
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await _add_user(db, new_user)
     
     # Create access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": new_user.email},
+        data={"sub": new_user.email, "uid": new_user.id},
         expires_delta=access_token_expires
     )
     
@@ -116,8 +185,8 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     }
 
 @app.post("/auth/login", response_model=Token)
-def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
-    user = get_user_by_email(db, email=user_credentials.email)
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await _find_user(db, user_credentials.email)
     
     if not user:
         raise HTTPException(
@@ -131,15 +200,22 @@ def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
             detail=f"This account uses {user.auth_provider} login. Please use that method."
         )
     
-    if not verify_password(user_credentials.password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify(user_credentials.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
+    # BCRYPT_ROUNDS changed since this hash was made: store a new one
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await _add_user(db, user)
+        user_cache.invalidate(user.email)
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email},
+        data={"sub": user.email, "uid": user.id},
         expires_delta=access_token_expires
     )
     
@@ -157,9 +233,10 @@ async def google_login(request: Request):
     return await oauth.google.authorize_redirect(request, redirect_uri)
 
 @app.get("/auth/google/callback")
-async def google_callback(request: Request, db: Session = Depends(get_db)):
+async def google_callback(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
-        token = await oauth.google.authorize_access_token(request)
+        with span("oauth.exchange_code"):
+            token = await oauth.google.authorize_access_token(request)
         user_info = token.get('userinfo')
         
         if not user_info:
@@ -170,37 +247,19 @@ async def google_callback(request: Request, db: Session = Depends(get_db)):
         name = user_info.get('name')
         picture = user_info.get('picture')
         
-        # Check if user exists by Google ID
-        user = get_user_by_google_id(db, google_id=google_id)
-        
-        if not user:
-            # Check if email exists (user might have registered with email/password)
-            user = get_user_by_email(db, email=email)
-            if user:
-                # Link Google account to existing user
-                user.google_id = google_id
-                user.auth_provider = "google"
-                user.avatar_url = picture
-                user.is_verified = True
-            else:
-                # Create new user
-                user = User(
-                    email=email,
-                    full_name=name,
-                    google_id=google_id,
-                    auth_provider="google",
-                    avatar_url=picture,
-                    is_verified=True
-                )
-                db.add(user)
-        
-        db.commit()
-        db.refresh(user)
+        # One lookup by Google ID or email; a returning Google user needs
+        # nothing else, anyone else is created or linked by the upsert
+        user = await get_user_for_google(db, google_id=google_id, email=email)
+        if user is None or user.google_id != google_id:
+            user = await upsert_google_user(
+                db, google_id=google_id, email=email, full_name=name, avatar_url=picture
+            )
+            user_cache.invalidate(user.email)
         
         # Create access token
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email},
+            data={"sub": user.email, "uid": user.id},
             expires_delta=access_token_expires
         )
         
@@ -208,6 +267,8 @@ async def google_callback(request: Request, db: Session = Depends(get_db)):
         frontend_url = f"{settings.FRONTEND_URL}/auth/callback?token={access_token}"
         return RedirectResponse(url=frontend_url)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -217,6 +278,24 @@ async def google_callback(request: Request, db: Session = Depends(get_db)):
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+# ============ ADMIN ENDPOINTS ============
+
+@app.post("/auth/admin/users/import", response_model=ImportReport, dependencies=[Depends(require_admin)])
+async def bulk_import_users(request: Request):
+    # Body is text/csv (header: email,password[,username,full_name]) or a
+    # JSON list; existing emails are skipped and reported per row
+    rows = parse_rows(await request.body(), request.headers.get("content-type", ""))
+    if len(rows) > settings.BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BULK_IMPORT_MAX_ROWS} users per import",
+        )
+    return await import_users(rows, password_hasher, batch_size=settings.BULK_IMPORT_BATCH_SIZE)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/")
 def root():
     return {"message": "Hybrid Auth API is running on port 8000! Frontend should be on port 8080."}
\ No newline at end of file
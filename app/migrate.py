@@ -0,0 +1,12 @@
+from app.database import Base, engine
+from app import models  # noqa: F401  registers the tables on Base.metadata
+
+
+def create_schema():
+    # Creates missing tables only; existing ones are left as they are
+    Base.metadata.create_all(bind=engine)
+
+
+if __name__ == "__main__":
+    create_schema()
+    print(f"Schema ready: {', '.join(sorted(Base.metadata.tables))}")
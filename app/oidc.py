@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Optional
+
+import httpx
+from authlib.integrations.starlette_client import StarletteOAuth2App
+from fastapi import HTTPException, status
+
+from study_buddy_metrics import Counter, Gauge
+
+# Google's discovery document and signing keys (JWKS), cached in memory and
+# on disk and refreshed in the background before they expire.  Logins read
+# the cached copies only; they never wait on a fetch.  The disk copy lets a
+# cold worker serve its first login without going to the network.
+
+log = logging.getLogger(__name__)
+
+OIDC_REFRESHES = Counter("auth_oidc_refresh_total", "Discovery/JWKS refreshes by result.", ["result"])
+OIDC_UNAVAILABLE = Counter(
+    "auth_oidc_unavailable_total", "Google sign-in requests rejected because no metadata was cached."
+)
+OIDC_AGE = Gauge("auth_oidc_cache_age_seconds", "Age of the cached discovery document and JWKS.")
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def _max_age(response: httpx.Response) -> Optional[float]:
+    match = _MAX_AGE.search(response.headers.get("cache-control", ""))
+    return float(match.group(1)) if match else None
+
+
+class OIDCDiscovery:
+    def __init__(
+        self,
+        metadata_url: str,
+        cache_path: Optional[str] = None,
+        ttl: float = 3600,
+        refresh_ahead: float = 300,
+        timeout: float = 5,
+        preload_timeout: float = 10,
+    ):
+        self.metadata_url = metadata_url
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        self.preload_timeout = preload_timeout
+        self.metadata: Optional[dict] = None
+        self.jwks: Optional[dict] = None
+        self.fetched_at = 0.0
+        self.expires_at = 0.0
+        self.failures = 0
+        self._last_attempt = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        OIDC_AGE.set_function(lambda: time.time() - self.fetched_at if self.ready else 0.0)
+
+    @property
+    def ready(self) -> bool:
+        return self.metadata is not None and self.jwks is not None
+
+    def _accept(self, metadata: dict, jwks: dict, fetched_at: float, expires_at: float):
+        self.metadata, self.jwks = metadata, jwks
+        self.fetched_at, self.expires_at = fetched_at, expires_at
+
+    def load_cached(self) -> bool:
+        # A stale disk copy is still used; the refresh loop replaces it
+        if not self.cache_path:
+            return False
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["metadata_url"] != self.metadata_url:
+                return False
+            self._accept(cached["metadata"], cached["jwks"], cached["fetched_at"], cached["expires_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _store(self):
+        if not self.cache_path:
+            return
+        document = {
+            "metadata_url": self.metadata_url,
+            "metadata": self.metadata,
+            "jwks": self.jwks,
+            "fetched_at": self.fetched_at,
+            "expires_at": self.expires_at,
+        }
+        # Workers share the file; write a private copy and swap it in
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            log.warning("Could not write the OIDC cache to %s", self.cache_path, exc_info=True)
+
+    async def _fetch(self):
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.metadata_url)
+            response.raise_for_status()
+            metadata = response.json()
+            lifetimes = [_max_age(response)]
+            response = await client.get(metadata["jwks_uri"])
+            response.raise_for_status()
+            jwks = response.json()
+            lifetimes.append(_max_age(response))
+        fetched_at = time.time()
+        lifetime = min((age for age in lifetimes if age is not None), default=self.ttl)
+        self._accept(metadata, jwks, fetched_at, fetched_at + lifetime)
+        self._store()
+
+    async def _refresh(self) -> bool:
+        self._last_attempt = time.time()
+        try:
+            await self._fetch()
+        except (httpx.HTTPError, ValueError, KeyError) as exc:
+            self.failures += 1
+            OIDC_REFRESHES.inc(result="error")
+            log.warning("OIDC metadata refresh from %s failed: %s", self.metadata_url, exc)
+            return False
+        self.failures = 0
+        OIDC_REFRESHES.inc(result="ok")
+        return True
+
+    def refresh(self) -> asyncio.Task:
+        # One refresh at a time; concurrent callers share it
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return self._refreshing
+
+    def request_refresh(self, min_interval: float = 30):
+        # Called when a token names an unknown key; rate limited so forged
+        # key ids cannot make us hammer the provider
+        if time.time() - self._last_attempt >= min_interval:
+            self.refresh()
+
+    def _next_delay(self) -> float:
+        if not self.ready or self.failures:
+            return min(300.0, 5.0 * 2 ** min(self.failures, 6))
+        return max(1.0, self.expires_at - self.refresh_ahead - time.time())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self._next_delay())
+            await asyncio.shield(self.refresh())
+
+    async def start(self):
+        loaded = self.load_cached()
+        if not loaded and self.preload_timeout > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.refresh()), self.preload_timeout)
+            except asyncio.TimeoutError:
+                log.warning("OIDC metadata not loaded within %ss; retrying in the background", self.preload_timeout)
+        elif loaded and self.expires_at - self.refresh_ahead <= time.time():
+            self.refresh()
+        if self._loop_task is None:
+            self._loop_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+        self._loop_task = None
+
+
+class CachedDiscoveryOAuth2App(StarletteOAuth2App):
+    # Registered with client_cls=...; reads metadata and keys from an
+    # OIDCDiscovery instead of fetching them on the first login
+    def __init__(self, framework, name, discovery: OIDCDiscovery = None, **kwargs):
+        super().__init__(framework, name, **kwargs)
+        self.discovery = discovery
+
+    async def load_server_metadata(self):
+        if not self.discovery.ready:
+            OIDC_UNAVAILABLE.inc()
+            self.discovery.request_refresh(min_interval=5)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Google sign-in is starting up, please retry",
+                headers={"Retry-After": "5"},
+            )
+        self.server_metadata.update(self.discovery.metadata)
+        return self.server_metadata
+
+    async def fetch_jwk_set(self, force=False):
+        # force means the id token named a key we do not have: refresh in
+        # the background and let this login fail rather than wait
+        if force:
+            self.discovery.request_refresh()
+        await self.load_server_metadata()
+        return self.discovery.jwks
@@ -0,0 +1,144 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from study_buddy_metrics import Counter, Gauge, Histogram
+from study_buddy_tracing import span
+
+# bcrypt is CPU bound and holds a worker for ~100-300 ms per call, so it runs
+# on its own process pool instead of the event loop or the shared threadpool.
+# Only the worker functions below run in the child processes; this module
+# must stay importable without the app settings or database.
+
+HASH_QUEUE_SECONDS = Histogram(
+    "auth_password_hash_queue_seconds",
+    "Time password hashing jobs waited for a free worker.",
+    ["operation"],
+)
+HASH_SECONDS = Histogram(
+    "auth_password_hash_seconds",
+    "Time spent hashing or verifying a password in a worker.",
+    ["operation"],
+)
+HASH_PENDING = Gauge("auth_password_hash_pending", "Password hashing jobs queued or running.")
+HASH_REJECTED = Counter(
+    "auth_password_hash_rejected_total", "Password hashing jobs rejected because the queue was full."
+)
+REHASHED = Counter("auth_password_rehashed_total", "Password hashes upgraded to the current cost on login.")
+
+
+@lru_cache()
+def crypt_context(rounds: int) -> CryptContext:
+    # Pinning min/max to the configured cost makes verify_and_update flag any
+    # hash made with a different cost, higher or lower
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+def _hash_job(password: str, rounds: int) -> Tuple[str, float, float]:
+    started = time.time()
+    hashed = crypt_context(rounds).hash(password)
+    return hashed, started, time.time()
+
+
+def _verify_job(password: str, hashed: str, rounds: int) -> Tuple[Tuple[bool, Optional[str]], float, float]:
+    started = time.time()
+    result = crypt_context(rounds).verify_and_update(password, hashed)
+    return result, started, time.time()
+
+
+def _warm_up() -> None:
+    pass
+
+
+def _init_worker(niceness: int) -> None:
+    # Hashing yields the CPU to request handling when cores are scarce
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: int = 2, max_queue: int = 256, niceness: int = 10):
+        self.rounds = rounds
+        self.workers = workers
+        self.niceness = niceness
+        self.max_pending = workers + max_queue
+        self.pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        HASH_PENDING.set_function(lambda: self.pending)
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a server process that already runs threads is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.niceness,),
+            )
+        return self._pool
+
+    def start(self):
+        # Start every worker up front so the first logins do not pay for it
+        for future in [self.pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _run(self, operation: str, job, *args):
+        if self.pending >= self.max_pending:
+            HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password operations in progress, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        submitted = time.time()
+        try:
+            with span(f"bcrypt.{operation}", rounds=self.rounds) as s:
+                result, started, finished = await asyncio.wrap_future(self.pool.submit(job, *args))
+                s.set(queue_ms=round((started - submitted) * 1000, 3))
+        finally:
+            self.pending -= 1
+        HASH_QUEUE_SECONDS.observe(max(0.0, started - submitted), operation=operation)
+        HASH_SECONDS.observe(finished - started, operation=operation)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash_job, password, self.rounds)
+
+    async def hash_many(self, passwords: List[str]) -> List[str]:
+        # Keeps only a couple of jobs per worker queued, so logins arriving
+        # during a bulk import wait behind a few hashes, not the whole batch
+        slots = asyncio.Semaphore(2 * self.workers)
+
+        async def hash_one(password):
+            async with slots:
+                return await self.hash(password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        # Returns (valid, new_hash); new_hash is set when the stored hash
+        # used another cost and should be replaced
+        valid, new_hash = await self._run("verify", _verify_job, password, hashed, self.rounds)
+        if new_hash is not None:
+            REHASHED.inc()
+        return valid, new_hash
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -23,6 +23,7 @@ class User(UserBase):
     created_at: datetime
     
     class Config:
+        orm_mode = True
         from_attributes = True
 
 class Token(BaseModel):
@@ -31,4 +32,18 @@ class Token(BaseModel):
     user: User
 
 class GoogleAuth(BaseModel):
-    code: str
\ No newline at end of file
+    code: str
+
+class ImportRowResult(BaseModel):
+    row: int
+    email: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+class ImportReport(BaseModel):
+    total: int
+    created: int
+    skipped: int
+    failed: int
+    seconds: float
+    rows: List[ImportRowResult]
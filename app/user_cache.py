@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from study_buddy_metrics import Counter, Gauge
+
+# Verified token -> detached User snapshot.  Each process has its own cache,
+# so an invalidation only reaches the worker that made the change; the TTL
+# bounds how long other workers can serve the old snapshot.
+
+USER_CACHE_REQUESTS = Counter(
+    "auth_user_cache_requests_total",
+    "Authenticated-user lookups by cache result; every hit is a database query saved.",
+    ["result"],
+)
+USER_CACHE_INVALIDATIONS = Counter(
+    "auth_user_cache_invalidations_total", "Cached user snapshots dropped because the user changed."
+)
+USER_CACHE_SIZE = Gauge("auth_user_cache_entries", "Tokens with a cached user snapshot.")
+
+
+class UserCache:
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # token -> (expires_at, email, user)
+        self._entries: "OrderedDict[str, Tuple[float, str, object]]" = OrderedDict()
+        self._tokens_by_email: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        USER_CACHE_SIZE.set_function(lambda: len(self._entries))
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, token: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] <= time.time():
+                self._remove(token)
+                entry = None
+            if entry is None:
+                USER_CACHE_REQUESTS.inc(result="miss")
+                return None
+            self._entries.move_to_end(token)
+        USER_CACHE_REQUESTS.inc(result="hit")
+        return entry[2]
+
+    def put(self, token: str, email: str, user, token_expires_at: Optional[float] = None):
+        # The user must be detached from its session; callers only read it
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (expires_at, email, user)
+            self._tokens_by_email.setdefault(email, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, email: str):
+        with self._lock:
+            tokens = self._tokens_by_email.pop(email, set())
+            for token in tokens:
+                self._entries.pop(token, None)
+        if tokens:
+            USER_CACHE_INVALIDATIONS.inc(len(tokens))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_email.clear()
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_email.get(entry[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[entry[1]]
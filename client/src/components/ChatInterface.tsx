@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Button } from "@/components/ui/button";
 import { ScrollArea } from "@/components/ui/scroll-area";
 import {
@@ -31,7 +31,18 @@ import {
   setCurrentSessionId,
   type StudySession,
 } from "@/lib/sessionManager";
-import { sendChatMessage, uploadNotes, type ChatMessage } from "@/lib/api";
+import {
+  getSessionMessages,
+  sendChatMessage,
+  uploadNotes,
+  type ChatRequestPayload,
+  type ChatResponsePayload,
+  type ChatTurn,
+} from "@/lib/api";
+
+// Sends per message when the session keeps changing under us (409)
+const MAX_SEND_ATTEMPTS = 5;
+const CONFLICT_RETRY_MS = 500;
 
 interface Message {
   id: string;
@@ -57,6 +68,8 @@ export default function ChatInterface({ userName = "Student" }: ChatInterfacePro
   const [isFirstMessage, setIsFirstMessage] = useState(true);
   const [uploadedFiles, setUploadedFiles] = useState<File[]>([]);
   const [hasUploadedNotes, setHasUploadedNotes] = useState(false);
+  // Last server session version seen per session id
+  const sessionVersions = useRef<Record<string, number>>({});
 
   // Initialize sessions on mount
   useEffect(() => {
@@ -150,6 +163,63 @@ export default function ChatInterface({ userName = "Student" }: ChatInterfacePro
     });
   };
 
+  // Every page of turns after version `after`
+  const fetchMissedTurns = async (userId: number, sessionId: string, after?: number) => {
+    const turns: ChatTurn[] = [];
+    let page = await getSessionMessages(userId, sessionId, { after });
+    turns.push(...page.turns);
+    while (page.has_more && page.turns.length > 0) {
+      after = page.turns[page.turns.length - 1].version;
+      page = await getSessionMessages(userId, sessionId, { after });
+      turns.push(...page.turns);
+    }
+    return { version: page.version, turns };
+  };
+
+  // Show turns from the server before a message that is still pending
+  const insertBefore = (sessionId: string, messageId: string, turns: ChatTurn[]) => {
+    if (turns.length === 0) return;
+    const timestamp = new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+    const missed: Message[] = turns.map((turn) => ({
+      id: `${sessionId}-v${turn.version}`,
+      content: turn.text,
+      isUser: turn.is_user,
+      timestamp,
+    }));
+    setMessages((prev) => {
+      const known = new Set(prev.map((m) => m.id));
+      const fresh = missed.filter((m) => !known.has(m.id));
+      const index = prev.findIndex((m) => m.id === messageId);
+      if (index === -1) return [...prev, ...fresh];
+      return [...prev.slice(0, index), ...fresh, ...prev.slice(index)];
+    });
+  };
+
+  // On a 409 the session moved on (another tab, or a server restart): show
+  // the turns we missed above the pending message and resend.  If nothing
+  // new arrived, a reply is still being generated elsewhere, so wait a
+  // little before trying again
+  const sendCatchingUp = async (
+    request: ChatRequestPayload,
+    pendingId: string
+  ): Promise<ChatResponsePayload> => {
+    let baseVersion = request.base_version;
+    for (let attempt = 1; ; attempt++) {
+      try {
+        return await sendChatMessage({ ...request, base_version: baseVersion });
+      } catch (error) {
+        const conflict = error instanceof Error && error.message.startsWith("409");
+        if (!conflict || attempt >= MAX_SEND_ATTEMPTS) throw error;
+      }
+      const missed = await fetchMissedTurns(request.user_id, request.session_id, baseVersion);
+      if (missed.turns.length === 0 && missed.version === baseVersion) {
+        await new Promise((resolve) => setTimeout(resolve, CONFLICT_RETRY_MS * attempt));
+      }
+      insertBefore(request.session_id, pendingId, missed.turns);
+      baseVersion = missed.version;
+    }
+  };
+
   const handleSendMessage = async (content: string) => {
     const newMessage: Message = {
       id: Date.now().toString(),
@@ -172,21 +242,20 @@ export default function ChatInterface({ userName = "Student" }: ChatInterfacePro
       };
       const personalityMode = personalityMap[studyMode] || "1";
 
-      // Convert messages to backend format
-      const conversationHistory: ChatMessage[] = messages.map(msg => ({
-        text: msg.content,
-        is_user: msg.isUser,
-      }));
-
-      // Send request to backend
-      const response = await sendChatMessage({
+      // The backend keeps the conversation; send only the new message and
+      // the last session version we saw
+      const request: ChatRequestPayload = {
         user_id: 1, // Default user ID, could be dynamic based on auth
         session_id: selectedSession,
         message: content,
         personality_mode: personalityMode,
-        conversation: conversationHistory,
+        base_version: sessionVersions.current[selectedSession],
         use_notes: hasUploadedNotes, // Use notes if files have been uploaded
-      });
+      };
+
+      // Send request to backend
+      const response = await sendCatchingUp(request, newMessage.id);
+      sessionVersions.current[selectedSession] = response.version;
 
       setIsTyping(false);
 
@@ -5,12 +5,17 @@ export interface ChatMessage {
   is_user: boolean;
 }
 
+export interface ChatTurn extends ChatMessage {
+  version: number;
+}
+
 export interface ChatRequestPayload {
   user_id: number;
   session_id: string;
   message: string;
   personality_mode: string;
-  conversation?: ChatMessage[];
+  // Session version the client last saw; the server keeps the history
+  base_version?: number;
   use_notes?: boolean;
 }
 
@@ -18,6 +23,15 @@ export interface ChatResponsePayload {
   reply: string;
   emotion: string;
   session_id: string;
+  version: number;
+  turns: ChatTurn[];
+}
+
+export interface SessionHistoryPayload {
+  session_id: string;
+  version: number;
+  turns: ChatTurn[];
+  has_more: boolean;
 }
 
 export interface NoteUploadResponse {
@@ -39,6 +53,26 @@ export async function sendChatMessage(payload: ChatRequestPayload): Promise<Chat
   return response.json();
 }
 
+/**
+ * Fetch one page of a session's history: the turns after version `after`,
+ * or the latest `limit` turns before version `before`
+ */
+export async function getSessionMessages(
+  userId: number,
+  sessionId: string,
+  options: { after?: number; before?: number; limit?: number } = {}
+): Promise<SessionHistoryPayload> {
+  const params = new URLSearchParams({ user_id: userId.toString() });
+  for (const [key, value] of Object.entries(options)) {
+    if (value !== undefined) params.set(key, value.toString());
+  }
+  const response = await apiRequest(
+    "GET",
+    `/api/sessions/${encodeURIComponent(sessionId)}/messages?${params}`
+  );
+  return response.json();
+}
+
 /**
  * Upload study notes to the backend
  */
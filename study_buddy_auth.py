@@ -0,0 +1,202 @@
+"""
+Study Buddy Token Verification
+==============================
+
+The auth service in ``app/`` signs a JWT for every login
+(``create_access_token``).  The Study Buddy API verifies those bearer
+tokens itself instead of asking the auth service who the caller is: the
+signing key is shared configuration, the token carries the user id in
+its ``uid`` claim and the expiry in ``exp``, so checking a token needs no
+network hop and no database.
+
+:class:`TokenVerifier` keeps the verification cheap:
+
+* The key material is prepared once.  HMAC tokens (``HS256``, the auth
+  service default) are checked with :mod:`hmac` directly; asymmetric
+  algorithms construct a ``python-jose`` key object once and reuse it.
+* Only the configured algorithm is accepted, whatever the token header
+  says, so ``none`` or an HMAC token signed with a public key is rejected.
+* Decoded claims are kept in a small LRU keyed by the token string until
+  the token expires.  A front‑end sends the same token on every request,
+  so after the first request of a session verification is a dictionary
+  lookup and an expiry comparison.
+
+Configuration comes from the environment (see
+:meth:`TokenVerifier.from_env`).  Without a key the backend does not
+authenticate requests at all, as before.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from jose import jwk  # type: ignore
+except ImportError:
+    jwk = None  # type: ignore
+
+
+# Claim holding the numeric user id; the auth service adds it next to
+# ``sub`` (the email)
+USER_ID_CLAIM = "uid"
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+
+class TokenError(Exception):
+    """Raised when a bearer token is malformed, forged or expired."""
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+class TokenVerifier:
+    """Verifies JWTs signed by the auth service, with a decoded-token cache.
+
+    Thread‑safe; sync endpoints running on worker threads may share it.
+
+    Args:
+        key: HMAC secret, or a PEM public key for asymmetric algorithms.
+        algorithm: The only algorithm accepted (default ``HS256``).
+        leeway: Seconds of clock skew tolerated on ``exp`` and ``nbf``.
+        cache_size: Maximum number of decoded tokens kept; ``0`` disables
+            the cache.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        algorithm: str = "HS256",
+        leeway: float = 0.0,
+        cache_size: int = 4096,
+    ) -> None:
+        self.algorithm = algorithm
+        self.leeway = leeway
+        self.cache_size = cache_size
+        self._digest = _HMAC_DIGESTS.get(algorithm)
+        if self._digest is not None:
+            self._secret = key.encode("utf-8")
+            self._key = None
+        else:
+            if jwk is None:
+                raise RuntimeError(f"python-jose is required to verify {algorithm} tokens")
+            self._secret = b""
+            self._key = jwk.construct(key, algorithm)
+        # token -> (expires_at, claims)
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"hit": 0, "verified": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["TokenVerifier"]:
+        """Build a verifier from the environment, or ``None`` if unconfigured.
+
+        ``STUDY_BUDDY_JWT_KEY`` holds the key (the auth service's
+        ``SECRET_KEY`` for HMAC tokens), or ``STUDY_BUDDY_JWT_KEY_FILE``
+        names a file containing it.  ``STUDY_BUDDY_JWT_ALGORITHM`` must
+        match the auth service's ``ALGORITHM``; ``STUDY_BUDDY_JWT_LEEWAY_S``
+        and ``STUDY_BUDDY_JWT_CACHE_SIZE`` tune the checks and the cache.
+        """
+        key = os.environ.get("STUDY_BUDDY_JWT_KEY")
+        key_file = os.environ.get("STUDY_BUDDY_JWT_KEY_FILE")
+        if not key and key_file:
+            with open(key_file, "r", encoding="utf-8") as f:
+                key = f.read().strip()
+        if not key:
+            return None
+        return cls(
+            key,
+            algorithm=os.environ.get("STUDY_BUDDY_JWT_ALGORITHM", "HS256"),
+            leeway=float(os.environ.get("STUDY_BUDDY_JWT_LEEWAY_S", "0")),
+            cache_size=int(os.environ.get("STUDY_BUDDY_JWT_CACHE_SIZE", "4096")),
+        )
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Return the claims of a valid token.
+
+        Args:
+            token: The compact JWT, without the ``Bearer`` prefix.
+
+        Returns:
+            The decoded claims.  Callers must not modify them; cached
+            tokens share one dictionary.
+
+        Raises:
+            TokenError: If the token is malformed, its signature does not
+                match, it has no ``exp`` claim, it has expired or it is not
+                valid yet.
+        """
+        now = time.time()
+        if self.cache_size > 0:
+            with self._lock:
+                entry = self._cache.get(token)
+                if entry is not None:
+                    if entry[0] + self.leeway > now:
+                        self._cache.move_to_end(token)
+                        self.counters["hit"] += 1
+                        return entry[1]
+                    del self._cache[token]
+        try:
+            claims = self._decode(token, now)
+        except TokenError:
+            self.counters["rejected"] += 1
+            raise
+        self.counters["verified"] += 1
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[token] = (float(claims["exp"]), claims)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
+
+    def _decode(self, token: str, now: float) -> Dict[str, Any]:
+        try:
+            signing_input, _, signature_segment = token.rpartition(".")
+            header_segment, _, payload_segment = signing_input.partition(".")
+            header = json.loads(_b64decode(header_segment))
+            signature = _b64decode(signature_segment)
+        except (ValueError, TypeError) as exc:
+            raise TokenError("Malformed token") from exc
+        if not isinstance(header, dict) or header.get("alg") != self.algorithm:
+            raise TokenError("Unexpected token algorithm")
+
+        message = signing_input.encode("ascii", "replace")
+        if self._digest is not None:
+            expected = hmac.new(self._secret, message, self._digest).digest()
+            valid = hmac.compare_digest(expected, signature)
+        else:
+            valid = self._key.verify(message, signature)
+        if not valid:
+            raise TokenError("Invalid token signature")
+
+        try:
+            claims = json.loads(_b64decode(payload_segment))
+        except (ValueError, TypeError) as exc:
+            raise TokenError("Malformed token") from exc
+        if not isinstance(claims, dict):
+            raise TokenError("Malformed token")
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            raise TokenError("Token has no expiry")
+        if exp + self.leeway <= now:
+            raise TokenError("Token has expired")
+        nbf = claims.get("nbf")
+        if isinstance(nbf, (int, float)) and nbf - self.leeway > now:
+            raise TokenError("Token is not valid yet")
+        return claims
@@ -0,0 +1,322 @@
+"""
+Study Buddy Auth Load Test
+==========================
+
+Load scenarios for the authentication service in ``app/``.
+
+``burst``
+    A "start of class" login storm.  A few clients poll ``GET /auth/me``
+    with a valid token for the whole run; after a quiet baseline period a
+    burst of concurrent ``POST /auth/register`` calls (each a bcrypt hash)
+    arrives.  The report compares ``/auth/me`` latency before, during and
+    after the burst, which should stay flat when password hashing does not
+    share the event loop or the request threadpool.
+
+``me``
+    Throughput of authenticated requests.  ``--users`` accounts are
+    registered, then ``--clients`` concurrent clients call ``GET /auth/me``
+    with those tokens for ``--duration`` seconds.  With ``--no-user-cache``
+    every call reaches the database, which makes this a benchmark of the
+    connection pool and driver (``DB_POOL_SIZE`` etc.).
+
+``import``
+    Cohort onboarding.  ``--registrations`` users are created once with a
+    single ``POST /auth/admin/users/import`` (CSV) and once more with one
+    ``POST /auth/register`` per user at ``--concurrency``; the report
+    compares users per second.  ``--admin-token`` must match the server's
+    ``ADMIN_TOKEN`` when ``--url`` is used.
+
+By default the app is imported in‑process against a throw‑away SQLite
+database, with placeholder Google credentials.  ``--url`` targets a
+running server instead.  ``--bcrypt-rounds`` and ``--hash-workers`` set
+``BCRYPT_ROUNDS`` and ``PASSWORD_HASH_WORKERS`` for the in‑process app,
+``--database-url`` replaces the SQLite file (e.g. a local MySQL) and
+``--no-user-cache`` sets ``USER_CACHE_SIZE=0``.
+
+Examples:
+
+```
+python study_buddy_auth_loadtest.py burst --registrations 200
+python study_buddy_auth_loadtest.py burst --url http://localhost:8000 --output burst.json
+python study_buddy_auth_loadtest.py me --no-user-cache --clients 64 --duration 20
+python study_buddy_auth_loadtest.py import --registrations 1000 --bcrypt-rounds 10
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from study_buddy_benchmark import summarize
+
+
+###############################################################################
+# Target
+###############################################################################
+
+async def _in_process_client(args: argparse.Namespace) -> httpx.AsyncClient:
+    """Import the auth app against a temporary SQLite database."""
+    directory = tempfile.mkdtemp(prefix="study-buddy-auth-")
+    defaults = {
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(directory, 'auth.db')}",
+        "SECRET_KEY": "load-test-secret",
+        "GOOGLE_CLIENT_ID": "load-test",
+        "GOOGLE_CLIENT_SECRET": "load-test",
+        "GOOGLE_REDIRECT_URI": "http://localhost:8000/auth/google/callback",
+        "FRONTEND_URL": "http://localhost:8080",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "PASSWORD_HASH_WORKERS": str(args.hash_workers),
+        "ADMIN_TOKEN": args.admin_token,
+        # Google sign‑in is not exercised; do not wait for its metadata
+        "OIDC_CACHE_PATH": os.path.join(directory, "oidc.json"),
+        "OIDC_PRELOAD_TIMEOUT": "0",
+    }
+    if args.no_user_cache:
+        defaults["USER_CACHE_SIZE"] = "0"
+    for key, value in defaults.items():
+        os.environ[key] = value
+    from app.main import app
+
+    for handler in app.router.on_startup:
+        result = handler()
+        if asyncio.iscoroutine(result):
+            await result
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://auth.local", timeout=args.timeout
+    )
+
+
+async def _client(args: argparse.Namespace) -> httpx.AsyncClient:
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    return await _in_process_client(args)
+
+
+async def _register(client: httpx.AsyncClient, tag: str) -> Tuple[int, Optional[str]]:
+    response = await client.post(
+        "/auth/register",
+        json={"email": f"{tag}@loadtest.example.com", "password": "correct horse battery"},
+    )
+    token = response.json().get("access_token") if response.status_code == 200 else None
+    return response.status_code, token
+
+
+###############################################################################
+# Scenarios
+###############################################################################
+
+async def burst(args: argparse.Namespace) -> Dict[str, Any]:
+    run_id = uuid.uuid4().hex[:8]
+    async with await _client(args) as client:
+        status, token = await _register(client, f"probe-{run_id}")
+        if token is None:
+            raise SystemExit(f"Could not register the probe user (HTTP {status})")
+        headers = {"Authorization": f"Bearer {token}"}
+        phases: Dict[str, List[float]] = {"before": [], "during": [], "after": []}
+        errors = {"me": 0, "register": 0}
+        phase = "before"
+        done = asyncio.Event()
+
+        async def probe() -> None:
+            while not done.is_set():
+                started = time.perf_counter()
+                response = await client.get("/auth/me", headers=headers)
+                phases[phase].append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors["me"] += 1
+                await asyncio.sleep(args.probe_interval_ms / 1000.0)
+
+        register_samples: List[float] = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def register_one(index: int) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                status, _ = await _register(client, f"burst-{run_id}-{index}")
+                register_samples.append(time.perf_counter() - started)
+                if status != 200:
+                    errors["register"] += 1
+
+        probes = [asyncio.ensure_future(probe()) for _ in range(args.probes)]
+        await asyncio.sleep(args.baseline)
+        phase = "during"
+        burst_started = time.perf_counter()
+        await asyncio.gather(*(register_one(i) for i in range(args.registrations)))
+        burst_seconds = time.perf_counter() - burst_started
+        phase = "after"
+        await asyncio.sleep(args.baseline)
+        done.set()
+        await asyncio.gather(*probes)
+
+    report: Dict[str, Any] = {
+        "me": {name: summarize(samples, 1.0) for name, samples in phases.items()},
+        "register": summarize(register_samples, burst_seconds),
+        "errors": errors,
+    }
+    for metrics in report["me"].values():
+        metrics.pop("throughput_per_s", None)
+    return report
+
+
+async def me(args: argparse.Namespace) -> Dict[str, Any]:
+    run_id = uuid.uuid4().hex[:8]
+    async with await _client(args) as client:
+        tokens = []
+        for index in range(args.users):
+            status, token = await _register(client, f"me-{run_id}-{index}")
+            if token is None:
+                raise SystemExit(f"Could not register a user (HTTP {status})")
+            tokens.append(token)
+        samples: List[float] = []
+        errors = {"me": 0}
+        deadline = time.perf_counter() + args.duration
+
+        async def worker(index: int) -> None:
+            headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get("/auth/me", headers=headers)
+                samples.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors["me"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.clients)))
+        wall = time.perf_counter() - started
+    return {"me": {"all": summarize(samples, wall)}, "errors": errors}
+
+
+async def bulk_import(args: argparse.Namespace) -> Dict[str, Any]:
+    run_id = uuid.uuid4().hex[:8]
+    async with await _client(args) as client:
+        lines = ["email,password,full_name"]
+        lines += [
+            f"import-{run_id}-{i}@loadtest.example.com,correct horse battery,Student {i}"
+            for i in range(args.registrations)
+        ]
+        started = time.perf_counter()
+        response = await client.post(
+            "/auth/admin/users/import",
+            content="\n".join(lines).encode("utf-8"),
+            headers={"Content-Type": "text/csv", "X-Admin-Token": args.admin_token},
+        )
+        import_seconds = time.perf_counter() - started
+        if response.status_code != 200:
+            raise SystemExit(f"Import failed (HTTP {response.status_code}): {response.text[:200]}")
+        imported = response.json()
+
+        register_samples: List[float] = []
+        errors = {"register": 0}
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def register_one(index: int) -> None:
+            async with semaphore:
+                begun = time.perf_counter()
+                status, _ = await _register(client, f"register-{run_id}-{index}")
+                register_samples.append(time.perf_counter() - begun)
+                if status != 200:
+                    errors["register"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(register_one(i) for i in range(args.registrations)))
+        register_seconds = time.perf_counter() - started
+    return {
+        "import": {
+            "users": imported["created"],
+            "seconds": round(import_seconds, 3),
+            "users_per_s": round(imported["created"] / import_seconds, 1),
+            "failed_rows": imported["total"] - imported["created"],
+        },
+        "register": summarize(register_samples, register_seconds),
+        "errors": errors,
+    }
+
+
+SCENARIOS = {"burst": burst, "me": me, "import": bulk_import}
+
+
+def _print_table(scenario: str, report: Dict[str, Any]) -> None:
+    if scenario == "import":
+        imported, register = report["import"], report["register"]
+        print(
+            f"bulk import: {imported['users']} users in {imported['seconds']:.1f} s "
+            f"({imported['users_per_s']:.1f}/s, {imported['failed_rows']} rows not created)",
+            file=sys.stderr,
+        )
+        print(
+            f"/auth/register: {register.get('n', 0)} users at "
+            f"{register.get('throughput_per_s', 0.0):.1f}/s   errors: {report['errors']}",
+            file=sys.stderr,
+        )
+        return
+    header = ("series", "n", "p50 ms", "p95 ms", "p99 ms", "max ms")
+    print("{:<16} {:>7} {:>9} {:>9} {:>9} {:>9}".format(*header), file=sys.stderr)
+    rows = [(f"/auth/me {name}", m) for name, m in report["me"].items()]
+    if "register" in report:
+        rows.append(("register", report["register"]))
+    for name, m in rows:
+        if not m.get("n"):
+            continue
+        print(
+            f"{name:<16} {m['n']:>7} {m['p50_ms']:>9.1f} {m['p95_ms']:>9.1f} "
+            f"{m['p99_ms']:>9.1f} {m['max_ms']:>9.1f}",
+            file=sys.stderr,
+        )
+    if scenario == "burst":
+        rate = report["register"].get("throughput_per_s", 0.0)
+        print(f"registrations/s: {rate:.1f}   errors: {report['errors']}", file=sys.stderr)
+    else:
+        rate = report["me"]["all"].get("throughput_per_s", 0.0)
+        print(f"requests/s: {rate:.1f}   errors: {report['errors']}", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Study Buddy auth service load test")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS), help="Scenario to run")
+    parser.add_argument("--url", help="Base URL of a running server (default: in‑process)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per‑request timeout (s)")
+    parser.add_argument("--registrations", type=int, default=200, help="Registrations in the burst")
+    parser.add_argument("--concurrency", type=int, default=100, help="Concurrent registrations")
+    parser.add_argument("--probes", type=int, default=4, help="Concurrent /auth/me pollers")
+    parser.add_argument("--probe-interval-ms", type=float, default=20.0, help="Pause between polls")
+    parser.add_argument("--baseline", type=float, default=3.0, help="Quiet seconds before/after")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="In‑process BCRYPT_ROUNDS")
+    parser.add_argument("--hash-workers", type=int, default=2, help="In‑process hash workers")
+    parser.add_argument("--users", type=int, default=20, help="Accounts used by the me scenario")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent clients in the me scenario")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of the me scenario")
+    parser.add_argument("--database-url", help="In‑process DATABASE_URL (default: temporary SQLite)")
+    parser.add_argument("--no-user-cache", action="store_true", help="Disable the user cache")
+    parser.add_argument("--admin-token", default="load-test-admin", help="X-Admin-Token for import")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(SCENARIOS[args.scenario](args))
+    report["meta"] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "scenario": args.scenario,
+        "target": args.url or "in-process",
+        "arguments": {k: v for k, v in vars(args).items() if k not in {"url", "output", "admin_token"}},
+    }
+    _print_table(args.scenario, report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,27 @@ Key features:
   chunks and passes them to the generative model to provide a
   context‑aware answer.
 
+* **Metrics** – Every stage of the chat, ask, upload and summary
+  endpoints is timed into Prometheus histograms, and store sizes, session
+  counts and worker‑thread queue depths are exported as gauges.  Scrape
+  them from ``GET /metrics`` (see ``study_buddy_metrics.py``).  A sample
+  of requests can also be traced span by span to a local JSONL file (see
+  ``study_buddy_tracing.py``), and admins can capture sampling profiles
+  of single requests or of all traffic (see ``study_buddy_profiling.py``).
+
+* **Authentication** – When ``STUDY_BUDDY_JWT_KEY`` is set, requests must
+  carry a bearer token from the auth service in ``app/``.  Tokens are
+  verified locally with the shared key and cached once decoded, and the
+  ``user_id`` in a request must match the token's (see
+  ``study_buddy_auth.py``).
+
 * **Stateless design** – To keep the example simple, conversation
-  histories and note embeddings are stored in memory.  In a production
-  system you would persist these to a database and use a dedicated
-  vector store for retrieval.
+  histories and note embeddings are stored in memory.  Notes live in a
+  concurrency‑safe store that publishes immutable per‑user snapshots
+  (see ``study_buddy_store.py``).  In a production system you would
+  persist these to a database and use a dedicated vector store for
+  retrieval.  Under a memory budget, inactive users' notes are spilled
+  to disk and reloaded on demand.
 
 The endpoints defined here expect JSON payloads and return structured
 responses that can be consumed directly by a React front‑end.
@@ -44,14 +61,27 @@ responses that can be consumed directly by a React front‑end.
 
 from __future__ import annotations
 
+import asyncio
+import contextvars
+import hashlib
 import json
+import math
 import os
+import secrets
+import threading
+import time
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Iterator, Tuple
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Form
+import anyio
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Form, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
+from starlette.routing import Match
 
 try:
     from sqlmodel import SQLModel, Field, create_engine, Session, select  # type: ignore
@@ -63,9 +93,6 @@ except ImportError:
     select = None  # type: ignore
 
 # Third‑party libraries for AI functionality
-import google.generativeai as genai
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from dotenv import load_dotenv
 
@@ -73,6 +100,30 @@ from dotenv import load_dotenv
 import pdfplumber
 import docx2txt
 
+from study_buddy_auth import USER_ID_CLAIM, TokenError, TokenVerifier
+from study_buddy_coalescing import KeyReused, SingleFlight
+from study_buddy_llm import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    LLMDeadlineExceeded,
+    LLMError,
+    LLMUnavailableError,
+    load_llm_client,
+    load_llm_scheduler,
+)
+from study_buddy_memory import TracemallocTracker, deep_sizeof, model_memory, process_memory
+from study_buddy_metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram, StageTimer
+from study_buddy_inference import load_models
+from study_buddy_models import SharedTokenizer
+from study_buddy_profiling import PROFILE_HEADER, PROFILER_LOCK, ProfileStore, StackSampler
+from study_buddy_store import (
+    DEFAULT_RESCORE_CANDIDATES,
+    NoteStore,
+    QuotaExceededError,
+    validate_corpus_id,
+)
+from study_buddy_tracing import Tracer, record_span, span, tracing_active
+
 
 ###############################################################################
 # Configuration and initialisation
@@ -84,20 +135,27 @@ load_dotenv()
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
-if not GEMINI_API_KEY:
-    raise RuntimeError(
-        "Environment variable GEMINI_API_KEY is not set. "
-        "Make sure it's in your .env file."
-    )
-
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Use the flash model for low latency 
-    _generative_model = genai.GenerativeModel("models/gemini-2.5-flash") 
-    print("Gemini client configured successfully!")
-
-except Exception as e:
-    raise RuntimeError(f"Failed to initialise the Gemini client: {e}")
+# The generative model sits behind a small client interface.  By default this
+# is Gemini (the flash model, for low latency); STUDY_BUDDY_LLM=fake swaps in
+# a local stand‑in with configurable latency and failure rate so load tests
+# do not burn API quota.  See study_buddy_llm.py.
+_llm_client = load_llm_client(GEMINI_API_KEY)
+print(f"LLM client configured successfully ({_llm_client.name})!")
+
+# Every LLM call goes through the scheduler: an adaptive concurrency limit,
+# a priority queue (chat and questions ahead of summaries), jittered retries
+# of throttled calls and a circuit breaker.  Deadlines bound how long a
+# request may wait in total, retries included.
+_llm_scheduler = load_llm_scheduler(_llm_client)
+
+# Bearer tokens minted by the auth service (app/) are verified locally with
+# the shared signing key; the user id comes from the token's claims instead
+# of the request body.  Without STUDY_BUDDY_JWT_KEY requests are not
+# authenticated and the body's user_id is trusted, as in development and
+# load tests.  See study_buddy_auth.py.
+_token_verifier = TokenVerifier.from_env()
+CHAT_DEADLINE_S = float(os.environ.get("STUDY_BUDDY_CHAT_DEADLINE_S", "30"))
+SUMMARY_DEADLINE_S = float(os.environ.get("STUDY_BUDDY_SUMMARY_DEADLINE_S", "90"))
 
 # Initialise the emotion classification pipeline.  The model used here
 # (distilbert‑base‑uncased‑emotion) has been fine‑tuned on the Emotion
@@ -105,15 +163,42 @@ except Exception as e:
 # {sadness, joy, love, anger, fear, surprise}【570093660071415†L602-L633】) and
 # achieves competitive accuracy【696647717412394†L82-L97】.  Returning all
 # scores allows us to pick the highest‑scoring label.
-_emotion_classifier = pipeline(
-    "text-classification",
-    model="bhadresh-savani/distilbert-base-uncased-emotion",
-    top_k=None,
+#
+# Both models are loaded through study_buddy_models so that benchmarks and
+# load tests can set STUDY_BUDDY_STUB_MODELS=1 and run with deterministic
+# stand‑ins instead of downloading and running the real networks.
+#
+# When the local inference service is running (study_buddy_inference.py)
+# the worker uses its models over a Unix socket instead of loading its own
+# copy, so memory does not grow with the number of workers; concurrent
+# calls from all workers are batched by the service.
+_emotion_classifier, _embedding_model, _inference_client = load_models()
+if _inference_client is not None:
+    print(f"Using the inference service on {_inference_client.socket_path}")
+
+# Model inference runs on a dedicated thread pool so that a chat request can
+# classify its message and embed/search its notes at the same time, and so
+# the event loop stays free while the models work.  Each model is guarded by
+# a lock because Hugging Face fast tokenizers are not safe to call from two
+# threads at once; the classifier and the embedder still run in parallel.
+# Remote models need no lock: each thread has its own connection and the
+# service batches the calls.
+_inference_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("STUDY_BUDDY_INFERENCE_THREADS", "4")),
+    thread_name_prefix="study-buddy-inference",
 )
+_classifier_lock: Any = nullcontext() if _inference_client is not None else threading.Lock()
+_embedder_lock: Any = nullcontext() if _inference_client is not None else threading.Lock()
 
-# Initialise the sentence embedding model.  MiniLM provides a good
-# performance/quality trade‑off for semantic similarity tasks.
-_embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+# With STUDY_BUDDY_SHARED_TOKENIZATION=1 a message that is both classified
+# and embedded is tokenized once, provided both models use the same
+# vocabulary (see SharedTokenizer in study_buddy_models.py).
+_shared_tokenizer: Optional[SharedTokenizer] = None
+if os.environ.get("STUDY_BUDDY_SHARED_TOKENIZATION", "").lower() in {"1", "true", "yes"}:
+    _shared_tokenizer = SharedTokenizer(_emotion_classifier, _embedding_model)
+    if not _shared_tokenizer.compatible:
+        print("Shared tokenization disabled: the models use different vocabularies.")
+        _shared_tokenizer = None
 
 
 ###############################################################################
@@ -209,20 +294,282 @@ EMOTION_GUIDANCE: Dict[str, str] = {
     ),
 }
 
-# In‑memory storage for note embeddings.  Maps a user id to a list of
-# dictionaries with 'embedding' (NumPy array) and 'text' fields.
-_vector_store: Dict[int, List[Dict[str, Any]]] = {}
+# In‑memory storage for note embeddings.  Each user's notes are published as
+# an immutable snapshot (embedding matrix + texts) so that retrieval never
+# blocks on, or observes a half‑finished, upload.  See study_buddy_store.py.
+#
+# Optional tiering: with STUDY_BUDDY_NOTES_MEMORY_MB set, the least recently
+# used users are spilled to STUDY_BUDDY_NOTES_SPILL_DIR (a temporary directory
+# by default) once the resident notes exceed the budget, and reloaded on their
+# next retrieval.  STUDY_BUDDY_MAX_CHUNKS_PER_USER caps each user's notes.
+#
+# STUDY_BUDDY_EMBEDDING_PRECISION selects float32 (default), float16 or int8
+# storage for the embedding matrix.  Compact precisions rescore the best
+# STUDY_BUDDY_RESCORE_CANDIDATES first‑pass hits against float32 copies kept
+# on disk, so retrieval results stay the same while RAM drops 2–4×.
+_notes_memory_mb = os.environ.get("STUDY_BUDDY_NOTES_MEMORY_MB")
+_max_chunks_per_user = os.environ.get("STUDY_BUDDY_MAX_CHUNKS_PER_USER")
+_vector_store = NoteStore(
+    memory_budget_bytes=int(float(_notes_memory_mb) * 1024 * 1024) if _notes_memory_mb else None,
+    spill_dir=os.environ.get("STUDY_BUDDY_NOTES_SPILL_DIR") or None,
+    max_chunks_per_user=int(_max_chunks_per_user) if _max_chunks_per_user else None,
+    precision=os.environ.get("STUDY_BUDDY_EMBEDDING_PRECISION", "float32"),
+)
+_RESCORE_CANDIDATES = int(
+    os.environ.get("STUDY_BUDDY_RESCORE_CANDIDATES", DEFAULT_RESCORE_CANDIDATES)
+)
 
 # In‑memory conversation history.  Maps a session id (str) to a list of
 # messages, each message being a dict with 'text' and 'is_user'.  
 _conversation_history: Dict[str, List[Dict[str, Any]]] = {}
 
+# Sessions are append‑only, so a session's version is simply its number of
+# messages and the message at index i has version i + 1.  Clients send the
+# version they last saw instead of the whole conversation; a write based on
+# an old version, or made while another reply for the session is still
+# being generated, is rejected with 409 and the client fetches the missing
+# turns from /api/sessions/{id}/messages.
+_generating_sessions: Dict[str, int] = {}
+
+# The user whose first message created each session.  Session ids are
+# chosen by the client and easy to guess, so only the owner may extend or
+# read a conversation.
+_session_owners: Dict[str, int] = {}
+
+
+def _check_session_owner(session_id: str, user_id: int, claim: bool = False) -> None:
+    """Raise 403 unless ``user_id`` owns the session.
+
+    Args:
+        session_id: The conversation being accessed.
+        user_id: The requesting user.
+        claim: Make ``user_id`` the owner of a session that has none yet.
+    """
+    owner = _session_owners.setdefault(session_id, user_id) if claim else _session_owners.get(session_id)
+    if owner is not None and owner != user_id:
+        raise HTTPException(status_code=403, detail="Session belongs to another user")
+
+
+def _session_turns(session_id: str, start: int, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Return messages ``start`` to ``stop`` (exclusive) with their versions."""
+    messages = _conversation_history.get(session_id, [])
+    return [
+        {"version": version, **message}
+        for version, message in enumerate(messages[start:stop], start=start + 1)
+    ]
+
+
+def _check_base_version(session_id: str, base_version: Optional[int]) -> List[Dict[str, Any]]:
+    """Return the session's history, or raise 409 if ``base_version`` is stale."""
+    conversation = _conversation_history.setdefault(session_id, [])
+    if base_version is None:
+        return conversation
+    if base_version != len(conversation) or _generating_sessions.get(session_id):
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Session has changed; fetch the new turns and retry",
+                "version": len(conversation),
+            },
+        )
+    return conversation
+
+
+@contextmanager
+def _generating(session_id: str) -> Iterator[None]:
+    """Mark a reply for ``session_id`` as in progress."""
+    _generating_sessions[session_id] = _generating_sessions.get(session_id, 0) + 1
+    try:
+        yield
+    finally:
+        _generating_sessions[session_id] -= 1
+        if not _generating_sessions[session_id]:
+            del _generating_sessions[session_id]
+
+# Duplicate messages (double clicks, client retries) are coalesced: a
+# request identical to one still being answered for the same session waits
+# for it and shares its reply, so the LLM is called and the history updated
+# once.  Requests carrying an ``Idempotency-Key`` header also replay their
+# reply for STUDY_BUDDY_IDEMPOTENCY_TTL_S seconds after it completes; the
+# key is scoped to the user and reusing it with a different body is a 422.
+_inflight_replies = SingleFlight(ttl=float(os.environ.get("STUDY_BUDDY_IDEMPOTENCY_TTL_S", "600")))
+
+
+def _coalescing_key(
+    endpoint: str, session_id: str, user_id: int, idempotency_key: Optional[str], *fields: Any
+) -> Tuple[Tuple[str, str, int, str], str]:
+    """Key duplicates by idempotency key if given, else by content hash.
+
+    Returns the key and the hash of the request body it was made for.
+    """
+    digest = hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+    if idempotency_key:
+        return (endpoint, session_id, user_id, "key:" + idempotency_key), digest
+    return (endpoint, session_id, user_id, "sha256:" + digest), digest
+
+
+async def _coalesce(
+    key: Tuple[str, str, int, str],
+    digest: str,
+    respond: Callable[[], Awaitable[Any]],
+    remember: bool,
+) -> Any:
+    """Run ``respond`` through ``_inflight_replies``; 422 on a reused key."""
+    try:
+        response, _ = await _inflight_replies.run(key, respond, remember=remember, fingerprint=digest)
+    except KeyReused:
+        raise HTTPException(
+            status_code=422, detail="Idempotency-Key was already used for a different request"
+        )
+    return response
+
+
+###############################################################################
+# Metrics
+###############################################################################
+
+# Per‑stage latency.  A middleware times every request under its route path
+# and endpoints wrap each step in ``_stage(name)``; helpers such as
+# retrieve_context pick up the calling endpoint from a context variable, so
+# the same stage name ("search", "generate") is reported per endpoint.
+_timer = StageTimer(
+    Histogram(
+        "study_buddy_request_seconds",
+        "End-to-end latency of Study Buddy API requests.",
+        ["endpoint"],
+    ),
+    Histogram(
+        "study_buddy_stage_seconds",
+        "Latency of individual stages within Study Buddy API requests.",
+        ["endpoint", "stage"],
+    ),
+)
+
+
+# Note store statistics are read from NoteStore.stats() at scrape time.
+_STORE_METRICS: List[Tuple[str, Any, str, str]] = [
+    ("resident_bytes", Gauge, "study_buddy_notes_resident_bytes",
+     "Bytes of note snapshots held in memory."),
+    ("resident_users", Gauge, "study_buddy_notes_resident_owners",
+     "Users and shared corpora with notes in memory."),
+    ("resident_chunks", Gauge, "study_buddy_notes_resident_chunks",
+     "Note chunks held in memory."),
+    ("cold_users", Gauge, "study_buddy_notes_cold_owners",
+     "Users and shared corpora with notes spilled to disk."),
+    ("shared_corpora", Gauge, "study_buddy_notes_shared_corpora",
+     "Shared note corpora in the store."),
+    ("corpus_subscriptions", Gauge, "study_buddy_notes_corpus_subscriptions",
+     "Subscriptions to shared corpora."),
+    ("evictions", Counter, "study_buddy_notes_evictions_total",
+     "Note snapshots spilled to disk."),
+    ("cold_loads", Counter, "study_buddy_notes_cold_loads_total",
+     "Note snapshots reloaded from disk."),
+    ("cold_load_seconds_total", Counter, "study_buddy_notes_cold_load_seconds_total",
+     "Time spent reloading notes from disk."),
+]
+for _stat, _kind, _name, _help in _STORE_METRICS:
+    _kind(_name, _help).set_function(lambda stat=_stat: _vector_store.stats()[stat])
+
+Gauge("study_buddy_sessions", "Conversation sessions held in memory.").set_function(
+    lambda: len(_conversation_history)
+)
+Gauge("study_buddy_session_messages", "Messages across all in-memory conversations.").set_function(
+    lambda: sum(len(messages) for messages in list(_conversation_history.values()))
+)
+Counter(
+    "study_buddy_coalesced_requests_total",
+    "Duplicate chat requests answered from another request's reply.",
+    ["outcome"],
+).set_function(
+    lambda: {
+        ("shared",): _inflight_replies.counters["shared"],
+        ("replayed",): _inflight_replies.counters["replayed"],
+    }
+)
+# Worker‑thread occupancy.  Sync endpoints run on AnyIO's default thread
+# limiter; requests beyond its capacity queue up as waiters.  Updated by the
+# /metrics handler itself because the limiter belongs to the event loop.
+_threadpool_gauge = Gauge(
+    "study_buddy_threadpool_tasks",
+    "Worker threads in use and tasks waiting for one.",
+    ["state"],
+)
+_inference_gauge = Gauge(
+    "study_buddy_inference_pool_tasks",
+    "Model calls running on, or queued for, the inference pool.",
+    ["state"],
+)
+
+# LLM scheduler state, read from _llm_scheduler.stats() at scrape time.
+Gauge("study_buddy_llm_concurrency_limit", "Current adaptive LLM concurrency limit.").set_function(
+    lambda: _llm_scheduler.limiter.limit
+)
+Gauge("study_buddy_llm_in_flight", "LLM calls currently running.").set_function(
+    lambda: _llm_scheduler.in_flight
+)
+Gauge("study_buddy_llm_queued", "LLM calls waiting for a slot.", ["priority"]).set_function(
+    lambda: {
+        ("interactive",): _llm_scheduler.queued(PRIORITY_INTERACTIVE),
+        ("batch",): _llm_scheduler.queued(PRIORITY_BATCH),
+    }
+)
+Gauge(
+    "study_buddy_llm_circuit_open", "1 while the LLM circuit breaker rejects calls."
+).set_function(lambda: _llm_scheduler.breaker.state != "closed")
+Counter("study_buddy_llm_calls_total", "LLM scheduler calls by outcome.", ["outcome"]).set_function(
+    lambda: {
+        (outcome,): _llm_scheduler.counters[outcome]
+        for outcome in (
+            "succeeded",
+            "failed",
+            "deadline_exceeded",
+            "circuit_rejected",
+            "queue_rejected",
+        )
+    }
+)
+Counter("study_buddy_llm_retries_total", "LLM calls retried after throttling.").set_function(
+    lambda: _llm_scheduler.counters["retries"]
+)
+Counter("study_buddy_llm_throttled_total", "LLM attempts throttled by the provider.").set_function(
+    lambda: _llm_scheduler.counters["throttled"]
+)
+Counter(
+    "study_buddy_llm_queue_wait_seconds_total", "Time LLM calls spent waiting for a slot."
+).set_function(lambda: _llm_scheduler.queue_wait_seconds_total)
+
+if _token_verifier is not None:
+    Counter(
+        "study_buddy_auth_tokens_total",
+        "Bearer tokens checked, by result (hit = served from the decoded-token cache).",
+        ["result"],
+    ).set_function(lambda: {(result,): n for result, n in _token_verifier.counters.items()})
+
+# Per‑request span tracing, off unless STUDY_BUDDY_TRACE_SAMPLE_RATE is set.
+# Every stage is both a histogram observation and, on sampled requests, a
+# span carrying attributes such as chunk counts and prompt sizes.  Inspect
+# the trace file with ``python study_buddy_tracing.py``.
+_tracer = Tracer.from_env(service="study-buddy")
+
+
+@contextmanager
+def _stage(name: str, **attributes: Any) -> Iterator[Any]:
+    """Time a stage into the stage histogram and the request's trace."""
+    with _timer.stage(name), span(name, **attributes) as stage_span:
+        yield stage_span
+
+
+def _record_stage(name: str, started: float, **attributes: Any) -> None:
+    """Record a stage timed by hand from ``started`` (a perf_counter value)."""
+    _timer.record(name, time.perf_counter() - started)
+    record_span(name, started, **attributes)
+
 
 ###############################################################################
 # Utility functions
 ###############################################################################
 
-def classify_emotion(text: str) -> str:
+def classify_emotion(text: str, tokens: Any = None) -> str:
     """Classify the predominant emotion in a piece of text.
 
     The classifier returns a list of label/score pairs.  We select the label
@@ -230,12 +577,17 @@ def classify_emotion(text: str) -> str:
 
     Args:
         text: The input string.
+        tokens: Optional output of ``_shared_tokenizer.encode(text)``.
 
     Returns:
         The predicted emotion label as a lower‑case string.
     """
     try:
-        predictions = _emotion_classifier(text)
+        with _classifier_lock:
+            if tokens is not None and _shared_tokenizer is not None:
+                predictions = [_shared_tokenizer.classify(tokens)]
+            else:
+                predictions = _emotion_classifier(text)
         # predictions is a list of one item since return_all_scores=True
         if not predictions:
             return "joy"
@@ -248,7 +600,7 @@ def classify_emotion(text: str) -> str:
         return "joy"
 
 
-def embed_text(text: str) -> np.ndarray:
+def embed_text(text: str, tokens: Any = None) -> np.ndarray:
     """Compute a sentence embedding for the given text.
 
     Uses the MiniLM model to encode the text into a high dimensional vector.  The
@@ -256,47 +608,187 @@ def embed_text(text: str) -> np.ndarray:
 
     Args:
         text: The input text.
+        tokens: Optional output of ``_shared_tokenizer.encode(text)``.
 
     Returns:
         A numpy array representing the embedding.
     """
-    # The embedding model expects a list of sentences and returns a list
-    embedding = _embedding_model.encode([text], convert_to_numpy=True)[0]
+    with _embedder_lock:
+        if tokens is not None and _shared_tokenizer is not None:
+            embedding = _shared_tokenizer.embed(tokens)
+        else:
+            # The embedding model expects a list of sentences and returns a list
+            embedding = _embedding_model.encode([text], convert_to_numpy=True)[0]
     # Normalise the embedding for cosine similarity
     norm = np.linalg.norm(embedding)
     return embedding / norm if norm > 0 else embedding
 
 
-def retrieve_context(user_id: int, question: str, k: int = 3) -> List[str]:
+def embed_texts(texts: List[str]) -> List[np.ndarray]:
+    """Compute normalised embeddings for several texts in one model call.
+
+    With the inference service this is a single round trip, batched with
+    other workers' calls.
+
+    Args:
+        texts: The input texts.
+
+    Returns:
+        One normalised embedding per text.
+    """
+    if not texts:
+        return []
+    with _embedder_lock:
+        matrix = np.asarray(_embedding_model.encode(list(texts), convert_to_numpy=True))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return list(matrix / np.where(norms > 0, norms, 1.0))
+
+
+# Notes are split into chunks of roughly this many words before embedding.
+CHUNK_SIZE_WORDS = 500
+
+
+def chunk_text(
+    text: str,
+    word_pages: Optional[List[int]] = None,
+    chunk_size: int = CHUNK_SIZE_WORDS,
+) -> Tuple[List[str], List[int]]:
+    """Split extracted note text into chunks of ``chunk_size`` words.
+
+    Args:
+        text: The full text of the document.
+        word_pages: Optional page number of every word in ``text.split()``.
+        chunk_size: Number of words per chunk.
+
+    Returns:
+        The non‑empty chunks and, aligned with them, the page each chunk's
+        first word came from (``-1`` when ``word_pages`` is not given).
+    """
+    words = text.split()
+    chunks: List[str] = []
+    pages: List[int] = []
+    for i in range(0, len(words), chunk_size):
+        chunk = " ".join(words[i : i + chunk_size])
+        if not chunk.strip():
+            continue
+        chunks.append(chunk)
+        pages.append(word_pages[i] if word_pages is not None else -1)
+    return chunks, pages
+
+
+def _has_notes(user_id: int) -> bool:
+    return bool(len(_vector_store.snapshot(user_id)) or _vector_store.subscriptions(user_id))
+
+
+def retrieve_context(user_id: int, question: str, k: int = 3, tokens: Any = None) -> List[str]:
     """Retrieve the most relevant note chunks for a question.
 
     Computes the embedding of the question and compares it to all stored
-    embeddings for the user.  Returns the texts of the top‑`k` matches.
+    embeddings for the user, including the shared corpora they subscribe
+    to.  Returns the texts of the top‑`k` matches.
 
     Args:
-        user_id: Identifier of the user.  Only their notes are considered.
+        user_id: Identifier of the user.  Only their notes and subscribed
+            corpora are considered.
         question: The query string for which context is needed.
         k: Number of top passages to return.
+        tokens: Optional output of ``_shared_tokenizer.encode(question)``.
 
     Returns:
         A list of `k` text passages sorted by similarity.
     """
-    notes = _vector_store.get(user_id, [])
-    if not notes:
+    # Check for notes before paying for the question embedding
+    if not _has_notes(user_id):
         return []
-    question_embedding = embed_text(question)
-    similarities = []
-    for entry in notes:
-        # Compute dot product since embeddings are normalised
-        score = float(np.dot(question_embedding, entry["embedding"]))
-        similarities.append((score, entry["text"]))
-    # Sort by similarity descending and take top k
-    similarities.sort(key=lambda x: x[0], reverse=True)
-    top_passages = [text for _, text in similarities[:k]]
+    with _stage("embed_query", chars=len(question)):
+        question_embedding = embed_text(question, tokens)
+    # Each visible snapshot is scored as a whole matrix (embeddings are
+    # normalised) and the per‑snapshot results are merged.  Concurrent
+    # uploads publish new snapshots rather than mutating these ones.
+    with _stage("search", k=k, candidates=_RESCORE_CANDIDATES) as search_span:
+        matches = _vector_store.search(
+            user_id, question_embedding, k, candidates=_RESCORE_CANDIDATES
+        )
+        # Only the winning chunks are decoded from the snapshots' text arenas
+        top_passages = [snapshot.text(row) for _, snapshot, row in matches]
+        if tracing_active():
+            search_span.set(
+                chunks=sum(len(view) for view in _vector_store.views(user_id)),
+                hits=len(matches),
+                context_chars=sum(len(p) for p in top_passages),
+            )
     return top_passages
 
 
-def generate_reply(
+async def run_inference(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking model call on the inference pool.
+
+    The caller's context (current endpoint for metrics, current trace span)
+    is copied into the worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    _inference_gauge.inc(state="queued")
+
+    def run() -> Any:
+        _inference_gauge.dec(state="queued")
+        _inference_gauge.inc(state="running")
+        try:
+            return context.run(func, *args)
+        finally:
+            _inference_gauge.dec(state="running")
+
+    return await loop.run_in_executor(_inference_pool, run)
+
+
+def _classify_stage(text: str, tokens: Any = None) -> str:
+    with _stage("classify", chars=len(text), shared_tokens=tokens is not None) as classify_span:
+        emotion = classify_emotion(text, tokens)
+        classify_span.set(emotion=emotion)
+        return emotion
+
+
+def _shared_encode(text: str) -> Any:
+    # The shared tokenizer is the classifier's, so it takes the same lock
+    with _classifier_lock:
+        return _shared_tokenizer.encode(text)
+
+
+async def analyze_message(
+    user_id: int, text: str, use_notes: bool
+) -> Tuple[str, Optional[List[str]]]:
+    """Detect the emotion of a message and, optionally, retrieve note context.
+
+    The two are independent, so they run concurrently on the inference
+    pool and are joined before the prompt is built.  With shared
+    tokenization the message is tokenized once for both models first.
+
+    Args:
+        user_id: The user whose notes are searched.
+        text: The student's message or question.
+        use_notes: Whether to retrieve note passages.
+
+    Returns:
+        The emotion label and the retrieved passages (``None`` when
+        ``use_notes`` is false).
+    """
+    with _stage("analyze", use_notes=use_notes):
+        # The store may take a writer's lock or load spilled notes from disk
+        if not use_notes or not await run_inference(_has_notes, user_id):
+            emotion = await run_inference(_classify_stage, text)
+            return emotion, ([] if use_notes else None)
+        tokens = None
+        if _shared_tokenizer is not None:
+            with _stage("tokenize", chars=len(text)):
+                tokens = await run_inference(_shared_encode, text)
+        emotion, passages = await asyncio.gather(
+            run_inference(_classify_stage, text, tokens),
+            run_inference(retrieve_context, user_id, text, 3, tokens),
+        )
+        return emotion, passages
+
+
+async def generate_reply(
     user_message: str,
     personality_mode: str,
     conversation: List[Dict[str, Any]],
@@ -307,7 +799,8 @@ def generate_reply(
 
     This helper builds a prompt that includes the personality description,
     emotion guidance, optional context from notes, and the conversation history.
-    It then calls the Gemini model to produce a natural response.
+    It then calls the Gemini model, through the scheduler at interactive
+    priority, to produce a natural response.
 
     Args:
         user_message: The latest message from the student.
@@ -319,7 +812,11 @@ def generate_reply(
 
     Returns:
         The generated response text.
+
+    Raises:
+        LLMError: If the model fails or cannot answer before the deadline.
     """
+    prompt_started = time.perf_counter()
     personality = PERSONALITY_MODES.get(personality_mode, PERSONALITY_MODES["1"])
     # Build conversation context string
     recent_history = conversation[-10:] if len(conversation) > 10 else conversation
@@ -352,12 +849,20 @@ def generate_reply(
         f"Maintain continuity of the conversation while being informative and educational."
         f"{note_context}"
     )
-    # Generate response using Gemini
-    try:
-        response = _generative_model.generate_content(full_prompt)
-        return response.text
-    except Exception as e:
-        return f"Error generating response: {e}"
+    _record_stage(
+        "prompt",
+        prompt_started,
+        history_messages=len(recent_history),
+        passages=len(context_passages or []),
+        prompt_chars=len(full_prompt),
+    )
+    # Generate response using the configured LLM client (Gemini by default)
+    with _stage("generate", llm=_llm_client.name, prompt_chars=len(full_prompt)) as gen_span:
+        reply = await _llm_scheduler.generate(
+            full_prompt, priority=PRIORITY_INTERACTIVE, timeout=CHAT_DEADLINE_S
+        )
+        gen_span.set(reply_chars=len(reply))
+        return reply
 
 
 ###############################################################################
@@ -383,6 +888,145 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(LLMError)
+async def llm_error_handler(request: Request, exc: LLMError) -> JSONResponse:
+    """Report LLM failures as HTTP errors instead of as reply text.
+
+    Overload (circuit open, queue full, retries exhausted) is a 503 with a
+    Retry-After header, a missed deadline is a 504 and any other model
+    failure is a 502.
+    """
+    if isinstance(exc, LLMDeadlineExceeded):
+        status_code = 504
+    elif isinstance(exc, LLMUnavailableError):
+        status_code = 503
+    else:
+        status_code = 502
+    headers = {}
+    if isinstance(exc, LLMUnavailableError):
+        headers["Retry-After"] = str(max(1, math.ceil(exc.retry_after)))
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": f"Failed to generate response: {exc}"},
+        headers=headers,
+    )
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next: Any) -> Any:
+    """Time each request and label its stages with the route path."""
+    with _timer.endpoint(_route_label(request.scope)):
+        return await call_next(request)
+
+
+def _route_label(scope: Dict[str, Any]) -> str:
+    # Match the way the router will, so parameterised routes are labelled
+    # by their template; unknown paths share one label so scanners cannot
+    # blow up cardinality
+    label = "other"
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and label == "other":
+            label = route.path
+    return label
+
+
+# Opt‑in sampling profiles.  A request with ``X-Study-Buddy-Profile: 1`` and
+# a valid ``X-Admin-Token`` (or any request while an admin has armed
+# profiling) runs under a stack sampler; the response carries the id of a
+# collapsed‑stack profile that can be fetched from /admin/profiles/{id}.
+_profiles = ProfileStore(directory=os.environ.get("STUDY_BUDDY_PROFILE_DIR") or None)
+_profile_armed = 0
+_profile_armed_lock = threading.Lock()
+
+
+def _take_armed_profile() -> bool:
+    global _profile_armed
+    with _profile_armed_lock:
+        if _profile_armed <= 0:
+            return False
+        _profile_armed -= 1
+        return True
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next: Any) -> Any:
+    """Sample the stacks of a request when asked to, and report the profile id."""
+    requested = request.headers.get(PROFILE_HEADER, "") in {"1", "true", "yes"}
+    if requested and not _is_admin(request.headers.get("x-admin-token")):
+        requested = False
+    if not (requested or _take_armed_profile()):
+        return await call_next(request)
+    if not PROFILER_LOCK.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers["X-Study-Buddy-Profile-Status"] = "busy"
+        return response
+    try:
+        sampler = StackSampler().start()
+        try:
+            response = await call_next(request)
+        finally:
+            await anyio.to_thread.run_sync(sampler.stop)
+    finally:
+        PROFILER_LOCK.release()
+    label = request.url.path.strip("/").replace("/", "_") or "root"
+    response.headers["X-Study-Buddy-Profile-Id"] = _profiles.add(sampler.collapsed(), label)
+    response.headers["X-Study-Buddy-Profile-Samples"] = str(sampler.samples)
+    return response
+
+
+# Registered last so it is the outermost middleware and its root span covers
+# the whole request
+app.middleware("http")(_tracer.middleware)
+
+
+async def authenticated_user(authorization: Optional[str] = Header(None)) -> Optional[int]:
+    """FastAPI dependency returning the user id from the bearer token.
+
+    The token is verified locally (see ``study_buddy_auth.py``); a repeat
+    token is a cache lookup.  Declared ``async`` so the check runs on the
+    event loop rather than costing a threadpool hop.
+
+    Returns:
+        The ``uid`` claim of a valid token, or ``None`` when token
+        verification is not configured.
+
+    Raises:
+        HTTPException: 401 if the token is missing, invalid, expired or
+            does not carry a user id.
+    """
+    if _token_verifier is None:
+        return None
+    challenge = {"WWW-Authenticate": "Bearer"}
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise HTTPException(status_code=401, detail="Not authenticated", headers=challenge)
+    try:
+        claims = _token_verifier.verify(token.strip())
+    except TokenError as exc:
+        raise HTTPException(status_code=401, detail=str(exc), headers=challenge) from exc
+    user_id = claims.get(USER_ID_CLAIM)
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise HTTPException(status_code=401, detail="Token does not identify a user", headers=challenge)
+    return user_id
+
+
+def _authorize(authenticated: Optional[int], user_id: int) -> None:
+    """Reject requests acting for a user other than the token's."""
+    if authenticated is not None and authenticated != user_id:
+        raise HTTPException(status_code=403, detail="user_id does not match the bearer token")
+
+
+class ChatTurn(BaseModel):
+    """One message of a conversation and the session version it created."""
+
+    version: int
+    text: str
+    is_user: bool
+
+
 class ChatRequest(BaseModel):
     """Schema for chat requests."""
 
@@ -391,63 +1035,104 @@ class ChatRequest(BaseModel):
     message: str
     personality_mode: str = "1"
 
-    # The front‑end can optionally send the conversation history; if not
-    # provided the server will use what it has stored for this session.
-    conversation: Optional[List[Dict[str, Any]]] = None
+    # The session version the client last saw.  The server keeps the
+    # conversation; the client only sends the new message.  If set and out
+    # of date the request is rejected with 409.
+    base_version: Optional[int] = None
     # If provided and true, ask the model to consult uploaded notes.
     use_notes: bool = False
 
 
 class ChatResponse(BaseModel):
-    """Schema for chat responses."""
+    """Schema for chat responses.
+
+    ``turns`` holds every message after the request's ``base_version`` (or
+    just the new message and reply), and ``version`` is the new session
+    version.
+    """
 
     reply: str
     emotion: str
     session_id: str
+    version: int
+    turns: List[ChatTurn]
 
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(payload: ChatRequest) -> ChatResponse:
+async def chat_endpoint(
+    payload: ChatRequest,
+    idempotency_key: Optional[str] = Header(None),
+    user: Optional[int] = Depends(authenticated_user),
+) -> ChatResponse:
     """Handle a chat message from the front‑end.
 
     Steps:
     1. Retrieve or initialise the conversation history for the given session.
-    2. Detect the emotional state of the student's message.
-    3. Optionally retrieve relevant note passages for the user.
-    4. Generate a reply using the selected persona and context.
-    5. Store the message and response in the session history.
+    2. Detect the emotional state of the student's message and, if
+       requested, retrieve relevant note passages for the user (concurrently).
+    3. Generate a reply using the selected persona and context.
+    4. Store the message and response in the session history.
+
+    A duplicate of a message that is still being answered for the same
+    session (same content, or same ``Idempotency-Key`` header) does not
+    repeat these steps; it receives the reply of the first request.
 
     Args:
         payload: Parsed request body containing user id, session id, message,
-            personality mode and optional conversation history.
+            personality mode and optionally the last seen session version.
+        idempotency_key: Optional client‑chosen key identifying retries of
+            the same message.
+        user: User id from the bearer token, if tokens are verified; it
+            must match ``payload.user_id``.
 
     Returns:
         A ChatResponse containing the AI's reply and the detected emotion.
     """
-    # Retrieve or create conversation history
-    conversation = payload.conversation or _conversation_history.get(payload.session_id, [])
-    # Append the new user message to the history
-    conversation.append({"text": payload.message, "is_user": True})
-    # Detect emotion
-    emotion = classify_emotion(payload.message)
-    # If requested, retrieve relevant note passages
-    context_passages: Optional[List[str]] = None
-    if payload.use_notes:
-        context_passages = retrieve_context(payload.user_id, payload.message)
-    # Generate the reply
-    reply = generate_reply(
-        user_message=payload.message,
-        personality_mode=payload.personality_mode,
-        conversation=conversation,
-        emotion=emotion,
-        context_passages=context_passages,
+    _authorize(user, payload.user_id)
+    _check_session_owner(payload.session_id, payload.user_id, claim=True)
+
+    async def respond() -> ChatResponse:
+        # Retrieve or create conversation history
+        conversation = _check_base_version(payload.session_id, payload.base_version)
+        user_turn = {"text": payload.message, "is_user": True}
+        with _generating(payload.session_id):
+            # Detect emotion and, if requested, retrieve relevant note
+            # passages; the two run concurrently
+            emotion, context_passages = await analyze_message(
+                payload.user_id, payload.message, payload.use_notes
+            )
+            # Generate the reply
+            reply = await generate_reply(
+                user_message=payload.message,
+                personality_mode=payload.personality_mode,
+                conversation=conversation + [user_turn],
+                emotion=emotion,
+                context_passages=context_passages,
+            )
+        # Record the message and the reply together, only once there is one
+        conversation.extend([user_turn, {"text": reply, "is_user": False}])
+        version = len(conversation)
+        start = version - 2 if payload.base_version is None else payload.base_version
+        # Return structured response
+        return ChatResponse(
+            reply=reply,
+            emotion=emotion,
+            session_id=payload.session_id,
+            version=version,
+            turns=_session_turns(payload.session_id, start),
+        )
+
+    key, digest = _coalescing_key(
+        "chat",
+        payload.session_id,
+        payload.user_id,
+        idempotency_key,
+        payload.message,
+        payload.personality_mode,
+        payload.use_notes,
+        payload.base_version,
     )
-    # Append AI response to history
-    conversation.append({"text": reply, "is_user": False})
-    # Save conversation back to memory
-    _conversation_history[payload.session_id] = conversation
-    # Return structured response
-    return ChatResponse(reply=reply, emotion=emotion, session_id=payload.session_id)
+    return await _coalesce(key, digest, respond, remember=bool(idempotency_key))
 
 
 class NoteUploadResponse(BaseModel):
@@ -459,6 +1144,9 @@ class NoteUploadResponse(BaseModel):
 async def upload_notes(
     user_id: int = Form(...),
     file: UploadFile = File(...),
+    corpus_id: Optional[str] = Form(None),
+    user: Optional[int] = Depends(authenticated_user),
+    x_admin_token: Optional[str] = Header(None),
 ) -> NoteUploadResponse:
     """Upload study notes for later retrieval.
 
@@ -466,21 +1154,57 @@ async def upload_notes(
     split into chunks of around 500 words and stored as embeddings in the
     in‑memory vector store.  For large files this endpoint may take a while.
 
+    When ``corpus_id`` is given (e.g. a class code) the notes go into a
+    shared corpus and the user is subscribed to it once they are stored.
+    Only the corpus's owner (the user whose upload created it) or an admin
+    may add documents; anyone else gets 403.  If the same file was already
+    uploaded to that corpus, it is not parsed or embedded again and the
+    user is simply subscribed.
+
     Args:
         user_id: The id of the user uploading the notes.
         file: The uploaded file (multipart/form-data).
+        corpus_id: Optional shared corpus to store the notes in.
+        user: User id from the bearer token, if tokens are verified.
+        x_admin_token: The admin token, to write to another user's corpus.
 
     Returns:
         A NoteUploadResponse indicating how many chunks were stored.
     """
+    _authorize(user, user_id)
     # Read file contents
-    contents = await file.read()
+    with _stage("read") as read_span:
+        contents = await file.read()
+        read_span.set(bytes=len(contents))
     if not contents:
         raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    content_hash: Optional[str] = None
+    if corpus_id is not None:
+        try:
+            validate_corpus_id(corpus_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        content_hash = hashlib.sha256(contents).hexdigest()
+        if _vector_store.has_document(corpus_id, content_hash):
+            # Nothing is written, so any user may subscribe this way
+            _vector_store.subscribe(user_id, corpus_id)
+            return NoteUploadResponse(
+                message=f"Subscribed user {user_id} to shared notes '{corpus_id}'",
+                num_chunks=0,
+            )
+        # None lets an admin write to any corpus; otherwise the store checks
+        # (and, for a new corpus, claims) ownership
+        corpus_writer: Optional[int] = None if _is_admin(x_admin_token) else user_id
+        owner = _vector_store.corpus_owner(corpus_id)
+        if corpus_writer is not None and owner is not None and owner != corpus_writer:
+            raise HTTPException(status_code=403, detail="Only the corpus owner can add notes to it")
     # Determine file type by extension
     filename = file.filename or ""
     ext = os.path.splitext(filename.lower())[1]
     text: str = ""
+    # Page number of every word, when the source has pages (PDF only)
+    word_pages: Optional[List[int]] = None
+    parse_started = time.perf_counter()
     try:
         import tempfile
         if ext in {".pdf"}:
@@ -492,6 +1216,11 @@ async def upload_notes(
             with pdfplumber.open(tmp_path) as pdf:
                 pages = [page.extract_text() or "" for page in pdf.pages]
                 text = "\n".join(pages)
+            word_pages = [
+                page_number
+                for page_number, page_text in enumerate(pages, start=1)
+                for _ in page_text.split()
+            ]
             os.unlink(tmp_path)
         elif ext in {".docx", ".doc"}:
             # Extract text from DOCX using docx2txt
@@ -506,86 +1235,213 @@ async def upload_notes(
             text = contents.decode("utf-8", errors="ignore")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to parse file: {e}")
-    # Split text into chunks of roughly 500 words
-    words = text.split()
-    chunk_size = 500
-    chunks = [
-        " ".join(words[i : i + chunk_size])
-        for i in range(0, len(words), chunk_size)
-    ]
-    # Compute embeddings and store them
-    stored = []
-    for chunk in chunks:
-        if not chunk.strip():
-            continue
-        embedding = embed_text(chunk)
-        stored.append({"embedding": embedding, "text": chunk})
-    # Extend existing entries or create new list
-    user_notes = _vector_store.get(user_id, [])
-    user_notes.extend(stored)
-    _vector_store[user_id] = user_notes
+    _record_stage("parse", parse_started, ext=ext, chars=len(text))
+    # Split text into chunks of roughly 500 words, each tagged with the page
+    # its first word came from
+    with _stage("chunk") as chunk_span:
+        stored, pages = chunk_text(text, word_pages)
+        chunk_span.set(chunks=len(stored))
+    # Compute embeddings on the inference pool; the embedder lock must not
+    # be taken on the event loop
+    with _stage("embed", chunks=len(stored)):
+        embeddings = await run_inference(embed_texts, stored)
+    if corpus_id is not None:
+        try:
+            with _stage("store", chunks=len(stored), corpus_id=corpus_id):
+                await run_inference(
+                    partial(
+                        _vector_store.append_corpus,
+                        corpus_id,
+                        embeddings,
+                        stored,
+                        pages=pages,
+                        content_hash=content_hash,
+                        writer=corpus_writer,
+                    )
+                )
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        # Subscribe only once the notes are stored, so a failed upload
+        # leaves no subscription behind
+        _vector_store.subscribe(user_id, corpus_id)
+        return NoteUploadResponse(
+            message=f"Stored {len(stored)} chunks in shared notes '{corpus_id}'",
+            num_chunks=len(stored),
+        )
+    # Publish the new chunks atomically under the user's writer lock.  Like
+    # the embedding this runs on the pool: with tiering an append can copy
+    # the matrix, write the rescoring file and spill or load other notes
+    try:
+        with _stage("store", chunks=len(stored)):
+            await run_inference(
+                partial(_vector_store.append, user_id, embeddings, stored, pages=pages)
+            )
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     return NoteUploadResponse(
         message=f"Stored {len(stored)} chunks for user {user_id}",
         num_chunks=len(stored),
     )
 
 
+class CorpusSubscription(BaseModel):
+    user_id: int
+    corpus_id: str
+
+
+class CorpusSubscriptionResponse(BaseModel):
+    corpus_id: str
+    subscribers: int
+
+
+@app.post("/api/notes/corpora/unsubscribe", response_model=CorpusSubscriptionResponse)
+def unsubscribe_corpus(
+    payload: CorpusSubscription, user: Optional[int] = Depends(authenticated_user)
+) -> CorpusSubscriptionResponse:
+    """Stop using a shared corpus.
+
+    The corpus is reference counted; when its last subscriber leaves, its
+    embeddings and texts are freed.
+    """
+    _authorize(user, payload.user_id)
+    if payload.corpus_id not in _vector_store.subscriptions(payload.user_id):
+        raise HTTPException(status_code=404, detail="User is not subscribed to this corpus")
+    remaining = _vector_store.unsubscribe(payload.user_id, payload.corpus_id)
+    return CorpusSubscriptionResponse(corpus_id=payload.corpus_id, subscribers=remaining)
+
+
 class NoteQuery(BaseModel):
     user_id: int
     session_id: str
     question: str
     personality_mode: str = "1"
+    base_version: Optional[int] = None
 
 
 class NoteAnswer(BaseModel):
     answer: str
     emotion: str
     session_id: str
+    version: int
+    turns: List[ChatTurn]
 
 
 @app.post("/api/notes/ask", response_model=NoteAnswer)
-async def ask_notes(payload: NoteQuery) -> NoteAnswer:
+async def ask_notes(
+    payload: NoteQuery,
+    idempotency_key: Optional[str] = Header(None),
+    user: Optional[int] = Depends(authenticated_user),
+) -> NoteAnswer:
     """Answer a question using the student's uploaded notes.
 
     Retrieves the most relevant passages from the user's notes and uses
     them as context for the generative model.  The conversation history is
-    also updated with the question and response.
+    also updated with the question and response.  Duplicates are coalesced
+    as in :func:`chat_endpoint`.
 
     Args:
         payload: The query containing user id, session id and question.
+        idempotency_key: Optional client‑chosen key identifying retries of
+            the same question.
+        user: User id from the bearer token, if tokens are verified.
 
     Returns:
         A NoteAnswer containing the generated answer and the detected emotion.
     """
-    # Retrieve conversation history
-    conversation = _conversation_history.get(payload.session_id, [])
-    # Append the student's question
-    conversation.append({"text": payload.question, "is_user": True})
-    # Detect emotion
-    emotion = classify_emotion(payload.question)
-    # Retrieve relevant passages from notes
-    passages = retrieve_context(payload.user_id, payload.question)
-    if not passages:
-        # If no notes are available, still attempt to answer using the generative model
-        reply = generate_reply(
-            user_message=payload.question,
-            personality_mode=payload.personality_mode,
-            conversation=conversation,
+    _authorize(user, payload.user_id)
+    _check_session_owner(payload.session_id, payload.user_id, claim=True)
+
+    async def respond() -> NoteAnswer:
+        # Retrieve conversation history
+        conversation = _check_base_version(payload.session_id, payload.base_version)
+        user_turn = {"text": payload.question, "is_user": True}
+        with _generating(payload.session_id):
+            # Detect emotion and retrieve relevant passages from notes
+            # concurrently
+            emotion, passages = await analyze_message(payload.user_id, payload.question, True)
+            # If no notes are available, still attempt to answer using the
+            # generative model
+            reply = await generate_reply(
+                user_message=payload.question,
+                personality_mode=payload.personality_mode,
+                conversation=conversation + [user_turn],
+                emotion=emotion,
+                context_passages=passages or None,
+            )
+        # Record the question and the reply together
+        conversation.extend([user_turn, {"text": reply, "is_user": False}])
+        version = len(conversation)
+        start = version - 2 if payload.base_version is None else payload.base_version
+        return NoteAnswer(
+            answer=reply,
             emotion=emotion,
-            context_passages=None,
+            session_id=payload.session_id,
+            version=version,
+            turns=_session_turns(payload.session_id, start),
         )
+
+    key, digest = _coalescing_key(
+        "ask",
+        payload.session_id,
+        payload.user_id,
+        idempotency_key,
+        payload.question,
+        payload.personality_mode,
+        payload.base_version,
+    )
+    return await _coalesce(key, digest, respond, remember=bool(idempotency_key))
+
+
+class SessionHistory(BaseModel):
+    session_id: str
+    version: int
+    turns: List[ChatTurn]
+    has_more: bool
+
+
+MAX_HISTORY_PAGE = 200
+
+
+@app.get("/api/sessions/{session_id}/messages", response_model=SessionHistory)
+def get_session_messages(
+    session_id: str,
+    user_id: int = Query(...),
+    after: Optional[int] = Query(None, ge=0),
+    before: Optional[int] = Query(None, ge=1),
+    limit: int = Query(50, ge=1, le=MAX_HISTORY_PAGE),
+    user: Optional[int] = Depends(authenticated_user),
+) -> SessionHistory:
+    """Return one page of a session's conversation.
+
+    With ``after`` the page holds the messages following that version,
+    oldest first, which is how a client catches up after a 409.  Otherwise
+    it holds the ``limit`` most recent messages before version ``before``
+    (default: the newest), which is how a client reloads a conversation
+    page by page from the end.  ``has_more`` says whether the same query
+    continued past this page would return more messages.
+
+    Args:
+        session_id: The conversation to read.
+        user_id: The requesting user; must own the session (403 otherwise).
+        after: Return messages with a version greater than this.
+        before: Return messages with a version smaller than this.
+        limit: Maximum number of messages to return.
+        user: User id from the bearer token, if tokens are verified; it
+            must match ``user_id``.
+    """
+    _authorize(user, user_id)
+    _check_session_owner(session_id, user_id)
+    version = len(_conversation_history.get(session_id, []))
+    if after is not None:
+        stop = min(version, after + limit)
+        turns = _session_turns(session_id, after, stop)
+        has_more = stop < version
     else:
-        reply = generate_reply(
-            user_message=payload.question,
-            personality_mode=payload.personality_mode,
-            conversation=conversation,
-            emotion=emotion,
-            context_passages=passages,
-        )
-    # Append reply to history
-    conversation.append({"text": reply, "is_user": False})
-    _conversation_history[payload.session_id] = conversation
-    return NoteAnswer(answer=reply, emotion=emotion, session_id=payload.session_id)
+        stop = min(version, before - 1) if before is not None else version
+        start = max(0, stop - limit)
+        turns = _session_turns(session_id, start, stop)
+        has_more = start > 0
+    return SessionHistory(session_id=session_id, version=version, turns=turns, has_more=has_more)
 
 
 @app.get("/api/personality-modes", response_model=Dict[str, Personality])
@@ -609,24 +1465,31 @@ class SummaryResponse(BaseModel):
 
 
 @app.post("/api/notes/summary", response_model=SummaryResponse)
-async def summarize_notes(payload: SummaryRequest) -> SummaryResponse:
+async def summarize_notes(
+    payload: SummaryRequest, user: Optional[int] = Depends(authenticated_user)
+) -> SummaryResponse:
     """Generate a summary of all uploaded notes for a user.
 
-    Retrieves all note chunks for the user and asks the AI to generate
-    a comprehensive summary of the content.
+    Retrieves all note chunks for the user, including subscribed shared
+    corpora, and asks the AI to generate a comprehensive summary of the
+    content.
 
     Args:
         payload: The request containing user_id and personality_mode.
+        user: User id from the bearer token, if tokens are verified.
 
     Returns:
         A SummaryResponse containing the generated summary and number of chunks.
     """
-    notes = _vector_store.get(payload.user_id, [])
-    if not notes:
+    _authorize(user, payload.user_id)
+    # Snapshots of spilled notes are loaded from disk
+    views = await run_inference(_vector_store.views, payload.user_id)
+    if not views:
         raise HTTPException(status_code=404, detail="No notes found for this user")
     
     # Combine all note chunks
-    all_text = "\n\n".join([entry["text"] for entry in notes])
+    prompt_started = time.perf_counter()
+    all_text = "\n\n".join(text for notes in views for text in notes.iter_texts())
     
     personality = PERSONALITY_MODES.get(payload.personality_mode, PERSONALITY_MODES["1"])
     
@@ -640,21 +1503,22 @@ async def summarize_notes(payload: SummaryRequest) -> SummaryResponse:
         f"Notes content:\n{all_text}\n\n"
         "Please provide a well-organized summary."
     )
+    _record_stage("prompt", prompt_started, prompt_chars=len(summary_prompt))
     
-    try:
-        response = _generative_model.generate_content(summary_prompt)
-        summary = response.text
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate summary: {e}")
+    # Summaries are batch work: they queue behind chat and may wait longer
+    with _stage("generate", llm=_llm_client.name, prompt_chars=len(summary_prompt)):
+        summary = await _llm_scheduler.generate(
+            summary_prompt, priority=PRIORITY_BATCH, timeout=SUMMARY_DEADLINE_S
+        )
     
     return SummaryResponse(
         summary=summary,
-        num_chunks=len(notes)
+        num_chunks=sum(len(notes) for notes in views)
     )
 
 
 ###############################################################################
-# Health check
+# Health check and metrics
 ###############################################################################
 
 @app.get("/health")
@@ -663,11 +1527,175 @@ def health() -> Dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Expose latency histograms and gauges in Prometheus text format."""
+    # Read the thread limiter here, on the event loop that owns it
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    _threadpool_gauge.set(statistics.borrowed_tokens, state="busy")
+    _threadpool_gauge.set(statistics.tasks_waiting, state="waiting")
+    _threadpool_gauge.set(statistics.total_tokens, state="capacity")
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+###############################################################################
+# Admin endpoints
+###############################################################################
+
+# Admin endpoints are disabled unless STUDY_BUDDY_ADMIN_TOKEN is set; callers
+# then authenticate with the same value in the X-Admin-Token header.
+_ADMIN_TOKEN = os.environ.get("STUDY_BUDDY_ADMIN_TOKEN")
+
+
+def _is_admin(token: Optional[str]) -> bool:
+    return bool(_ADMIN_TOKEN and token and secrets.compare_digest(token, _ADMIN_TOKEN))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """FastAPI dependency that rejects requests without the admin token."""
+    if not _ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+# Continuous profiles are capped so a typo cannot pin a sampler for hours
+MAX_PROFILE_SECONDS = 300.0
+
+
+class ProfileArmRequest(BaseModel):
+    count: int = 1
+
+
+@app.post("/admin/profile/arm", dependencies=[Depends(require_admin)])
+def arm_profiling(payload: ProfileArmRequest) -> Dict[str, int]:
+    """Profile the next ``count`` requests without needing the header."""
+    global _profile_armed
+    with _profile_armed_lock:
+        _profile_armed = max(0, payload.count)
+        return {"armed": _profile_armed}
+
+
+@app.post("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile_continuously(seconds: float = 10.0, interval_ms: float = 10.0) -> PlainTextResponse:
+    """Sample all threads for ``seconds`` and return collapsed stacks.
+
+    Every request served meanwhile contributes to the profile.  The result
+    can be fed straight to ``flamegraph.pl`` or speedscope.
+    """
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(
+            status_code=400, detail=f"seconds must be in (0, {MAX_PROFILE_SECONDS:g}]"
+        )
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+    if not PROFILER_LOCK.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Another profile is already running")
+    try:
+        sampler = StackSampler(interval=interval_ms / 1000.0).start()
+        try:
+            await anyio.sleep(seconds)
+        finally:
+            await anyio.to_thread.run_sync(sampler.stop)
+    finally:
+        PROFILER_LOCK.release()
+    collapsed = sampler.collapsed()
+    profile_id = _profiles.add(collapsed, "continuous")
+    return PlainTextResponse(
+        collapsed,
+        headers={
+            "X-Study-Buddy-Profile-Id": profile_id,
+            "X-Study-Buddy-Profile-Samples": str(sampler.samples),
+        },
+    )
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def list_profiles() -> Dict[str, List[str]]:
+    """List the ids of recent profiles, newest first."""
+    return {"profiles": _profiles.ids()}
+
+
+@app.get(
+    "/admin/profiles/{profile_id}",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin)],
+)
+def get_profile(profile_id: str) -> PlainTextResponse:
+    """Return a stored profile in collapsed‑stack format."""
+    collapsed = _profiles.get(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(collapsed)
+
+
+_tracemalloc = TracemallocTracker()
+
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+def memory_report(limit: int = 50, tracemalloc: Optional[str] = None) -> Dict[str, Any]:
+    """Attribute the process's memory to notes, conversations and models.
+
+    Reports the bytes held for each user and shared corpus in the note
+    store (embeddings, texts and metadata separately), each conversation
+    session, and each loaded model's parameters and buffers.  Lists are
+    sorted largest first and cut to ``limit`` entries.
+
+    ``tracemalloc=start`` begins allocation tracing and records a baseline;
+    ``tracemalloc=diff`` on a later call adds the source lines whose
+    allocations grew since then; ``tracemalloc=stop`` ends tracing.
+    """
+    store = _vector_store.memory_report()
+    sessions = sorted(
+        (
+            {"session_id": session_id, "messages": len(messages), "bytes": deep_sizeof(messages)}
+            for session_id, messages in list(_conversation_history.items())
+        ),
+        key=lambda entry: entry["bytes"],
+        reverse=True,
+    )
+    report: Dict[str, Any] = {
+        "process": process_memory(),
+        "notes": {
+            "embedding_bytes": sum(entry["embedding_bytes"] for entry in store),
+            "text_bytes": sum(entry["text_bytes"] for entry in store),
+            "metadata_bytes": sum(entry["metadata_bytes"] for entry in store),
+            "disk_bytes": sum(entry["disk_bytes"] for entry in store),
+            "entries": store[:limit],
+        },
+        "conversations": {
+            "sessions": len(sessions),
+            "messages": sum(entry["messages"] for entry in sessions),
+            "bytes": sum(entry["bytes"] for entry in sessions),
+            "largest": sessions[:limit],
+        },
+        "models": {
+            "emotion_classifier": model_memory(_emotion_classifier),
+            "embedding_model": model_memory(_embedding_model),
+        },
+    }
+    if tracemalloc == "start":
+        report["tracemalloc"] = _tracemalloc.start()
+    elif tracemalloc == "diff":
+        try:
+            report["tracemalloc"] = _tracemalloc.diff(limit)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    elif tracemalloc == "stop":
+        report["tracemalloc"] = _tracemalloc.stop()
+    elif tracemalloc is not None:
+        raise HTTPException(status_code=400, detail="tracemalloc must be start, diff or stop")
+    return report
+
+
 ###############################################################################
 # Run the application
 ###############################################################################
 
 if __name__ == "__main__":
+    # Development server with auto-reload; run study_buddy_server.py for
+    # several workers sharing one copy of the models
     import uvicorn
     uvicorn.run(
         "study_buddy_backend:app",
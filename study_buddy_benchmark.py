@@ -0,0 +1,458 @@
+"""
+Study Buddy Micro‑Benchmarks
+============================
+
+Reproducible micro‑benchmarks for the hot paths of the Study Buddy backend:
+
+* ``classify_emotion`` – one emotion classification per chat message.
+* ``embed_text`` – one sentence embedding per chunk or question.
+* ``chunk_text`` – the 500‑word chunker used by ``upload_notes``.
+* ``ingest`` – chunking, embedding and storing a whole document, i.e.
+  ``upload_notes`` without the file parsing.
+* ``retrieve_context`` – question embedding plus top‑k search over stores of
+  increasing size (100 chunks up to 1M with ``--sizes``).
+* ``concurrent_store`` – a stress run with concurrent writers and readers on
+  one user's notes that also checks readers never see half‑appended state.
+
+Every stage reports latency percentiles, throughput and peak traced memory.
+Results can be written as JSON with ``--output`` and compared against an
+earlier run with ``--compare``.
+
+By default the models are replaced by the deterministic stand‑ins from
+``study_buddy_models`` so the suite runs fully offline and gives the same
+inputs on every run for a given ``--seed``.  Pass ``--real-models`` to
+benchmark DistilBERT and MiniLM instead.  The generative model is never
+called; the backend is started with the local stand‑in LLM client.
+
+Examples:
+
+```
+python study_buddy_benchmark.py
+python study_buddy_benchmark.py --sizes 100,1000,10000,100000,1000000 --output after.json
+python study_buddy_benchmark.py --output after.json --compare before.json
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_SIZES = (100, 1_000, 10_000, 100_000)
+
+# Words used to build synthetic messages, questions and notes.
+_VOCABULARY = (
+    "photosynthesis chlorophyll mitochondria enzyme protein cell membrane nucleus "
+    "derivative integral limit function matrix vector eigenvalue theorem proof "
+    "revolution empire treaty parliament economy trade colony migration culture "
+    "algorithm recursion pointer compiler memory thread network database query "
+    "energy momentum velocity acceleration force gravity wave particle quantum "
+    "the a of and to in is that for it with as was on be by this are from "
+    "exam study notes question answer remember explain understand review practice"
+).split()
+
+_MOODS = (
+    "I'm so nervous about the exam tomorrow",
+    "This is really fun, I finally get it",
+    "I hate how confusing this chapter is",
+    "Thanks so much, I love studying with you",
+    "I'm tired and feel a bit lost",
+    "Wow, I didn't expect that result",
+)
+
+
+###############################################################################
+# Synthetic data
+###############################################################################
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_VOCABULARY) for _ in range(words))
+
+
+def synthetic_messages(rng: random.Random, n: int) -> List[str]:
+    """Chat messages mixing an emotional opener with topical words."""
+    return [f"{rng.choice(_MOODS)}. {_sentence(rng, rng.randint(5, 25))}?" for _ in range(n)]
+
+
+def synthetic_document(rng: random.Random, words: int) -> str:
+    """A plain‑text document of roughly ``words`` words split into lines."""
+    lines = []
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, rng.randint(8, 16))
+        lines.append(_sentence(rng, length))
+        remaining -= length
+    return "\n".join(lines)
+
+
+def synthetic_embeddings(np_rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    """``n`` normalised float32 vectors drawn around a few topic centres."""
+    centres = np_rng.standard_normal((64, dim)).astype(np.float32)
+    matrix = np.empty((n, dim), dtype=np.float32)
+    block = 65_536
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        rows = centres[np_rng.integers(0, len(centres), stop - start)]
+        rows = rows + 0.7 * np_rng.standard_normal((stop - start, dim)).astype(np.float32)
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        matrix[start:stop] = rows
+    return matrix
+
+
+###############################################################################
+# Measurement helpers
+###############################################################################
+
+def summarize(samples: Sequence[float], wall_seconds: float) -> Dict[str, float]:
+    """Latency percentiles (ms) and throughput for per‑call durations in seconds."""
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    if not len(values):
+        return {"n": 0}
+    return {
+        "n": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+        "throughput_per_s": float(len(values) / wall_seconds) if wall_seconds > 0 else 0.0,
+    }
+
+
+def time_calls(fn: Callable[[Any], Any], inputs: Sequence[Any]) -> Dict[str, float]:
+    """Call ``fn`` once per input and summarise the latencies."""
+    samples = []
+    started = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def peak_memory(fn: Callable[[Any], Any], inputs: Sequence[Any]) -> int:
+    """Peak bytes traced by :mod:`tracemalloc` while calling ``fn`` on ``inputs``.
+
+    Run separately from :func:`time_calls` so tracing does not skew timings.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        for item in inputs:
+            fn(item)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return int(peak)
+
+
+###############################################################################
+# Stages
+###############################################################################
+
+def bench_classify(backend: Any, rng: random.Random, n: int) -> Dict[str, Any]:
+    messages = synthetic_messages(rng, n)
+    result = time_calls(backend.classify_emotion, messages)
+    result["peak_memory_bytes"] = peak_memory(backend.classify_emotion, messages[:50])
+    return result
+
+
+def bench_embed(backend: Any, rng: random.Random, n: int) -> Dict[str, Any]:
+    texts = [_sentence(rng, rng.randint(8, 40)) for _ in range(n)]
+    result = time_calls(backend.embed_text, texts)
+    result["peak_memory_bytes"] = peak_memory(backend.embed_text, texts[:50])
+    return result
+
+
+def bench_chunk(backend: Any, rng: random.Random, n: int, words: int) -> Dict[str, Any]:
+    documents = [synthetic_document(rng, words) for _ in range(n)]
+    result = time_calls(backend.chunk_text, documents)
+    result["words_per_document"] = words
+    result["words_per_s"] = result["throughput_per_s"] * words
+    result["peak_memory_bytes"] = peak_memory(backend.chunk_text, documents[:5])
+    return result
+
+
+def bench_ingest(backend: Any, rng: random.Random, n: int, words: int) -> Dict[str, Any]:
+    from study_buddy_store import NoteStore
+
+    documents = [synthetic_document(rng, words) for _ in range(n)]
+    original_store = backend._vector_store
+    backend._vector_store = NoteStore(precision=original_store.precision)
+
+    def ingest(document: str) -> None:
+        chunks, pages = backend.chunk_text(document)
+        embeddings = [backend.embed_text(chunk) for chunk in chunks]
+        backend._vector_store.append(1, embeddings, chunks, pages=pages)
+
+    try:
+        result = time_calls(ingest, documents)
+        result["peak_memory_bytes"] = peak_memory(ingest, documents[:3])
+    finally:
+        backend._vector_store = original_store
+    result["words_per_document"] = words
+    return result
+
+
+def bench_retrieve(
+    backend: Any,
+    rng: random.Random,
+    np_rng: np.random.Generator,
+    size: int,
+    queries: int,
+    k: int,
+) -> Dict[str, Any]:
+    from study_buddy_store import NoteStore
+
+    dim = backend.embed_text("dimension probe").shape[0]
+    original_store = backend._vector_store
+    store = NoteStore(precision=original_store.precision)
+    matrix = synthetic_embeddings(np_rng, size, dim)
+    texts = [_sentence(rng, 12) for _ in range(size)]
+    build_started = time.perf_counter()
+    store.append(1, matrix, texts)
+    build_seconds = time.perf_counter() - build_started
+    del matrix, texts
+    backend._vector_store = store
+    questions = [_sentence(rng, rng.randint(6, 14)) for _ in range(queries)]
+    try:
+        result = time_calls(lambda q: backend.retrieve_context(1, q, k), questions)
+        transient = peak_memory(lambda q: backend.retrieve_context(1, q, k), questions[:10])
+    finally:
+        backend._vector_store = original_store
+    stats = store.stats()
+    result.update(
+        {
+            "chunks": size,
+            "k": k,
+            "build_seconds": build_seconds,
+            "store_resident_bytes": stats["resident_bytes"],
+            "peak_memory_bytes": stats["resident_bytes"] + transient,
+        }
+    )
+    store.clear(1)
+    return result
+
+
+def bench_concurrent_store(
+    np_rng: np.random.Generator,
+    writers: int,
+    readers: int,
+    seconds: float,
+    dim: int,
+) -> Dict[str, Any]:
+    """Hammer one user's notes with concurrent appends and searches.
+
+    Readers check every snapshot they see for torn state: the number of
+    embedding rows, text offsets and metadata rows must always agree.
+    """
+    from study_buddy_store import NoteStore
+
+    store = NoteStore()
+    pool = synthetic_embeddings(np_rng, 4096, dim)
+    stop = threading.Event()
+    write_samples: List[float] = []
+    read_samples: List[float] = []
+    violations: List[str] = []
+    lock = threading.Lock()
+
+    def writer(index: int) -> None:
+        local_rng = np.random.default_rng(index)
+        local: List[float] = []
+        while not stop.is_set():
+            rows = pool[local_rng.integers(0, len(pool), 8)]
+            t0 = time.perf_counter()
+            store.append(7, rows, [f"w{index}"] * len(rows))
+            local.append(time.perf_counter() - t0)
+        with lock:
+            write_samples.extend(local)
+
+    def reader(index: int) -> None:
+        local: List[float] = []
+        query = pool[index % len(pool)]
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            snapshot = store.snapshot(7)
+            n = len(snapshot)
+            rows = (snapshot.embeddings.shape[0], len(snapshot.document_ids), len(snapshot.pages))
+            if n and any(count != n for count in rows):
+                violations.append(f"torn snapshot v{snapshot.version}")
+            snapshot.search(query, 3)
+            local.append(time.perf_counter() - t0)
+        with lock:
+            read_samples.extend(local)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    final = store.snapshot(7)
+    expected_rows = 8 * len(write_samples)
+    return {
+        "writers": writers,
+        "readers": readers,
+        "writes": summarize(write_samples, wall),
+        "reads": summarize(read_samples, wall),
+        "final_chunks": len(final),
+        "lost_chunks": expected_rows - len(final),
+        "torn_snapshots": len(violations),
+        "ok": not violations and expected_rows == len(final),
+    }
+
+
+###############################################################################
+# Driver
+###############################################################################
+
+def run_suite(args: argparse.Namespace) -> Dict[str, Any]:
+    if not args.real_models:
+        os.environ["STUDY_BUDDY_STUB_MODELS"] = "1"
+    os.environ["STUDY_BUDDY_LLM"] = "fake"
+    import study_buddy_backend as backend
+
+    stages = set(args.stages.split(","))
+    results: List[Dict[str, Any]] = []
+
+    def record(stage: str, metrics: Dict[str, Any]) -> None:
+        metrics = {"stage": stage, **metrics}
+        results.append(metrics)
+        print(_format_row(metrics), file=sys.stderr)
+
+    # Each stage gets its own generators so adding or skipping a stage does
+    # not change the inputs of the others.
+    def rngs(offset: int) -> Any:
+        return random.Random(args.seed + offset), np.random.default_rng(args.seed + offset)
+
+    if "classify" in stages:
+        record("classify_emotion", bench_classify(backend, rngs(1)[0], args.calls))
+    if "embed" in stages:
+        record("embed_text", bench_embed(backend, rngs(2)[0], args.calls))
+    if "chunk" in stages:
+        record("chunk_text", bench_chunk(backend, rngs(3)[0], args.documents, args.document_words))
+    if "ingest" in stages:
+        record("ingest", bench_ingest(backend, rngs(4)[0], args.documents, args.document_words))
+    if "retrieve" in stages:
+        for size in args.sizes:
+            rng, np_rng = rngs(5 + size)
+            record("retrieve_context", bench_retrieve(backend, rng, np_rng, size, args.queries, args.k))
+    if "concurrent" in stages:
+        dim = backend.embed_text("dimension probe").shape[0]
+        record(
+            "concurrent_store",
+            bench_concurrent_store(rngs(6)[1], args.writers, args.readers, args.stress_seconds, dim),
+        )
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "seed": args.seed,
+            "stub_models": not args.real_models,
+            "embedding_precision": backend._vector_store.precision,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def _format_row(metrics: Dict[str, Any]) -> str:
+    label = metrics["stage"]
+    if "chunks" in metrics:
+        label += f"[{metrics['chunks']}]"
+    if "p50_ms" not in metrics:
+        return (
+            f"{label:<28} ok={metrics.get('ok')} "
+            f"reads={metrics['reads'].get('n')} writes={metrics['writes'].get('n')}"
+        )
+    return (
+        f"{label:<28} p50={metrics['p50_ms']:9.3f}ms p95={metrics['p95_ms']:9.3f}ms "
+        f"p99={metrics['p99_ms']:9.3f}ms thr={metrics['throughput_per_s']:11.1f}/s "
+        f"peak={metrics.get('peak_memory_bytes', 0) / 1e6:8.1f}MB"
+    )
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    """Print p50/p99/throughput ratios of ``current`` against a saved run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(row: Dict[str, Any]) -> str:
+        return f"{row['stage']}[{row.get('chunks', '')}]"
+
+    before = {key(row): row for row in baseline.get("results", [])}
+    print(f"\nComparison against {baseline_path} (new / old):")
+    for row in current["results"]:
+        old = before.get(key(row))
+        if old is None or "p50_ms" not in row or "p50_ms" not in old:
+            continue
+        ratios = [
+            f"{metric}={row[metric] / old[metric]:.2f}x"
+            for metric in ("p50_ms", "p99_ms", "throughput_per_s")
+            if old.get(metric)
+        ]
+        print(f"  {key(row):<28} " + " ".join(ratios))
+
+
+def _parse_sizes(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Study Buddy hot‑path micro‑benchmarks")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for all synthetic data")
+    parser.add_argument(
+        "--stages",
+        default="classify,embed,chunk,ingest,retrieve,concurrent",
+        help="Comma‑separated stages to run",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=_parse_sizes,
+        default=list(DEFAULT_SIZES),
+        help="Store sizes (chunks) for retrieve_context, e.g. 100,1000,1000000",
+    )
+    parser.add_argument("--calls", type=int, default=500, help="Calls per model stage")
+    parser.add_argument("--queries", type=int, default=200, help="Questions per store size")
+    parser.add_argument("--k", type=int, default=3, help="Passages retrieved per question")
+    parser.add_argument("--documents", type=int, default=20, help="Documents for chunk/ingest")
+    parser.add_argument("--document-words", type=int, default=5000, help="Words per document")
+    parser.add_argument("--writers", type=int, default=2, help="Writer threads for the stress run")
+    parser.add_argument("--readers", type=int, default=4, help="Reader threads for the stress run")
+    parser.add_argument("--stress-seconds", type=float, default=2.0, help="Stress run duration")
+    parser.add_argument("--real-models", action="store_true", help="Use DistilBERT/MiniLM")
+    parser.add_argument("--output", help="Write JSON results to this path")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
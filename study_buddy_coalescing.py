@@ -0,0 +1,130 @@
+"""
+Study Buddy Request Coalescing
+==============================
+
+Double clicks and client retries from the front‑end often send the same
+chat message for the same session twice, a few hundred milliseconds
+apart.  Without coalescing each copy runs its own LLM call and appends its
+own pair of turns to the conversation.
+
+:class:`SingleFlight` runs one coroutine per key at a time.  Callers that
+arrive with a key that is already in flight await the running task and
+receive its result (or its exception) instead of starting a new one.  The
+task is shielded from the callers, so a client that disconnects does not
+cancel the work the others are waiting on.
+
+Results can optionally be remembered for a while after the task finishes.
+The backend does this only for requests that carry an explicit
+``Idempotency-Key`` header, so a retry after a dropped response gets the
+original reply; duplicates identified only by a hash of their content are
+coalesced while in flight and forgotten as soon as they finish, because a
+student may legitimately ask the same thing twice.
+
+A call may also pass a *fingerprint* of its arguments.  A later call with
+the same key but a different fingerprint raises :class:`KeyReused` instead
+of sharing a reply that was produced for another request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class KeyReused(ValueError):
+    """A key was reused for a call with a different fingerprint."""
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key.
+
+    Must be used from a single event loop.
+
+    Args:
+        ttl: Seconds to keep a successful result for calls made with
+            ``remember=True``.
+        max_results: Maximum number of remembered results; the oldest are
+            dropped first.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_results: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_results = max_results
+        self._inflight: Dict[Hashable, Tuple["asyncio.Task[Any]", Optional[str]]] = {}
+        self._results: "OrderedDict[Hashable, Tuple[float, Optional[str], Any]]" = OrderedDict()
+        self.counters: Dict[str, int] = {"leader": 0, "shared": 0, "replayed": 0}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[Any]],
+        remember: bool = False,
+        fingerprint: Optional[str] = None,
+    ) -> Tuple[Any, bool]:
+        """Run ``func()`` unless a call with ``key`` is already running.
+
+        Args:
+            key: Identifies duplicate calls.
+            func: Zero‑argument coroutine function doing the work.
+            remember: Keep a successful result for ``ttl`` seconds so later
+                calls with the same key replay it.
+            fingerprint: Digest of the call's arguments; must match the
+                fingerprint of a running or remembered call with ``key``.
+
+        Returns:
+            A tuple ``(result, shared)``; ``shared`` is True when the result
+            came from another caller's call.
+
+        Raises:
+            KeyReused: ``key`` is running or remembered with a different
+                fingerprint.
+        """
+        cached = self._results.get(key)
+        if cached is not None:
+            expires, stored, result = cached
+            if expires > time.monotonic():
+                self._check(stored, fingerprint)
+                self.counters["replayed"] += 1
+                return result, True
+            del self._results[key]
+        running = self._inflight.get(key)
+        shared = running is not None
+        if running is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = (task, fingerprint)
+            task.add_done_callback(lambda done: self._finished(key, done, remember, fingerprint))
+            self.counters["leader"] += 1
+        else:
+            task, stored = running
+            self._check(stored, fingerprint)
+            self.counters["shared"] += 1
+        return await asyncio.shield(task), shared
+
+    @staticmethod
+    def _check(stored: Optional[str], fingerprint: Optional[str]) -> None:
+        if stored != fingerprint:
+            raise KeyReused("key was already used for a different call")
+
+    def _finished(
+        self,
+        key: Hashable,
+        task: "asyncio.Task[Any]",
+        remember: bool,
+        fingerprint: Optional[str],
+    ) -> None:
+        running = self._inflight.get(key)
+        if running is not None and running[0] is task:
+            del self._inflight[key]
+        # Retrieve the exception so an unshared failure is not reported as
+        # "never retrieved"; failures are never remembered
+        if task.cancelled() or task.exception() is not None or not remember:
+            return
+        self._results[key] = (time.monotonic() + self.ttl, fingerprint, task.result())
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
@@ -0,0 +1,546 @@
+"""
+Study Buddy Inference Service
+=============================
+
+A long‑lived local process that owns the emotion classifier and the
+sentence embedder and serves them over a Unix domain socket.
+
+Without it every process pays for its own copy of the models: the
+terminal client loads DistilBERT and MiniLM on every launch, and each API
+worker holds a private copy, so resident memory grows with the number of
+workers.  With the service running, clients connect in milliseconds and a
+single copy of the weights serves all of them.
+
+Protocol
+--------
+
+Each message is a 4‑byte big‑endian length, a JSON header of that length
+and, when the header has a ``"binary"`` field, that many raw bytes.
+Requests are ``{"op": "classify" | "embed" | "ping", "texts": [...]}``.
+``classify`` answers ``{"scores": [[{"label", "score"}, ...], ...]}``;
+``embed`` answers ``{"shape": [n, dim], "dtype": "float32", "binary": k}``
+followed by the embedding matrix.  Failures answer ``{"error": "..."}``.
+
+Batching
+--------
+
+Requests from all connections are queued per model.  A batcher takes
+whatever is queued, up to ``--max-batch`` texts, runs the model once on
+the whole batch and hands each caller its rows.  By default it does not
+wait for company: a lone request runs at once, and batches form from the
+requests that arrive while the model is busy.  ``--max-wait-ms`` trades
+latency for larger batches.  The classifier and the
+embedder have their own worker threads, so they run in parallel.
+
+Clients
+-------
+
+:func:`load_models` is what the backend and the terminal call instead of
+the loaders in ``study_buddy_models.py``.  When the service answers on
+``STUDY_BUDDY_INFERENCE_SOCKET`` (default: ``study-buddy-inference.sock``
+in the temp directory; ``off`` disables it) it returns
+:class:`RemoteEmotionClassifier` and :class:`RemoteEmbeddingModel`, which
+have the call signatures of the real models.  Otherwise, and if the
+service disappears later, the models are loaded in‑process.
+
+Run the service with:
+
+```
+python study_buddy_inference.py serve
+python study_buddy_inference.py ping
+```
+
+``STUDY_BUDDY_STUB_MODELS=1`` serves the deterministic stand‑ins; clients
+only use a service whose stub setting matches their own.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from study_buddy_models import (
+    EMBEDDING_MODEL_NAME,
+    EMOTION_MODEL_NAME,
+    load_embedding_model,
+    load_emotion_classifier,
+    stub_models_enabled,
+)
+
+# Largest header or payload accepted, so a bad client cannot make either
+# side allocate without bound.
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+_LENGTH = struct.Struct(">I")
+
+
+def default_socket_path() -> Optional[str]:
+    """Return the configured socket path, or ``None`` if the service is off."""
+    path = os.environ.get(
+        "STUDY_BUDDY_INFERENCE_SOCKET",
+        os.path.join(tempfile.gettempdir(), "study-buddy-inference.sock"),
+    )
+    return None if path.lower() in {"", "off", "0", "none"} else path
+
+
+class InferenceUnavailable(ConnectionError):
+    """Raised when the inference service cannot be reached."""
+
+
+class InferenceError(RuntimeError):
+    """Raised when the inference service reports a failed request."""
+
+
+###############################################################################
+# Server
+###############################################################################
+
+class _Batcher:
+    """Collects concurrent requests for one model into batched calls.
+
+    Args:
+        run_batch: Runs the model on a list of texts and returns one result
+            per text (a list, or an array with one row per text).
+        max_batch: Maximum number of texts per model call.  A single
+            request larger than this still runs as one call.
+        max_wait: Seconds to wait for more requests once one is queued.
+    """
+
+    def __init__(
+        self, run_batch: Callable[[List[str]], Any], max_batch: int, max_wait: float
+    ) -> None:
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue: List[Tuple[List[str], "asyncio.Future[Any]"]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.batches = 0
+        self.texts = 0
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._loop())
+
+    async def submit(self, texts: List[str]) -> Any:
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self._queue.append((texts, future))
+        self._wakeup.set()
+        return await future
+
+    def _queued_texts(self) -> int:
+        return sum(len(texts) for texts, _ in self._queue)
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            deadline = loop.time() + self.max_wait
+            while self._queued_texts() < self.max_batch and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            batch, size = [], 0
+            while self._queue and (not batch or size + len(self._queue[0][0]) <= self.max_batch):
+                texts, future = self._queue.pop(0)
+                batch.append((texts, future))
+                size += len(texts)
+            if self._queue:
+                self._wakeup.set()
+            else:
+                self._wakeup.clear()
+            texts = [text for request, _ in batch for text in request]
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, texts)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for request, future in batch:
+                if not future.done():
+                    future.set_result(results[start:start + len(request)])
+                start += len(request)
+
+
+class InferenceServer:
+    """Serves one copy of the models to every local client.
+
+    Args:
+        socket_path: Filesystem path of the Unix socket.
+        classifier: Emotion classifier from :func:`load_emotion_classifier`.
+        embedder: Embedder from :func:`load_embedding_model`.
+        max_batch: Maximum texts per model call.
+        max_wait_ms: How long a batch waits for more requests.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        classifier: Any,
+        embedder: Any,
+        max_batch: int = 64,
+        max_wait_ms: float = 0.0,
+    ) -> None:
+        self.socket_path = socket_path
+        self.classifier = classifier
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.started = time.time()
+        self.connections = 0
+        self._batchers: Dict[str, _Batcher] = {}
+
+    def _classify_batch(self, texts: List[str]) -> List[Any]:
+        return self.classifier(texts, batch_size=len(texts))
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self.embedder.encode(texts, convert_to_numpy=True, batch_size=len(texts)),
+            dtype=np.float32,
+        ).reshape(len(texts), -1)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "stub": stub_models_enabled(),
+            "emotion_model": EMOTION_MODEL_NAME,
+            "embedding_model": EMBEDDING_MODEL_NAME,
+            "embedding_dim": int(self.embedder.get_sentence_embedding_dimension()),
+            "uptime_s": round(time.time() - self.started, 3),
+            "connections": self.connections,
+            "batches": {op: b.batches for op, b in self._batchers.items()},
+            "texts": {op: b.texts for op, b in self._batchers.items()},
+        }
+
+    async def _handle(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        op = request.get("op")
+        if op == "ping":
+            return self.info(), b""
+        texts = request.get("texts")
+        if op not in self._batchers:
+            raise ValueError(f"Unknown op {op!r}")
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            raise ValueError("texts must be a list of strings")
+        if not texts:
+            results: Any = [] if op == "classify" else np.zeros((0, 0), dtype=np.float32)
+        else:
+            results = await self._batchers[op].submit(texts)
+        if op == "classify":
+            return {"scores": [list(scores) for scores in results]}, b""
+        matrix = np.ascontiguousarray(results, dtype=np.float32)
+        payload = matrix.tobytes()
+        return {"shape": list(matrix.shape), "dtype": "float32", "binary": len(payload)}, payload
+
+    async def _serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+                    if length > MAX_MESSAGE_BYTES:
+                        break
+                    request = json.loads(await reader.readexactly(length))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                try:
+                    header, payload = await self._handle(request)
+                except Exception as exc:
+                    header, payload = {"error": f"{type(exc).__name__}: {exc}"}, b""
+                body = json.dumps(header).encode("utf-8")
+                writer.write(_LENGTH.pack(len(body)) + body + payload)
+                await writer.drain()
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve_forever(self) -> None:
+        self._batchers = {
+            "classify": _Batcher(self._classify_batch, self.max_batch, self.max_wait),
+            "embed": _Batcher(self._embed_batch, self.max_batch, self.max_wait),
+        }
+        for batcher in self._batchers.values():
+            batcher.start()
+        if os.path.exists(self.socket_path):
+            # A stale socket from a previous run; refuse to take over a live one
+            try:
+                InferenceClient(self.socket_path, timeout=1.0).ping()
+            except InferenceUnavailable:
+                os.unlink(self.socket_path)
+            else:
+                raise SystemExit(f"An inference service is already running on {self.socket_path}")
+        server = await asyncio.start_unix_server(self._serve_connection, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        print(f"Inference service listening on {self.socket_path} (pid {os.getpid()})", flush=True)
+        # Remove the socket on SIGTERM/SIGINT too, so clients fall back at once
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+###############################################################################
+# Client
+###############################################################################
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Inference service closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class InferenceClient:
+    """Blocking client for :class:`InferenceServer`.
+
+    Thread‑safe: each thread uses its own connection, so calls from the
+    backend's inference pool run concurrently and are batched by the
+    service.
+
+    Args:
+        socket_path: Path of the service's Unix socket.
+        timeout: Seconds to wait for a connection or a reply.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        # The service's ping reply, filled in by connect()
+        self.info: Dict[str, Any] = {}
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        body = json.dumps(request).encode("utf-8")
+        # One retry on a fresh connection covers a service restart
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(_LENGTH.pack(len(body)) + body)
+                (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+                header = json.loads(_recv_exactly(sock, length))
+                payload = _recv_exactly(sock, header.get("binary", 0))
+                break
+            except OSError as exc:
+                self.close()
+                if attempt:
+                    raise InferenceUnavailable(f"Inference service unavailable: {exc}") from exc
+        if "error" in header:
+            raise InferenceError(header["error"])
+        return header, payload
+
+    def ping(self) -> Dict[str, Any]:
+        """Return the service's model names, batching counters and pid."""
+        return self._call({"op": "ping"})[0]
+
+    def classify(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """Return the label/score list for each text."""
+        return self._call({"op": "classify", "texts": list(texts)})[0]["scores"]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Return the (unnormalised) embeddings, one row per text."""
+        header, payload = self._call({"op": "embed", "texts": list(texts)})
+        return np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"])
+
+
+###############################################################################
+# Drop‑in model adapters
+###############################################################################
+
+class _RemoteModel:
+    """Calls the service, and a lazily loaded local model when it is down.
+
+    After a failure the service is tried again every ``retry_interval``
+    seconds, so a restarted service is picked up without restarting the
+    client.
+    """
+
+    def __init__(
+        self, client: InferenceClient, fallback: Callable[[], Any], retry_interval: float = 30.0
+    ) -> None:
+        self.client = client
+        self.fallback = fallback
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0
+        self._local: Any = None
+        self._local_lock = threading.Lock()
+
+    def _call(self, remote: Callable[[], Any], local: Callable[[Any], Any]) -> Any:
+        if time.monotonic() >= self._retry_at:
+            try:
+                return remote()
+            except InferenceUnavailable as exc:
+                self._retry_at = time.monotonic() + self.retry_interval
+                print(f"{exc}; using in‑process models", file=sys.stderr)
+        with self._local_lock:
+            if self._local is None:
+                self._local = self.fallback()
+            return local(self._local)
+
+
+class RemoteEmotionClassifier(_RemoteModel):
+    """Emotion classifier served by the inference service.
+
+    Called like the Hugging Face pipeline with ``top_k=None``.
+    """
+
+    def __call__(self, inputs: Union[str, List[str]], **kwargs: Any) -> List[Any]:
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        return self._call(lambda: self.client.classify(texts), lambda model: model(inputs, **kwargs))
+
+
+class RemoteEmbeddingModel(_RemoteModel):
+    """Sentence embedder served by the inference service.
+
+    Has the ``encode`` signature of ``SentenceTransformer``.
+    """
+
+    def __init__(self, client: InferenceClient, fallback: Callable[[], Any], dim: int, **kwargs: Any) -> None:
+        super().__init__(client, fallback, **kwargs)
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(
+        self, sentences: Union[str, List[str]], convert_to_numpy: bool = True, **kwargs: Any
+    ) -> Any:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        def remote() -> Any:
+            matrix = self.client.embed(texts) if texts else np.zeros((0, self.dim), np.float32)
+            if single:
+                return matrix[0]
+            return matrix if convert_to_numpy else list(matrix)
+
+        return self._call(
+            remote,
+            lambda model: model.encode(sentences, convert_to_numpy=convert_to_numpy, **kwargs),
+        )
+
+
+def connect(socket_path: Optional[str] = None, timeout: float = 30.0) -> Optional[InferenceClient]:
+    """Return a client for a running, compatible service, else ``None``.
+
+    Args:
+        socket_path: Socket to use; defaults to :func:`default_socket_path`.
+        timeout: Per‑call timeout of the returned client.
+    """
+    path = socket_path or default_socket_path()
+    if not path or not os.path.exists(path):
+        return None
+    client = InferenceClient(path, timeout=timeout)
+    try:
+        info = client.ping()
+    except (InferenceUnavailable, InferenceError):
+        return None
+    if bool(info.get("stub")) != stub_models_enabled():
+        print(
+            f"Ignoring the inference service on {path}: it serves "
+            f"{'stub' if info.get('stub') else 'real'} models",
+            file=sys.stderr,
+        )
+        client.close()
+        return None
+    client.info = info
+    return client
+
+
+def load_models(socket_path: Optional[str] = None) -> Tuple[Any, Any, Optional[InferenceClient]]:
+    """Return ``(classifier, embedder, client)`` for this process.
+
+    Uses the inference service when it is running, otherwise loads both
+    models in‑process; ``client`` is ``None`` in the latter case.
+    """
+    client = connect(socket_path)
+    if client is None:
+        return load_emotion_classifier(), load_embedding_model(), None
+    classifier = RemoteEmotionClassifier(client, load_emotion_classifier)
+    embedder = RemoteEmbeddingModel(client, load_embedding_model, dim=int(client.info["embedding_dim"]))
+    return classifier, embedder, client
+
+
+###############################################################################
+# Command line
+###############################################################################
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Study Buddy local inference service")
+    parser.add_argument("command", choices=["serve", "ping"], help="Run the service or query it")
+    parser.add_argument("--socket", default=None, help="Unix socket path (default: STUDY_BUDDY_INFERENCE_SOCKET)")
+    parser.add_argument("--max-batch", type=int, default=64, help="Maximum texts per model call")
+    parser.add_argument(
+        "--max-wait-ms", type=float, default=0.0, help="Extra wait for a batch to fill (ms)"
+    )
+    args = parser.parse_args(argv)
+    path = args.socket or default_socket_path()
+    if not path:
+        raise SystemExit("STUDY_BUDDY_INFERENCE_SOCKET is off; pass --socket")
+
+    if args.command == "ping":
+        try:
+            print(json.dumps(InferenceClient(path, timeout=5.0).ping(), indent=2))
+        except InferenceUnavailable as exc:
+            raise SystemExit(str(exc))
+        return
+
+    started = time.perf_counter()
+    classifier = load_emotion_classifier()
+    embedder = load_embedding_model()
+    print(f"Models loaded in {time.perf_counter() - started:.1f}s", flush=True)
+    server = InferenceServer(
+        path, classifier, embedder, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms
+    )
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,733 @@
+"""
+Study Buddy LLM Clients
+=======================
+
+The backend talks to its generative model through a small client
+interface instead of calling ``google.generativeai`` directly.  Two
+implementations are provided:
+
+* :class:`GeminiClient` – the production client, a thin wrapper around
+  ``genai.GenerativeModel("models/gemini-2.5-flash")``.
+
+* :class:`FakeLLMClient` – a local stand‑in for load tests and offline
+  development.  It never touches the network; it sleeps for a latency drawn
+  from a configurable distribution, fails a configurable fraction of calls
+  the way a throttled API would, and can stream its reply in chunks.
+
+:func:`load_llm_client` picks one from the environment:
+
+``STUDY_BUDDY_LLM``
+    ``gemini`` (default) or ``fake``.
+``STUDY_BUDDY_FAKE_LLM_LATENCY_MS``
+    Median latency of the fake, default ``800``.
+``STUDY_BUDDY_FAKE_LLM_DISTRIBUTION``
+    ``lognormal`` (default), ``uniform`` or ``constant``.
+``STUDY_BUDDY_FAKE_LLM_SIGMA``
+    Spread of the lognormal distribution, default ``0.5``.  For ``uniform``
+    latencies fall between 0 and twice the median.
+``STUDY_BUDDY_FAKE_LLM_FAILURE_RATE``
+    Probability that a call raises :class:`LLMError`, default ``0``.
+``STUDY_BUDDY_FAKE_LLM_SEED``
+    Seed for latencies and failures, default ``0``.
+``STUDY_BUDDY_FAKE_LLM_CAPACITY``
+    Concurrent calls the stand‑in serves before throttling with 429s,
+    default unlimited.
+
+Outbound calls are shaped by :class:`LLMScheduler`: an adaptive (AIMD)
+concurrency limit, a priority queue that serves interactive chat before
+batch work such as summaries, jittered retries that respect each call's
+deadline, and a circuit breaker that fails fast while the provider is
+down.  :func:`load_llm_scheduler` configures it from the environment.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_GEMINI_MODEL = "models/gemini-2.5-flash"
+
+
+class LLMError(RuntimeError):
+    """Raised when the generative model fails to produce a response.
+
+    Args:
+        message: Description of the failure.
+        retryable: True for transient failures (throttling, overload,
+            timeouts) that may succeed when retried later.
+    """
+
+    def __init__(self, message: str, retryable: bool = False) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LLMClient:
+    """Interface for text generation backends."""
+
+    name = "llm"
+
+    def generate(self, prompt: str) -> str:
+        """Return the full response text for ``prompt``."""
+        raise NotImplementedError
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the response for ``prompt`` in chunks.
+
+        The default implementation yields the complete response at once.
+        """
+        yield self.generate(prompt)
+
+
+###############################################################################
+# Gemini
+###############################################################################
+
+class GeminiClient(LLMClient):
+    """Google Gemini via ``google.generativeai``.
+
+    Args:
+        api_key: The Gemini API key.
+        model_name: Model to use; the flash model keeps latency low.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = DEFAULT_GEMINI_MODEL) -> None:
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        try:
+            response = self._model.generate_content(prompt)
+            return response.text
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(str(e), retryable=_is_transient(e)) from e
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        try:
+            for chunk in self._model.generate_content(prompt, stream=True):
+                yield chunk.text
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(str(e), retryable=_is_transient(e)) from e
+
+
+# google.api_core exception classes for throttling and server‑side trouble
+_TRANSIENT_ERRORS = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "GatewayTimeout",
+}
+
+
+_TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    # google.api_core errors carry the HTTP status in ``code``; HTTP client
+    # errors in ``status_code`` or on their response
+    for holder in (error, getattr(error, "response", None)):
+        for attr in ("code", "status_code"):
+            value = getattr(holder, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def _is_transient(error: Exception) -> bool:
+    if type(error).__name__ in _TRANSIENT_ERRORS:
+        return True
+    return _status_code(error) in _TRANSIENT_STATUS
+
+
+###############################################################################
+# Local stand‑in
+###############################################################################
+
+class FakeLLMClient(LLMClient):
+    """Offline stand‑in that simulates latency, failures and streaming.
+
+    Replies are built from the prompt so they are deterministic for a given
+    input, but carry no meaning.
+
+    Args:
+        latency_ms: Median latency of a full response in milliseconds.
+        distribution: ``lognormal``, ``uniform`` or ``constant``.
+        sigma: Shape of the lognormal distribution (larger = heavier tail).
+        failure_rate: Probability in ``[0, 1]`` that a call raises
+            :class:`LLMError` after its latency has elapsed.
+        stream_chunks: Number of chunks :meth:`stream` splits a reply into.
+        seed: Seed for the latency and failure draws.
+        capacity: Optional number of calls the simulated provider serves at
+            once.  Calls beyond it are throttled like a quota‑limited API:
+            they fail with a retryable 429 after ``throttle_ms``.
+        throttle_ms: Latency of a throttled call.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        distribution: str = "lognormal",
+        sigma: float = 0.5,
+        failure_rate: float = 0.0,
+        stream_chunks: int = 8,
+        seed: int = 0,
+        capacity: Optional[int] = None,
+        throttle_ms: float = 50.0,
+    ) -> None:
+        if distribution not in {"lognormal", "uniform", "constant"}:
+            raise ValueError(f"Unknown latency distribution: {distribution!r}")
+        if not 0.0 <= failure_rate <= 1.0:
+            raise ValueError("failure_rate must be between 0 and 1")
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self.stream_chunks = max(1, stream_chunks)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.capacity = capacity
+        self.throttle_ms = throttle_ms
+        self.calls = 0
+        self.failures = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _draw(self) -> Tuple[float, bool]:
+        """Draw a latency in seconds and whether this call fails."""
+        with self._rng_lock:
+            if self.distribution == "constant":
+                latency = self.latency_ms
+            elif self.distribution == "uniform":
+                latency = self._rng.uniform(0.0, 2.0 * self.latency_ms)
+            else:
+                latency = self.latency_ms * math.exp(self._rng.gauss(0.0, self.sigma))
+            failed = self._rng.random() < self.failure_rate
+            self.calls += 1
+            if failed:
+                self.failures += 1
+        return latency / 1000.0, failed
+
+    @staticmethod
+    def _reply(prompt: str) -> str:
+        marker = "Current student message:"
+        start = prompt.find(marker)
+        message = prompt[start + len(marker) :].strip().split("\n", 1)[0] if start >= 0 else ""
+        return (
+            f"[fake reply to a {len(prompt)}-character prompt] "
+            f"You asked: {message[:200]}"
+        ).strip()
+
+    def _admit(self) -> None:
+        """Count the call in flight, or throttle it when over capacity."""
+        with self._rng_lock:
+            throttled = self.capacity is not None and self.in_flight >= self.capacity
+            if throttled:
+                self.throttled += 1
+            else:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        if throttled:
+            time.sleep(self.throttle_ms / 1000.0)
+            raise LLMError("429 Too many concurrent requests (simulated)", retryable=True)
+
+    def _leave(self) -> None:
+        with self._rng_lock:
+            self.in_flight -= 1
+
+    def generate(self, prompt: str) -> str:
+        self._admit()
+        try:
+            latency, failed = self._draw()
+            time.sleep(latency)
+        finally:
+            self._leave()
+        if failed:
+            raise LLMError("429 Resource has been exhausted (simulated)", retryable=True)
+        return self._reply(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        latency, failed = self._draw()
+        reply = self._reply(prompt)
+        # Time to first chunk takes a third of the latency, the rest is
+        # spread evenly over the remaining chunks.
+        time.sleep(latency / 3.0)
+        if failed:
+            raise LLMError("429 Resource has been exhausted (simulated)", retryable=True)
+        size = max(1, math.ceil(len(reply) / self.stream_chunks))
+        pieces = [reply[i : i + size] for i in range(0, len(reply), size)]
+        per_chunk = (2.0 * latency / 3.0) / max(len(pieces), 1)
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(per_chunk)
+            yield piece
+
+
+###############################################################################
+# Scheduling
+###############################################################################
+
+# Queue priorities; lower values are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class LLMUnavailableError(LLMError):
+    """The call was not attempted or not completed because of overload.
+
+    Attributes:
+        retry_after: Suggested number of seconds before trying again.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0) -> None:
+        super().__init__(message, retryable=True)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class LLMDeadlineExceeded(LLMUnavailableError):
+    """Raised when a call cannot finish before its deadline."""
+
+
+class AIMDLimiter:
+    """Additive‑increase / multiplicative‑decrease concurrency limit.
+
+    Every successful call raises the limit by ``increase / limit`` (about
+    ``increase`` per round of calls); a throttled call, or a success slower
+    than ``latency_target``, multiplies it by ``backoff``.  Decreases are
+    applied at most once per observed call latency so one burst of
+    failures from the same window only counts once.
+
+    Args:
+        initial: Starting limit.
+        minimum: Lowest limit.
+        maximum: Highest limit.
+        increase: Additive step per round of successful calls.
+        backoff: Multiplicative factor applied on congestion.
+        latency_target: Optional latency in seconds above which a
+            successful call is treated as a congestion signal.
+    """
+
+    def __init__(
+        self,
+        initial: float = 8.0,
+        minimum: float = 1.0,
+        maximum: float = 64.0,
+        increase: float = 1.0,
+        backoff: float = 0.9,
+        latency_target: Optional[float] = None,
+    ) -> None:
+        if not 0 < minimum <= initial <= maximum:
+            raise ValueError("Expected 0 < minimum <= initial <= maximum")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.increase = increase
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self._last_decrease = 0.0
+        self._smoothed_latency = 1.0
+
+    def on_success(self, latency: float) -> None:
+        self._smoothed_latency = 0.8 * self._smoothed_latency + 0.2 * latency
+        if self.latency_target is not None and latency > self.latency_target:
+            self.on_congestion()
+            return
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def on_congestion(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self._smoothed_latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.backoff)
+
+
+class CircuitBreaker:
+    """Fails calls fast after repeated provider failures.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds.  It then lets a single
+    probe through (half‑open); success closes it, failure opens it again.
+
+    Args:
+        failure_threshold: Consecutive failures that open the breaker.
+        reset_timeout: Seconds to stay open before probing.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.opens = 0
+        self._failures = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def retry_after(self) -> float:
+        if self.state != self.OPEN:
+            return 1.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def release_probe(self) -> None:
+        """Let another call probe if this one ended without an outcome."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probing = False
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LLMScheduler:
+    """Asynchronous front door for all outbound LLM calls.
+
+    Calls wait in a priority queue for a slot under the adaptive
+    concurrency limit, run the (blocking) client on a private thread pool,
+    and are retried with full‑jitter exponential backoff when the provider
+    throttles them – but only while the retry can still finish before the
+    caller's deadline.  A circuit breaker rejects calls outright while the
+    provider keeps failing.
+
+    All methods must be called from the same event loop.
+
+    Args:
+        client: The :class:`LLMClient` to call.
+        limiter: Concurrency limiter; defaults to :class:`AIMDLimiter`.
+        breaker: Circuit breaker; defaults to :class:`CircuitBreaker`.
+        max_attempts: Attempts per call, including the first.
+        base_backoff: Backoff ceiling in seconds for the first retry; it
+            doubles per retry up to ``max_backoff``.
+        max_backoff: Largest backoff ceiling in seconds.
+        max_queue: Calls allowed to wait for a slot before new ones are
+            rejected.
+        enabled: With False the scheduler is a plain pass‑through (no
+            queue, limit, retries or breaker), for comparison runs.
+    """
+
+    def __init__(
+        self,
+        client: LLMClient,
+        limiter: Optional[AIMDLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        max_attempts: int = 4,
+        base_backoff: float = 0.25,
+        max_backoff: float = 8.0,
+        max_queue: int = 1000,
+        enabled: bool = True,
+    ) -> None:
+        self.client = client
+        self.limiter = limiter or AIMDLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max(1, max_attempts)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self.in_flight = 0
+        self._queue: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._sequence = itertools.count()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(math.ceil(self.limiter.maximum)) + 4,
+            thread_name_prefix="study-buddy-llm",
+        )
+        self._rng = random.Random()
+        self.counters: Dict[str, int] = {
+            "calls": 0,
+            "succeeded": 0,
+            "retries": 0,
+            "throttled": 0,
+            "failed": 0,
+            "deadline_exceeded": 0,
+            "circuit_rejected": 0,
+            "queue_rejected": 0,
+        }
+        self.queue_wait_seconds_total = 0.0
+
+    # -- slots -------------------------------------------------------------
+
+    def queued(self, priority: Optional[int] = None) -> int:
+        waiting = [entry for entry in self._queue if not entry[2].done()]
+        if priority is None:
+            return len(waiting)
+        return sum(1 for entry in waiting if entry[0] == priority)
+
+    async def _acquire(self, priority: int, deadline: float) -> None:
+        loop = asyncio.get_running_loop()
+        if self.in_flight < int(self.limiter.limit) and not self.queued():
+            self.in_flight += 1
+            return
+        if self.queued() >= self.max_queue:
+            self.counters["queue_rejected"] += 1
+            raise LLMUnavailableError("LLM queue is full", retry_after=1.0)
+        waiter: "asyncio.Future[None]" = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.counters["deadline_exceeded"] += 1
+            raise LLMDeadlineExceeded("Timed out waiting for an LLM slot", retry_after=2.0)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._queue and self.in_flight < int(self.limiter.limit):
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    # -- calls -------------------------------------------------------------
+
+    async def generate(
+        self,
+        prompt: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: float = 30.0,
+    ) -> str:
+        """Generate a response for ``prompt`` within ``timeout`` seconds.
+
+        Args:
+            prompt: The full prompt.
+            priority: Queue priority; :data:`PRIORITY_INTERACTIVE` for chat
+                and questions, :data:`PRIORITY_BATCH` for summaries.
+            timeout: Deadline for the whole call, queueing and retries
+                included.
+
+        Raises:
+            LLMUnavailableError: When the call was rejected (breaker open,
+                queue full) or ran out of time; ``retry_after`` says when
+                to try again.
+            LLMError: When the provider failed for good.
+        """
+        loop = asyncio.get_running_loop()
+        self.counters["calls"] += 1
+        if not self.enabled:
+            return await loop.run_in_executor(self._executor, self.client.generate, prompt)
+        deadline = loop.time() + timeout
+        last_error: Optional[LLMError] = None
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                self.counters["circuit_rejected"] += 1
+                raise CircuitOpenError(
+                    "LLM provider is failing; circuit breaker is open",
+                    retry_after=self.breaker.retry_after(),
+                )
+            # Whatever happens below, a half‑open probe must not stay taken,
+            # or the breaker would reject every later call
+            try:
+                queued_at = loop.time()
+                # A full queue or a slot wait past the deadline is local
+                # overload, not a provider failure; only _attempt outcomes
+                # feed the breaker
+                await self._acquire(priority, deadline)
+                self.queue_wait_seconds_total += loop.time() - queued_at
+                try:
+                    result = await self._attempt(prompt, deadline)
+                except LLMError as e:
+                    last_error = e
+                    if isinstance(e, LLMDeadlineExceeded):
+                        # Already counted as deadline_exceeded
+                        self.breaker.record_failure()
+                        raise
+                    if not e.retryable:
+                        self.breaker.record_failure()
+                        self.counters["failed"] += 1
+                        raise
+                    self.counters["throttled"] += 1
+                    self.limiter.on_congestion()
+                    self.breaker.record_failure()
+                else:
+                    return result
+            finally:
+                self.breaker.release_probe()
+            # Full jitter: sleep uniformly up to the exponential ceiling
+            ceiling = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+            backoff = self._rng.uniform(0, ceiling)
+            if attempt + 1 >= self.max_attempts or loop.time() + backoff >= deadline:
+                break
+            self.counters["retries"] += 1
+            await asyncio.sleep(backoff)
+        self.counters["failed"] += 1
+        raise LLMUnavailableError(
+            f"LLM call failed after retries: {last_error}", retry_after=self.base_backoff * 4
+        )
+
+    async def _attempt(self, prompt: str, deadline: float) -> str:
+        """Run one call in the thread pool, holding a slot until it ends."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        future = loop.run_in_executor(self._executor, self.client.generate, prompt)
+        abandoned = False
+
+        def finished(done: "asyncio.Future[str]") -> None:
+            # Runs when the thread really finishes, even after a timeout, so
+            # the limiter never sees more concurrency than it allowed
+            error = done.exception() if not done.cancelled() else None
+            if error is None and not done.cancelled():
+                self.limiter.on_success(loop.time() - started)
+                self.breaker.record_success()
+                self.counters["succeeded"] += 1
+            elif error is not None and abandoned:
+                # Nobody awaits this call any more; its failure still counts
+                self.breaker.record_failure()
+            self._release()
+
+        future.add_done_callback(finished)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), timeout=max(0.0, deadline - loop.time())
+            )
+        except asyncio.TimeoutError:
+            abandoned = True
+            self.counters["deadline_exceeded"] += 1
+            raise LLMDeadlineExceeded("LLM call did not finish before its deadline", retry_after=2.0)
+        except asyncio.CancelledError:
+            abandoned = True
+            raise
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(str(e)) from e
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the limit, occupancy, breaker state and counters."""
+        return {
+            "enabled": self.enabled,
+            "limit": self.limiter.limit,
+            "in_flight": self.in_flight,
+            "queued_interactive": self.queued(PRIORITY_INTERACTIVE),
+            "queued_batch": self.queued(PRIORITY_BATCH),
+            "breaker_state": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "queue_wait_seconds_total": self.queue_wait_seconds_total,
+            **self.counters,
+        }
+
+
+###############################################################################
+# Factory
+###############################################################################
+
+def load_llm_client(api_key: Optional[str] = None) -> LLMClient:
+    """Create the LLM client selected by ``STUDY_BUDDY_LLM``.
+
+    Args:
+        api_key: Gemini API key; defaults to ``GEMINI_API_KEY``.
+
+    Raises:
+        RuntimeError: If Gemini is selected but no API key is available or
+            the client cannot be initialised.
+    """
+    kind = os.environ.get("STUDY_BUDDY_LLM", "gemini").lower()
+    if kind == "fake":
+        capacity = os.environ.get("STUDY_BUDDY_FAKE_LLM_CAPACITY")
+        return FakeLLMClient(
+            latency_ms=float(os.environ.get("STUDY_BUDDY_FAKE_LLM_LATENCY_MS", "800")),
+            distribution=os.environ.get("STUDY_BUDDY_FAKE_LLM_DISTRIBUTION", "lognormal"),
+            sigma=float(os.environ.get("STUDY_BUDDY_FAKE_LLM_SIGMA", "0.5")),
+            failure_rate=float(os.environ.get("STUDY_BUDDY_FAKE_LLM_FAILURE_RATE", "0")),
+            seed=int(os.environ.get("STUDY_BUDDY_FAKE_LLM_SEED", "0")),
+            capacity=int(capacity) if capacity else None,
+        )
+    if kind != "gemini":
+        raise RuntimeError(f"Unknown STUDY_BUDDY_LLM value: {kind!r}")
+    api_key = api_key or os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError(
+            "Environment variable GEMINI_API_KEY is not set. "
+            "Make sure it's in your .env file."
+        )
+    try:
+        return GeminiClient(api_key)
+    except Exception as e:
+        raise RuntimeError(f"Failed to initialise the Gemini client: {e}")
+
+
+def load_llm_scheduler(client: LLMClient) -> LLMScheduler:
+    """Create the scheduler for ``client`` from ``STUDY_BUDDY_LLM_*`` variables.
+
+    ``STUDY_BUDDY_LLM_SCHEDULER=0`` turns it into a pass‑through.  The
+    limit starts at ``STUDY_BUDDY_LLM_CONCURRENCY`` (default 8) and moves
+    between 1 and ``STUDY_BUDDY_LLM_MAX_CONCURRENCY`` (default 64);
+    ``STUDY_BUDDY_LLM_LATENCY_TARGET_MS`` optionally treats slow responses
+    as congestion.  ``STUDY_BUDDY_LLM_MAX_ATTEMPTS`` (default 4),
+    ``STUDY_BUDDY_LLM_BREAKER_FAILURES`` (default 5) and
+    ``STUDY_BUDDY_LLM_BREAKER_RESET_S`` (default 10) tune retries and the
+    circuit breaker.
+    """
+    maximum = float(os.environ.get("STUDY_BUDDY_LLM_MAX_CONCURRENCY", "64"))
+    latency_target = os.environ.get("STUDY_BUDDY_LLM_LATENCY_TARGET_MS")
+    return LLMScheduler(
+        client,
+        limiter=AIMDLimiter(
+            initial=min(maximum, float(os.environ.get("STUDY_BUDDY_LLM_CONCURRENCY", "8"))),
+            maximum=maximum,
+            latency_target=float(latency_target) / 1000.0 if latency_target else None,
+        ),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get("STUDY_BUDDY_LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.environ.get("STUDY_BUDDY_LLM_BREAKER_RESET_S", "10")),
+        ),
+        max_attempts=int(os.environ.get("STUDY_BUDDY_LLM_MAX_ATTEMPTS", "4")),
+        enabled=os.environ.get("STUDY_BUDDY_LLM_SCHEDULER", "1").lower() not in {"0", "false", "no"},
+    )
@@ -0,0 +1,336 @@
+"""
+Study Buddy Load Test
+=====================
+
+Drives the Study Buddy FastAPI app with many concurrent simulated students
+and reports throughput, latency percentiles and error rates per endpoint.
+
+Each student uploads a synthetic set of notes, then loops over a weighted
+mix of actions until the run ends:
+
+* ``chat`` – ``POST /api/chat`` (with or without ``use_notes``)
+* ``ask`` – ``POST /api/notes/ask``
+* ``upload`` – ``POST /api/notes/upload``
+* ``summary`` – ``POST /api/notes/summary``
+
+By default the app is loaded in‑process with the local LLM stand‑in from
+``study_buddy_llm`` and the stub models from ``study_buddy_models``, so a
+run costs no Gemini quota and needs no network.  The stand‑in's latency
+distribution and failure rate are set with ``--llm-latency-ms``,
+``--llm-distribution`` and ``--llm-failure-rate``; ``--llm-capacity`` makes
+it throttle (HTTP 429‑style, retryable) beyond that many concurrent calls,
+like a rate‑limited Gemini quota.  ``--no-scheduler`` bypasses the
+backend's LLM scheduler to compare overload behaviour with and without it.
+Use ``--url`` to target a running server instead (configure that server's
+LLM through its own environment).
+
+LLM failures surface as HTTP errors: 503 when the backend is overloaded or
+the provider keeps failing, 504 when a call misses its deadline.
+
+Examples:
+
+```
+python study_buddy_loadtest.py --students 50 --duration 30
+python study_buddy_loadtest.py --students 200 --mix chat=70,ask=20,summary=10 --llm-failure-rate 0.05
+python study_buddy_loadtest.py --students 300 --think-ms 0 --llm-capacity 16 --no-scheduler
+python study_buddy_loadtest.py --url http://localhost:8001 --students 20 --output run.json
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from study_buddy_benchmark import summarize, synthetic_document, synthetic_messages
+
+DEFAULT_MIX = "chat=60,ask=20,upload=10,summary=10"
+
+
+class Recorder:
+    """Collects per‑endpoint latencies and outcomes."""
+
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, action: str, seconds: float, error: Optional[str]) -> None:
+        self.samples.setdefault(action, []).append(seconds)
+        counts = self.errors.setdefault(action, {})
+        if error is not None:
+            counts[error] = counts.get(error, 0) + 1
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        endpoints: Dict[str, Any] = {}
+        all_samples: List[float] = []
+        all_errors = 0
+        for action, samples in sorted(self.samples.items()):
+            errors = sum(self.errors.get(action, {}).values())
+            metrics = summarize(samples, wall_seconds)
+            metrics["errors"] = errors
+            metrics["error_rate"] = errors / len(samples) if samples else 0.0
+            metrics["error_kinds"] = dict(self.errors.get(action, {}))
+            endpoints[action] = metrics
+            all_samples.extend(samples)
+            all_errors += errors
+        overall = summarize(all_samples, wall_seconds)
+        overall["errors"] = all_errors
+        overall["error_rate"] = all_errors / len(all_samples) if all_samples else 0.0
+        return {"overall": overall, "endpoints": endpoints}
+
+
+def parse_mix(value: str) -> List[Tuple[str, float]]:
+    """Parse ``chat=60,ask=20`` into weighted actions."""
+    mix = []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in {"chat", "ask", "upload", "summary"}:
+            raise argparse.ArgumentTypeError(f"Unknown action in mix: {name!r}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+###############################################################################
+# Simulated student
+###############################################################################
+
+async def _call(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    action: str,
+    method: str,
+    url: str,
+    **kwargs: Any,
+) -> None:
+    started = time.perf_counter()
+    error: Optional[str] = None
+    try:
+        response = await client.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            error = f"http_{response.status_code}"
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    recorder.record(action, time.perf_counter() - started, error)
+
+
+async def student(
+    index: int,
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    mix: List[Tuple[str, float]],
+    deadline: float,
+    think_seconds: float,
+    seed: int,
+    document_words: int,
+) -> None:
+    rng = random.Random(seed * 100_003 + index)
+    user_id = 10_000 + index
+    session_id = f"loadtest_{seed}_{index}"
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    async def upload() -> None:
+        document = synthetic_document(rng, document_words)
+        await _call(
+            client,
+            recorder,
+            "upload",
+            "POST",
+            "/api/notes/upload",
+            data={"user_id": str(user_id)},
+            files={"file": (f"notes_{index}.txt", document.encode("utf-8"), "text/plain")},
+        )
+
+    # Every student starts with some notes so ask/summary have context.
+    await upload()
+    while time.perf_counter() < deadline:
+        action = rng.choices(names, weights)[0]
+        if action == "chat":
+            await _call(
+                client,
+                recorder,
+                "chat",
+                "POST",
+                "/api/chat",
+                json={
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "message": synthetic_messages(rng, 1)[0],
+                    "personality_mode": rng.choice("123"),
+                    "use_notes": rng.random() < 0.3,
+                },
+            )
+        elif action == "ask":
+            await _call(
+                client,
+                recorder,
+                "ask",
+                "POST",
+                "/api/notes/ask",
+                json={
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "question": synthetic_messages(rng, 1)[0],
+                    "personality_mode": rng.choice("123"),
+                },
+            )
+        elif action == "upload":
+            await upload()
+        else:
+            await _call(
+                client,
+                recorder,
+                "summary",
+                "POST",
+                "/api/notes/summary",
+                json={"user_id": user_id, "personality_mode": rng.choice("123")},
+            )
+        if think_seconds > 0:
+            await asyncio.sleep(rng.expovariate(1.0 / think_seconds))
+
+
+###############################################################################
+# Driver
+###############################################################################
+
+def _in_process_transport(args: argparse.Namespace) -> httpx.AsyncBaseTransport:
+    """Import the backend with offline models and the LLM stand‑in."""
+    os.environ["STUDY_BUDDY_LLM"] = "fake"
+    os.environ["STUDY_BUDDY_FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["STUDY_BUDDY_FAKE_LLM_DISTRIBUTION"] = args.llm_distribution
+    os.environ["STUDY_BUDDY_FAKE_LLM_FAILURE_RATE"] = str(args.llm_failure_rate)
+    os.environ["STUDY_BUDDY_FAKE_LLM_SEED"] = str(args.seed)
+    if args.llm_capacity:
+        os.environ["STUDY_BUDDY_FAKE_LLM_CAPACITY"] = str(args.llm_capacity)
+    if args.no_scheduler:
+        os.environ["STUDY_BUDDY_LLM_SCHEDULER"] = "0"
+    if not args.real_models:
+        os.environ["STUDY_BUDDY_STUB_MODELS"] = "1"
+    import study_buddy_backend as backend
+
+    return httpx.ASGITransport(app=backend.app)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        client = httpx.AsyncClient(
+            transport=_in_process_transport(args),
+            base_url="http://study-buddy.local",
+            timeout=args.timeout,
+        )
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    async with client:
+        await asyncio.gather(
+            *(
+                student(
+                    i,
+                    client,
+                    recorder,
+                    args.mix,
+                    deadline,
+                    args.think_ms / 1000.0,
+                    args.seed,
+                    args.document_words,
+                )
+                for i in range(args.students)
+            )
+        )
+    wall = time.perf_counter() - started
+    report = recorder.report(wall)
+    report["meta"] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "target": args.url or "in-process",
+        "students": args.students,
+        "duration_s": args.duration,
+        "wall_s": wall,
+        "mix": dict(args.mix),
+        "think_ms": args.think_ms,
+        "seed": args.seed,
+        "llm": None
+        if args.url
+        else {
+            "latency_ms": args.llm_latency_ms,
+            "distribution": args.llm_distribution,
+            "failure_rate": args.llm_failure_rate,
+            "capacity": args.llm_capacity,
+            "scheduler": not args.no_scheduler,
+        },
+    }
+    return report
+
+
+def _print_table(report: Dict[str, Any]) -> None:
+    rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+    header = ("endpoint", "n", "rps", "p50 ms", "p95 ms", "p99 ms", "errors")
+    print("{:<10} {:>7} {:>8} {:>9} {:>9} {:>9} {:>8}".format(*header), file=sys.stderr)
+    for name, m in rows:
+        if not m.get("n"):
+            continue
+        print(
+            f"{name:<10} {m['n']:>7} {m['throughput_per_s']:>8.1f} {m['p50_ms']:>9.1f} "
+            f"{m['p95_ms']:>9.1f} {m['p99_ms']:>9.1f} {m['error_rate']:>7.1%}",
+            file=sys.stderr,
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Study Buddy end‑to‑end load test")
+    parser.add_argument("--students", type=int, default=20, help="Concurrent simulated students")
+    parser.add_argument("--duration", type=float, default=20.0, help="Run length in seconds")
+    parser.add_argument(
+        "--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help="Action weights"
+    )
+    parser.add_argument("--think-ms", type=float, default=500.0, help="Mean pause between actions")
+    parser.add_argument("--document-words", type=int, default=1500, help="Words per uploaded file")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for students and the LLM stand‑in")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per‑request timeout (s)")
+    parser.add_argument("--url", help="Base URL of a running server (default: in‑process)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="Stand‑in median latency")
+    parser.add_argument(
+        "--llm-distribution",
+        default="lognormal",
+        choices=["lognormal", "uniform", "constant"],
+        help="Stand‑in latency distribution",
+    )
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Stand‑in failure rate")
+    parser.add_argument(
+        "--llm-capacity", type=int, help="Concurrent calls the stand‑in serves before throttling"
+    )
+    parser.add_argument(
+        "--no-scheduler", action="store_true", help="Bypass the backend's LLM scheduler"
+    )
+    parser.add_argument(
+        "--real-models", action="store_true", help="Use DistilBERT/MiniLM in‑process"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    _print_table(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Study Buddy Memory Introspection
+================================
+
+Helpers behind the backend's ``/admin/memory`` endpoint, which attributes
+the process's memory to the things that hold it:
+
+* :func:`process_memory` – resident set size of the whole process.
+* :func:`shared_memory` – resident memory of any process split into
+  shared and private pages, for forked workers that share model weights.
+* :func:`deep_sizeof` – bytes held by plain Python containers such as the
+  conversation histories (lists of dicts of strings).
+* :func:`model_memory` – parameter and buffer bytes of a loaded model.
+  Works for PyTorch modules, Hugging Face pipelines (through their
+  ``.model``) and SentenceTransformer; stand‑in models report zero.
+* :class:`TracemallocTracker` – start ``tracemalloc``, then diff later
+  snapshots against the first one to find the code that keeps allocating.
+
+Note store sizes come from ``NoteStore.memory_report()`` in
+``study_buddy_store.py``.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """Return the current and peak resident set size in bytes.
+
+    The current RSS is read from ``/proc/self/statm``; either value is
+    ``None`` where the platform does not provide it.
+    """
+    rss: Optional[int] = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    peak_bytes: Optional[int] = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_bytes = peak if sys.platform == "darwin" else peak * 1024
+    return {"rss_bytes": rss, "peak_rss_bytes": peak_bytes}
+
+
+_SMAPS_FIELDS = {
+    "Rss": "rss_bytes",
+    "Pss": "pss_bytes",
+    "Shared_Clean": "shared_bytes",
+    "Shared_Dirty": "shared_bytes",
+    "Private_Clean": "private_bytes",
+    "Private_Dirty": "private_bytes",
+}
+
+
+def shared_memory(pid: Any = "self") -> Optional[Dict[str, int]]:
+    """Return the RSS of a process split by how its pages are shared.
+
+    Reads ``/proc/<pid>/smaps_rollup`` (Linux 4.14+).  ``pss_bytes`` charges
+    each shared page to its sharers in equal parts, so the PSS of forked
+    workers adds up to the memory they really use together;
+    ``shared_bytes`` are pages also mapped by another process (weights
+    inherited from the parent) and ``private_bytes`` are pages only this
+    process holds (its own heap and any copy‑on‑write copies).
+
+    Args:
+        pid: Process id, or ``"self"``.
+
+    Returns:
+        ``rss_bytes``, ``pss_bytes``, ``shared_bytes`` and
+        ``private_bytes``, or ``None`` where the file cannot be read.
+    """
+    report = dict.fromkeys(_SMAPS_FIELDS.values(), 0)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                key = _SMAPS_FIELDS.get(name)
+                if key is not None:
+                    report[key] += int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return report
+
+
+def deep_sizeof(obj: Any, _seen: Optional[set] = None) -> int:
+    """Approximate the bytes held by ``obj`` and everything it contains.
+
+    Follows dicts, lists, tuples and sets; NumPy arrays count their data
+    buffer.  Shared objects are counted once.
+    """
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in list(obj.items()))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in list(obj))
+    return size
+
+
+def model_memory(model: Any) -> Dict[str, Any]:
+    """Count the parameters and buffers of a loaded model.
+
+    Args:
+        model: A ``torch.nn.Module``, a Hugging Face pipeline or any other
+            object.  Objects without PyTorch weights report zeros.
+
+    Returns:
+        A dictionary with the model class, parameter and buffer counts and
+        bytes, and the bytes per dtype and device.
+    """
+    module = getattr(model, "model", model)
+    report: Dict[str, Any] = {
+        "class": type(model).__name__,
+        "parameters": 0,
+        "parameter_bytes": 0,
+        "buffers": 0,
+        "buffer_bytes": 0,
+        "bytes_by_dtype": {},
+        "bytes_by_device": {},
+    }
+    if not (hasattr(module, "parameters") and hasattr(module, "buffers")):
+        return report
+    for kind, tensors in (("parameter", module.parameters()), ("buffer", module.buffers())):
+        for tensor in tensors:
+            nbytes = tensor.numel() * tensor.element_size()
+            report[f"{kind}s"] += tensor.numel()
+            report[f"{kind}_bytes"] += nbytes
+            dtype = str(tensor.dtype).replace("torch.", "")
+            device = str(tensor.device)
+            report["bytes_by_dtype"][dtype] = report["bytes_by_dtype"].get(dtype, 0) + nbytes
+            report["bytes_by_device"][device] = report["bytes_by_device"].get(device, 0) + nbytes
+    return report
+
+
+class TracemallocTracker:
+    """Compare tracemalloc snapshots against a baseline.
+
+    ``start()`` begins tracing and records the baseline; each ``diff()``
+    lists the source lines whose allocations grew the most since then.
+    Tracing slows allocations noticeably, so stop it when done.
+
+    Args:
+        frames: Number of stack frames stored per allocation.
+    """
+
+    def __init__(self, frames: int = 10) -> None:
+        self.frames = frames
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing() and self._baseline is not None
+
+    def start(self) -> Dict[str, Any]:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+            self._baseline = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "traced_bytes": current, "traced_peak_bytes": peak}
+
+    def diff(self, limit: int = 25) -> Dict[str, Any]:
+        """Return the top allocation growth since :meth:`start`.
+
+        Raises:
+            RuntimeError: If tracing has not been started.
+        """
+        with self._lock:
+            if not self.active:
+                raise RuntimeError("tracemalloc tracking has not been started")
+            snapshot = tracemalloc.take_snapshot()
+            filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+            stats = snapshot.filter_traces(filters).compare_to(
+                self._baseline.filter_traces(filters), "lineno"  # type: ignore[union-attr]
+            )
+            current, peak = tracemalloc.get_traced_memory()
+        top: List[Dict[str, Any]] = []
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            top.append(
+                {
+                    "location": f"{frame.filename}:{frame.lineno}",
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff,
+                }
+            )
+        return {
+            "tracing": True,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "growth_bytes": sum(stat.size_diff for stat in stats),
+            "top": top,
+        }
+
+    def stop(self) -> Dict[str, Any]:
+        with self._lock:
+            self._baseline = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        return {"tracing": False}
@@ -0,0 +1,324 @@
+"""
+Study Buddy Metrics
+===================
+
+A tiny, dependency‑free metrics library that renders the Prometheus text
+exposition format (version 0.0.4), so any Prometheus‑compatible scraper can
+read the backend's ``/metrics`` endpoint without an external client library
+or metrics service.
+
+Three metric types are supported:
+
+* :class:`Counter` – monotonically increasing totals.
+* :class:`Gauge` – values that go up and down.  Gauges (and counters) can be
+  backed by a callback that is evaluated at scrape time, which is how store
+  sizes and session counts are exported without touching the hot path.
+* :class:`Histogram` – cumulative bucket counts plus ``_sum``/``_count``.
+
+Labels are passed as keyword arguments (``hist.observe(0.2, stage="embed")``).
+
+:class:`StageTimer` ties two histograms together for per‑stage request
+timing.  ``with timer.endpoint("/api/chat"):`` times a whole request and
+records the endpoint name in a context variable; ``with
+timer.stage("embed"):`` inside it (including in helpers called from the
+endpoint) times one stage and labels it with that endpoint.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Latency buckets in seconds, from sub‑millisecond model calls up to slow
+# LLM responses.
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+CallbackResult = Union[float, Dict[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+###############################################################################
+# Metric types
+###############################################################################
+
+class Registry:
+    """A collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Return all metrics in Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _ValueMetric(_Metric):
+    """Shared implementation of counters and gauges."""
+
+    def __init__(self, *args: object, **kwargs: object) -> None:
+        super().__init__(*args, **kwargs)  # type: ignore[arg-type]
+        self._values: Dict[LabelValues, float] = {}
+        self._callback: Optional[Callable[[], CallbackResult]] = None
+
+    def set_function(self, callback: Callable[[], CallbackResult]) -> None:
+        """Compute the value at scrape time.
+
+        The callback returns a single number for an unlabelled metric, or a
+        mapping from label‑value tuples to numbers.
+        """
+        self._callback = callback
+
+    def _snapshot(self) -> Dict[LabelValues, float]:
+        if self._callback is not None:
+            try:
+                result = self._callback()
+            except Exception:
+                return {}
+            if isinstance(result, dict):
+                return {tuple(str(v) for v in key): float(val) for key, val in result.items()}
+            return {(): float(result)}
+        with self._lock:
+            return dict(self._values)
+
+    def value(self, **labels: str) -> float:
+        """Return the current value (mainly for tests and debugging)."""
+        return self._snapshot().get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(val)}"
+            for key, val in sorted(self._snapshot().items())
+        ]
+
+
+class Counter(_ValueMetric):
+    """A monotonically increasing total."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    """A value that can go up and down."""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed upper bounds."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional[Registry] = REGISTRY,
+    ) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per‑bucket counts incl. +Inf, sum)
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[key] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the ``with`` block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        """Number of observations for the given labels."""
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def total(self, **labels: str) -> float:
+        """Sum of observations for the given labels."""
+        series = self._series.get(self._key(labels))
+        return series[1][0] if series else 0.0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        lines: List[str] = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+###############################################################################
+# Per‑stage request timing
+###############################################################################
+
+class StageTimer:
+    """Times requests and their stages into two labelled histograms.
+
+    Args:
+        requests: Histogram with an ``endpoint`` label for whole requests.
+        stages: Histogram with ``endpoint`` and ``stage`` labels.
+    """
+
+    def __init__(self, requests: Histogram, stages: Histogram) -> None:
+        self.requests = requests
+        self.stages = stages
+        self._endpoint: contextvars.ContextVar[str] = contextvars.ContextVar(
+            f"{stages.name}_endpoint", default="none"
+        )
+
+    @property
+    def current_endpoint(self) -> str:
+        return self._endpoint.get()
+
+    @contextmanager
+    def endpoint(self, name: str) -> Iterator[None]:
+        """Time a request and label nested stages with ``name``."""
+        token = self._endpoint.set(name)
+        try:
+            with self.requests.time(endpoint=name):
+                yield
+        finally:
+            self._endpoint.reset(token)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Record a stage duration measured by the caller."""
+        self.stages.observe(seconds, endpoint=self._endpoint.get(), stage=stage)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time one stage of the current request."""
+        with self.stages.time(endpoint=self._endpoint.get(), stage=name):
+            yield
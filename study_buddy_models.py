@@ -0,0 +1,263 @@
+"""
+Study Buddy Model Loading
+=========================
+
+Central place where the Study Buddy loads its local models: the DistilBERT
+emotion classifier and the MiniLM sentence embedder.
+
+Loading goes through :func:`load_emotion_classifier` and
+:func:`load_embedding_model` so the models can be swapped for deterministic
+stand‑ins.  With ``STUDY_BUDDY_STUB_MODELS=1`` in the environment (or
+``stub=True``) the loaders return :class:`StubEmotionClassifier` and
+:class:`StubEmbeddingModel`, which need neither PyTorch nor a network
+connection.  The stubs are meant for benchmarks and load tests: they are
+cheap, produce the same output for the same input on every run, and keep
+the call signatures of the real models so the rest of the backend does not
+know the difference.
+
+:class:`SharedTokenizer` lets the backend tokenize a chat message once and
+feed the same token ids to both models.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+# Hugging Face model ids used by the backend and the terminal client.
+EMOTION_MODEL_NAME = "bhadresh-savani/distilbert-base-uncased-emotion"
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Output dimension of all-MiniLM-L6-v2; the stub embedder matches it.
+EMBEDDING_DIM = 384
+
+EMOTION_LABELS = ("sadness", "joy", "love", "anger", "fear", "surprise")
+
+
+def stub_models_enabled() -> bool:
+    """Return True if ``STUDY_BUDDY_STUB_MODELS`` asks for stand‑in models."""
+    return os.environ.get("STUDY_BUDDY_STUB_MODELS", "").lower() in {"1", "true", "yes"}
+
+
+###############################################################################
+# Deterministic stand‑ins
+###############################################################################
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# A few cue words per emotion so the stub classifier gives plausible labels.
+_EMOTION_CUES: Dict[str, tuple] = {
+    "sadness": ("sad", "tired", "lonely", "down", "cry", "hopeless", "lost"),
+    "joy": ("happy", "great", "fun", "excited", "yay", "awesome", "glad"),
+    "love": ("love", "thank", "thanks", "grateful", "appreciate", "adore"),
+    "anger": ("angry", "hate", "stupid", "annoying", "frustrated", "mad"),
+    "fear": ("scared", "afraid", "nervous", "worried", "anxious", "exam"),
+    "surprise": ("wow", "surprised", "unexpected", "really", "whoa"),
+}
+
+
+def _stub_tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class StubEmotionClassifier:
+    """Keyword‑based stand‑in for the Hugging Face emotion pipeline.
+
+    Calling the object mirrors ``pipeline(..., top_k=None)``: a single
+    string yields ``[[{"label", "score"}, ...]]`` and a list of strings
+    yields one list of label/score dicts per input.
+    """
+
+    def _scores(self, text: str) -> List[Dict[str, Any]]:
+        return self.scores_from_tokens(_stub_tokenize(text))
+
+    def scores_from_tokens(self, tokens: List[str]) -> List[Dict[str, Any]]:
+        counts = {label: 1.0 for label in EMOTION_LABELS}
+        counts["joy"] += 0.5  # neutral text leans towards the backend's default
+        for token in tokens:
+            for label, cues in _EMOTION_CUES.items():
+                if token in cues:
+                    counts[label] += 2.0
+        total = sum(counts.values())
+        return [{"label": label, "score": counts[label] / total} for label in EMOTION_LABELS]
+
+    def __call__(self, inputs: Union[str, List[str]], **_: Any) -> List[Any]:
+        if isinstance(inputs, str):
+            return [self._scores(inputs)]
+        return [self._scores(text) for text in inputs]
+
+
+class StubEmbeddingModel:
+    """Hashing stand‑in for ``SentenceTransformer``.
+
+    Each token is hashed with CRC32 to a signed position in a
+    :data:`EMBEDDING_DIM`‑dimensional vector.  The result depends only on
+    the input text, so runs are reproducible across processes and machines.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM) -> None:
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        return self.embed_tokens(_stub_tokenize(text))
+
+    def embed_tokens(self, tokens: List[str]) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokens:
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vector
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        convert_to_numpy: bool = True,
+        **_: Any,
+    ) -> Any:
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        if not sentences:
+            matrix = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            matrix = np.stack([self._embed(s) for s in sentences])
+        return matrix if convert_to_numpy else list(matrix)
+
+
+###############################################################################
+# Shared tokenization
+###############################################################################
+
+class SharedTokenizer:
+    """Tokenize a message once for both the classifier and the embedder.
+
+    A chat message is classified and embedded as the same text.  When the
+    two models use the same vocabulary – as distilbert‑base‑uncased and
+    all‑MiniLM‑L6‑v2 do (both use the bert‑base‑uncased WordPiece
+    vocabulary) – the tokenizer output of one is valid input for the
+    other, so :meth:`encode` runs the tokenizer once and
+    :meth:`classify` / :meth:`embed` feed the ids straight to each model.
+    The stand‑in models share their regex tokenizer the same way.
+
+    :attr:`compatible` is False when the models cannot share tokens; callers
+    then use the models' own entry points.
+
+    Args:
+        classifier: The emotion classifier from :func:`load_emotion_classifier`.
+        embedder: The embedding model from :func:`load_embedding_model`.
+    """
+
+    def __init__(self, classifier: Any, embedder: Any) -> None:
+        self.classifier = classifier
+        self.embedder = embedder
+        self._stub = isinstance(classifier, StubEmotionClassifier) and isinstance(
+            embedder, StubEmbeddingModel
+        )
+        self.compatible = self._stub or self._same_vocabulary()
+
+    def _same_vocabulary(self) -> bool:
+        classifier_tokenizer = getattr(self.classifier, "tokenizer", None)
+        embedder_tokenizer = getattr(self.embedder, "tokenizer", None)
+        if classifier_tokenizer is None or embedder_tokenizer is None:
+            return False
+        if getattr(self.classifier, "model", None) is None:
+            return False
+        try:
+            same_casing = getattr(classifier_tokenizer, "do_lower_case", None) == getattr(
+                embedder_tokenizer, "do_lower_case", None
+            )
+            return same_casing and (
+                classifier_tokenizer.get_vocab() == embedder_tokenizer.get_vocab()
+            )
+        except Exception:
+            return False
+
+    def encode(self, text: str) -> Any:
+        """Tokenize ``text`` once; the result is opaque to callers."""
+        if self._stub:
+            return _stub_tokenize(text)
+        return self.classifier.tokenizer(text, truncation=True, return_tensors="pt")
+
+    def classify(self, tokens: Any) -> List[Dict[str, Any]]:
+        """Return ``[{"label", "score"}, ...]`` for tokens from :meth:`encode`."""
+        if self._stub:
+            return self.classifier.scores_from_tokens(tokens)
+        import torch
+
+        model = self.classifier.model
+        inputs = {
+            key: value.to(model.device)
+            for key, value in tokens.items()
+            if key in ("input_ids", "attention_mask")
+        }
+        with torch.no_grad():
+            probabilities = torch.softmax(model(**inputs).logits[0], dim=-1).tolist()
+        return [
+            {"label": model.config.id2label[index], "score": score}
+            for index, score in enumerate(probabilities)
+        ]
+
+    def embed(self, tokens: Any) -> np.ndarray:
+        """Return the sentence embedding for tokens from :meth:`encode`."""
+        if self._stub:
+            return self.embedder.embed_tokens(tokens)
+        import torch
+
+        limit = self.embedder.max_seq_length
+        input_ids = tokens["input_ids"]
+        attention_mask = tokens["attention_mask"]
+        if input_ids.shape[1] > limit:
+            # Truncate as the embedder's own tokenizer would: keep [SEP] last
+            input_ids = torch.cat([input_ids[:, : limit - 1], input_ids[:, -1:]], dim=1)
+            attention_mask = attention_mask[:, :limit]
+        features = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in tokens:
+            features["token_type_ids"] = torch.zeros_like(input_ids)
+        device = self.embedder.device
+        features = {key: value.to(device) for key, value in features.items()}
+        with torch.no_grad():
+            output = self.embedder(features)["sentence_embedding"][0]
+        return output.cpu().numpy()
+
+
+###############################################################################
+# Loaders
+###############################################################################
+
+def load_emotion_classifier(stub: Optional[bool] = None) -> Any:
+    """Load the emotion classifier, or its stand‑in.
+
+    The real model (distilbert‑base‑uncased‑emotion) has been fine‑tuned on
+    the Emotion dataset and returns a score for each of the six labels.
+
+    Args:
+        stub: Force the stand‑in on or off.  Defaults to
+            :func:`stub_models_enabled`.
+    """
+    use_stub = stub_models_enabled() if stub is None else stub
+    if use_stub:
+        return StubEmotionClassifier()
+    from transformers import pipeline
+
+    return pipeline("text-classification", model=EMOTION_MODEL_NAME, top_k=None)
+
+
+def load_embedding_model(stub: Optional[bool] = None) -> Any:
+    """Load the MiniLM sentence embedder, or its stand‑in.
+
+    Args:
+        stub: Force the stand‑in on or off.  Defaults to
+            :func:`stub_models_enabled`.
+    """
+    use_stub = stub_models_enabled() if stub is None else stub
+    if use_stub:
+        return StubEmbeddingModel()
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
@@ -0,0 +1,199 @@
+"""
+Study Buddy Profiling
+=====================
+
+A small statistical stack sampler for profiling the backend in place.
+
+:class:`StackSampler` runs a daemon thread that wakes every few
+milliseconds, reads the current stack of every other thread with
+``sys._current_frames()`` and counts identical stacks.  Threads that are
+merely idle (blocked in ``selectors``, ``threading`` waits or an empty
+worker queue) are skipped so the profile shows where time is actually
+spent.  Results are rendered in the *collapsed stack* format understood by
+``flamegraph.pl``, speedscope and most other flame‑graph tools::
+
+    MainThread;study_buddy_backend.py:chat_endpoint;study_buddy_backend.py:generate_reply 42
+
+Sampling costs a few microseconds per thread per tick and needs no
+tracing hooks, so it is cheap enough to leave running for a while under
+real traffic.  The backend uses it in two ways (see the admin endpoints in
+``study_buddy_backend.py``):
+
+* **Per request** – a request carrying ``X-Study-Buddy-Profile: 1`` (or
+  any request while profiling is armed by an admin) is sampled from start
+  to finish.  Because all threads are sampled, requests running at the
+  same time appear in the profile as well; profile on a quiet instance
+  for a clean picture of one request.
+* **Continuous** – sample every thread for N seconds across all traffic.
+
+Only one sampler runs at a time; :data:`PROFILER_LOCK` guards this.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as _Counter
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_INTERVAL_S = 0.005
+
+# Request header that asks for a per‑request profile
+PROFILE_HEADER = "x-study-buddy-profile"
+
+# Leaf frames that mean "this thread is waiting, not working"
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# Held by whichever sampler is running; profiling is best effort, so
+# callers that cannot acquire it skip profiling instead of waiting.
+PROFILER_LOCK = threading.Lock()
+
+
+def _frame_label(code: object) -> str:
+    filename = os.path.basename(getattr(code, "co_filename", "?"))
+    name = getattr(code, "co_qualname", None) or getattr(code, "co_name", "?")
+    return f"{filename}:{name}"
+
+
+class StackSampler:
+    """Periodically samples the stacks of all threads.
+
+    Args:
+        interval: Seconds between samples.
+        include_idle: Keep stacks of threads that are blocked waiting.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL_S, include_idle: bool = False) -> None:
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = 0
+        self.started: Optional[float] = None
+        self.stopped: Optional[float] = None
+        self._stacks: _Counter = _Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StackSampler":
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="study-buddy-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped = time.perf_counter()
+        return self
+
+    def __enter__(self) -> "StackSampler":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate() if t.ident}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                key = self._collapse(frame)
+                if key is None:
+                    continue
+                self._stacks[(names.get(ident, str(ident)),) + key] += 1
+            self.samples += 1
+
+    def _collapse(self, frame: object) -> Optional[Tuple[str, ...]]:
+        code = frame.f_code  # type: ignore[attr-defined]
+        if not self.include_idle:
+            leaf = (os.path.basename(code.co_filename), code.co_name)
+            if leaf in _IDLE_LEAVES:
+                return None
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))  # type: ignore[attr-defined]
+            frame = frame.f_back  # type: ignore[attr-defined]
+        labels.reverse()
+        return tuple(labels)
+
+    def collapsed(self) -> str:
+        """Return the profile as collapsed stacks, heaviest first."""
+        lines = [
+            ";".join(stack).replace(" ", "_") + f" {count}"
+            for stack, count in self._stacks.most_common()
+        ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def top_functions(self, limit: int = 20) -> Iterable[Tuple[str, int]]:
+        """Return the functions present in the most samples (inclusive)."""
+        inclusive: _Counter = _Counter()
+        for stack, count in self._stacks.items():
+            for label in set(stack[1:]):
+                inclusive[label] += count
+        return inclusive.most_common(limit)
+
+    @property
+    def duration(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.stopped or time.perf_counter()) - self.started
+
+
+class ProfileStore:
+    """Keeps the most recent profiles in memory and optionally on disk.
+
+    Args:
+        capacity: Number of profiles to keep in memory.
+        directory: If set, every profile is also written there as
+            ``<id>.collapsed``.
+    """
+
+    def __init__(self, capacity: int = 32, directory: Optional[str] = None) -> None:
+        self.capacity = capacity
+        self.directory = directory
+        self._profiles: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, collapsed: str, label: str = "") -> str:
+        """Store a collapsed‑stack profile and return its id."""
+        profile_id = (label + "-" if label else "") + uuid.uuid4().hex[:12]
+        with self._lock:
+            self._profiles[profile_id] = collapsed
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{profile_id}.collapsed")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(collapsed)
+            except OSError:
+                pass
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[str]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(reversed(self._profiles.keys()))
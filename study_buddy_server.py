@@ -0,0 +1,513 @@
+"""
+Study Buddy Production Server
+=============================
+
+``python study_buddy_backend.py`` runs a single uvicorn process with
+auto‑reload, which is what you want while editing the code.  Started with
+``uvicorn --workers N`` instead, every worker imports the backend on its
+own: each loads a private copy of the emotion classifier and the embedder,
+and each PyTorch runtime sizes its thread pools for every core of the
+machine, so N workers run N × cores compute threads and oversubscribe the
+CPU.  This launcher runs the backend for production:
+
+* **Models are loaded once.**  The parent imports the backend, which loads
+  the models, and only then forks the workers.  The workers inherit the
+  weights copy‑on‑write, so the read‑only parameters stay in shared pages
+  instead of being copied per worker.  The parent runs no inference (an
+  OpenMP pool started before ``fork`` does not work in the children) and
+  moves the loaded objects out of the garbage collector's generations
+  (:func:`gc.freeze`) so collections in the workers do not write to, and
+  thereby copy, the pages holding them.
+* **Threads follow a core budget.**  ``--cores`` (default: all) is divided
+  between the workers: each gets ``cores // workers`` intra‑op threads and
+  ``--interop-threads`` inter‑op threads.  The budget is applied through
+  ``OMP_NUM_THREADS``/``MKL_NUM_THREADS``/``OPENBLAS_NUM_THREADS`` before
+  anything numerical is imported and through ``torch.set_num_threads`` /
+  ``torch.set_num_interop_threads`` when PyTorch is loaded.
+* **Workers are supervised.**  A worker that dies is forked again from the
+  parent, so it starts with the models already loaded.  ``SIGTERM`` or
+  ``Ctrl‑C`` stops the workers gracefully.
+* **The layout is measured.**  Every ``--report-interval`` seconds the
+  parent prints each worker's resident memory – RSS, PSS, shared and
+  private bytes (see :func:`study_buddy_memory.shared_memory`) – and its
+  request throughput.  ``--benchmark SECONDS`` drives the workers with
+  ``study_buddy_loadtest.py`` for that long, prints the same report for the
+  chosen layout and exits; compare layouts by re‑running it with other
+  ``--workers``/``--cores`` values.
+
+Conversations and notes live in each worker's memory.  With more than one
+worker a student must keep reaching the same worker: start with
+``--port-per-worker`` (worker *i* listens on ``port + i``) behind a proxy
+that routes by user, or run a single worker.  Workers spill notes to their
+own ``worker-<i>`` subdirectory of ``STUDY_BUDDY_NOTES_SPILL_DIR``.
+
+When the inference service is running (``study_buddy_inference.py
+serve``), the workers use it and hold no weights of their own; the core
+budget then only covers request handling.
+
+Linux only (``fork`` and ``/proc``).  Examples:
+
+```
+python study_buddy_server.py --workers 4 --cores 8
+python study_buddy_server.py --workers 2 --port-per-worker --port 8001
+python study_buddy_server.py --workers 2 --benchmark 30 --students 40 --output layout.json
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from multiprocessing.sharedctypes import RawArray
+from typing import Any, Dict, List, Optional
+
+from study_buddy_memory import model_memory, shared_memory
+
+# Read by OpenMP, MKL and OpenBLAS when they initialise, so they must be set
+# before the backend (and with it torch/numpy) is imported
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+###############################################################################
+# Thread budget
+###############################################################################
+
+def thread_layout(workers: int, cores: int, interop_threads: int = 1) -> Dict[str, int]:
+    """Split a core budget between workers.
+
+    Args:
+        workers: Number of worker processes.
+        cores: Cores the workers may use together.
+        interop_threads: Inter‑op threads per worker.
+
+    Returns:
+        ``workers``, ``cores``, ``intra_op_threads`` (per worker, at least
+        one) and ``inter_op_threads``.
+    """
+    return {
+        "workers": workers,
+        "cores": cores,
+        "intra_op_threads": max(1, cores // workers),
+        "inter_op_threads": max(1, interop_threads),
+    }
+
+
+def configure_thread_env(intra_op_threads: int) -> None:
+    """Size the native thread pools before the numerical libraries load."""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(intra_op_threads)
+    # The tokenizers' Rust thread pool is not fork‑safe; the workers
+    # already account for the cores
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def apply_torch_threads(intra_op_threads: int, inter_op_threads: Optional[int] = None) -> bool:
+    """Apply the budget to PyTorch if the models loaded it.
+
+    ``set_num_interop_threads`` only works before the first inter‑op task,
+    so pass ``inter_op_threads`` in the parent only.  Returns whether
+    PyTorch is loaded.
+    """
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return False
+    torch.set_num_threads(intra_op_threads)
+    if inter_op_threads is not None:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            pass  # Already set, or inter‑op work already ran
+    return True
+
+
+###############################################################################
+# Workers
+###############################################################################
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class _CountingApp:
+    """ASGI wrapper that counts a worker's finished HTTP requests."""
+
+    def __init__(self, app: Any, counts: Any, index: int) -> None:
+        self.app = app
+        self.counts = counts
+        self.index = index
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if scope["type"] == "http":
+                # Only this worker's event loop writes its slot
+                self.counts[self.index] += 1
+
+
+class Supervisor:
+    """Forks the workers from the loaded backend and keeps them running.
+
+    Args:
+        backend: The imported ``study_buddy_backend`` module.
+        layout: Output of :func:`thread_layout`.
+        sockets: Listening sockets; one shared by all workers, or one per
+            worker.
+        log_level: uvicorn log level for the workers.
+    """
+
+    def __init__(
+        self, backend: Any, layout: Dict[str, Any], sockets: List[socket.socket], log_level: str = "info"
+    ) -> None:
+        self.backend = backend
+        self.layout = layout
+        self.sockets = sockets
+        self.log_level = log_level
+        self.workers = layout["workers"]
+        # Shared with the children through anonymous mappings inherited on fork
+        self.requests = RawArray("Q", self.workers)
+        self.ready = RawArray("b", self.workers)
+        self.pids: Dict[int, int] = {}
+        self.started_at: Dict[int, float] = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def _socket(self, index: int) -> socket.socket:
+        return self.sockets[index if len(self.sockets) > 1 else 0]
+
+    def spawn(self, index: int) -> None:
+        self.ready[index] = 0
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._serve(index)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self.pids[index] = pid
+        self.started_at[index] = time.monotonic()
+
+    def _serve(self, index: int) -> None:
+        # Runs in the child; uvicorn installs its own signal handlers
+        import uvicorn
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        apply_torch_threads(self.layout["intra_op_threads"])
+        backend = self.backend
+        if backend._inference_client is not None:
+            # The parent's connection is now shared with every sibling
+            backend._inference_client.close()
+        store = backend._vector_store
+        if store.spill_dir is not None:
+            store.spill_dir = os.path.join(store.spill_dir, f"worker-{index}")
+            os.makedirs(store.spill_dir, exist_ok=True)
+
+        def mark_ready() -> None:
+            self.ready[index] = 1
+
+        backend.app.router.on_startup.append(mark_ready)
+        sock = self._socket(index)
+        for other in self.sockets:
+            if other is not sock:
+                other.close()
+        config = uvicorn.Config(_CountingApp(backend.app, self.requests, index), log_level=self.log_level)
+        uvicorn.Server(config).run(sockets=[sock])
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            self.spawn(index)
+
+    def wait_ready(self, timeout: float = 60.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(self.ready):
+                return True
+            self.reap()
+            time.sleep(0.05)
+        return False
+
+    def reap(self) -> None:
+        """Collect dead workers and fork their replacements."""
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = next((i for i, p in self.pids.items() if p == pid), None)
+            if index is None:
+                continue
+            del self.pids[index]
+            if self.stopping:
+                continue
+            print(
+                f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting",
+                file=sys.stderr,
+            )
+            # A worker that crashes on startup should not spin the CPU
+            if time.monotonic() - self.started_at[index] < 1.0:
+                time.sleep(1.0)
+            self.restarts += 1
+            self.spawn(index)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Ask every worker to finish its requests, then kill stragglers."""
+        self.stopping = True
+        for pid in self.pids.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        while self.pids and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in self.pids.values():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.pids.values()):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.pids.clear()
+
+    def report(self, baseline: List[int], seconds: float) -> Dict[str, Any]:
+        """Per‑worker memory and throughput since ``baseline`` was taken.
+
+        Args:
+            baseline: Request counts from :meth:`request_counts` at the
+                start of the window.
+            seconds: Length of the window.
+        """
+        rows = []
+        for index, pid in sorted(self.pids.items()):
+            requests = self.requests[index] - baseline[index]
+            row: Dict[str, Any] = {
+                "worker": index,
+                "pid": pid,
+                "port": self._socket(index).getsockname()[1],
+                "requests": requests,
+                "requests_per_s": requests / seconds if seconds > 0 else 0.0,
+            }
+            row.update(shared_memory(pid) or {})
+            rows.append(row)
+        parent: Dict[str, Any] = {"pid": os.getpid()}
+        parent.update(shared_memory("self") or {})
+        totals: Dict[str, Any] = {
+            "requests": sum(row["requests"] for row in rows),
+            "requests_per_s": sum(row["requests_per_s"] for row in rows),
+            "restarts": self.restarts,
+        }
+        for key in ("rss_bytes", "pss_bytes", "private_bytes"):
+            totals[key] = sum(row.get(key, 0) for row in rows) + parent.get(key, 0)
+        return {"workers": rows, "parent": parent, "totals": totals}
+
+    def request_counts(self) -> List[int]:
+        return list(self.requests)
+
+
+def _mb(value: Optional[int]) -> str:
+    return f"{value / 2 ** 20:.1f}" if value is not None else "-"
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    header = ("worker", "pid", "port", "req/s", "RSS MB", "PSS MB", "shared MB", "private MB")
+    line = "{:<7} {:>8} {:>6} {:>8} {:>8} {:>8} {:>10} {:>11}"
+    print(line.format(*header), file=sys.stderr)
+    parent = report["parent"]
+    rows = [
+        (str(row["worker"]), row["pid"], row["port"], f"{row['requests_per_s']:.1f}", row)
+        for row in report["workers"]
+    ]
+    rows.append(("parent", parent["pid"], "", "", parent))
+    for name, pid, port, rate, m in rows:
+        print(
+            line.format(
+                name, pid, port, rate, _mb(m.get("rss_bytes")), _mb(m.get("pss_bytes")),
+                _mb(m.get("shared_bytes")), _mb(m.get("private_bytes")),
+            ),
+            file=sys.stderr,
+        )
+    totals = report["totals"]
+    print(
+        f"total: {totals['requests_per_s']:.1f} req/s, PSS {_mb(totals['pss_bytes'])} MB "
+        f"(RSS sum {_mb(totals['rss_bytes'])} MB), {totals['restarts']} restarts",
+        file=sys.stderr,
+    )
+
+
+###############################################################################
+# Benchmark
+###############################################################################
+
+async def _drive(urls: List[str], students: int, seconds: float, think_ms: float) -> List[Dict[str, Any]]:
+    import study_buddy_loadtest as loadtest
+
+    runs = []
+    for i, url in enumerate(urls):
+        share = students // len(urls) + (1 if i < students % len(urls) else 0)
+        if share:
+            argv = ["--url", url, "--students", str(share), "--duration", str(seconds),
+                    "--think-ms", str(think_ms), "--seed", str(i)]
+            runs.append(loadtest.run(loadtest.parse_args(argv)))
+    return list(await asyncio.gather(*runs))
+
+
+def benchmark(
+    supervisor: Supervisor, host: str, seconds: float, students: int, think_ms: float
+) -> Dict[str, Any]:
+    """Load the workers for ``seconds`` and report the layout's cost.
+
+    With one port per worker the simulated students are split between
+    the ports, so each student keeps reaching the worker holding its notes.
+    """
+    client_host = "127.0.0.1" if host in ("", "0.0.0.0") else host
+    if ":" in client_host:
+        client_host = f"[{client_host}]"
+    urls = [f"http://{client_host}:{sock.getsockname()[1]}" for sock in supervisor.sockets]
+    baseline = supervisor.request_counts()
+    started = time.perf_counter()
+    loads = asyncio.run(_drive(urls, students, seconds, think_ms))
+    report = supervisor.report(baseline, time.perf_counter() - started)
+    report["loadtest"] = {
+        "students": students,
+        "duration_s": seconds,
+        "requests": sum(load["overall"]["n"] for load in loads),
+        "throughput_per_s": sum(load["overall"]["throughput_per_s"] for load in loads),
+        "errors": sum(load["overall"]["errors"] for load in loads),
+        "per_port": [dict(load["overall"], url=url) for url, load in zip(urls, loads)],
+    }
+    return report
+
+
+###############################################################################
+# Command line
+###############################################################################
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Study Buddy production server")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument(
+        "--cores", type=int, default=None, help="Cores shared by all workers (default: all)"
+    )
+    parser.add_argument("--interop-threads", type=int, default=1, help="Inter‑op threads per worker")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8001, help="Port (the first port with --port-per-worker)")
+    parser.add_argument(
+        "--port-per-worker", action="store_true", help="Give worker i its own port, port + i"
+    )
+    parser.add_argument("--backlog", type=int, default=2048, help="Listen backlog")
+    parser.add_argument("--log-level", default="info", help="uvicorn log level")
+    parser.add_argument(
+        "--report-interval", type=float, default=60.0, help="Seconds between reports (0: never)"
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=30.0, help="Seconds workers get to finish on shutdown"
+    )
+    parser.add_argument(
+        "--benchmark", type=float, default=None, metavar="SECONDS",
+        help="Run the load test against the workers for this long, report and exit",
+    )
+    parser.add_argument("--students", type=int, default=20, help="Simulated students (--benchmark)")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="Pause between actions (--benchmark)")
+    parser.add_argument("--output", help="Write the benchmark report to this JSON file")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+
+    cores = args.cores or os.cpu_count() or 1
+    layout: Dict[str, Any] = thread_layout(args.workers, cores, args.interop_threads)
+    if args.workers > cores:
+        print(
+            f"{args.workers} workers on {cores} cores: each gets one thread and they still share cores",
+            file=sys.stderr,
+        )
+    configure_thread_env(layout["intra_op_threads"])
+
+    started = time.perf_counter()
+    import study_buddy_backend as backend
+
+    layout["torch"] = apply_torch_threads(layout["intra_op_threads"], layout["inter_op_threads"])
+    layout["models"] = "inference service" if backend._inference_client is not None else "in‑process"
+    layout["model_bytes"] = sum(
+        report.get("parameter_bytes", 0) + report.get("buffer_bytes", 0)
+        for report in (model_memory(backend._emotion_classifier), model_memory(backend._embedding_model))
+    )
+    # Everything loaded so far is shared with the workers; keep the
+    # collector from touching it
+    gc.collect()
+    gc.freeze()
+    print(
+        f"Backend loaded in {time.perf_counter() - started:.1f}s; {layout['workers']} workers × "
+        f"{layout['intra_op_threads']} intra‑op + {layout['inter_op_threads']} inter‑op threads, "
+        f"models {layout['models']}",
+        file=sys.stderr,
+    )
+
+    ports = [args.port + i for i in range(args.workers)] if args.port_per_worker else [args.port]
+    sockets = [_bind(args.host, port, args.backlog) for port in ports]
+    supervisor = Supervisor(backend, layout, sockets, log_level=args.log_level)
+    supervisor.start()
+
+    if args.benchmark is not None:
+        try:
+            if not supervisor.wait_ready():
+                raise SystemExit("Workers did not start within 60s")
+            report = benchmark(supervisor, args.host, args.benchmark, args.students, args.think_ms)
+        finally:
+            supervisor.stop(args.graceful_timeout)
+        report["layout"] = layout
+        _print_report(report)
+        load = report["loadtest"]
+        print(
+            f"load test: {load['requests']} requests, {load['throughput_per_s']:.1f} req/s, "
+            f"{load['errors']} errors",
+            file=sys.stderr,
+        )
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.output}", file=sys.stderr)
+        return
+
+    def request_stop(signum: int, frame: Any) -> None:
+        supervisor.stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    baseline, window_start = supervisor.request_counts(), time.perf_counter()
+    try:
+        while not supervisor.stopping:
+            supervisor.reap()
+            time.sleep(0.2)
+            elapsed = time.perf_counter() - window_start
+            if args.report_interval and elapsed >= args.report_interval:
+                _print_report(supervisor.report(baseline, elapsed))
+                baseline, window_start = supervisor.request_counts(), time.perf_counter()
+    finally:
+        supervisor.stop(args.graceful_timeout)
+
+
+if __name__ == "__main__":
+    main()
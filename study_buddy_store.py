@@ -0,0 +1,1074 @@
+"""
+Study Buddy Note Store
+======================
+
+In‑memory storage for the note embeddings used by the Study Buddy backend.
+
+The original backend kept a plain ``Dict[int, List[Dict[str, Any]]]`` and
+updated it with a read‑modify‑write (``get`` → ``extend`` → assign).  That is
+fine while every request runs on the event loop one at a time, but as soon as
+ingestion and retrieval run on worker threads two uploads for the same user can
+lose each other's chunks, and a reader can observe a list that is half way
+through being extended.
+
+This module replaces the dictionary with a small store built around these ideas:
+
+* **Immutable snapshots** – A user's notes are published as a
+  :class:`NoteSnapshot` holding a read‑only embedding matrix and the chunk
+  texts and metadata.  Readers grab the current snapshot with a single
+  dictionary lookup and work on it without taking any lock, so retrieval
+  never waits for an upload to finish and never sees partially appended
+  state.
+
+* **Per‑user writer locks** – Writers for the same user are serialised by a
+  lock dedicated to that user.  A writer copies the current snapshot, appends
+  its rows and publishes the new snapshot with one assignment.  Uploads for
+  different users proceed in parallel.
+
+* **Hot/cold tiering** – Most students only touch their notes around exam
+  time.  When a global memory budget is configured, the least recently used
+  users' snapshots are spilled to compact ``.npz`` files (embedding matrix
+  plus a UTF‑8 text buffer with offsets) and dropped from RAM.  They are
+  loaded back transparently the next time the user's notes are read.  An
+  optional per‑user chunk quota caps how much a single user can store.
+
+* **Compact embeddings** – Embeddings dominate the store's memory.  They can
+  be kept as float16 or as int8 with one float32 scale per row (scalar
+  quantisation), cutting RAM by 2× or ~4×.  Searches score the compact
+  vectors first and then rescore a small candidate set exactly against the
+  full‑precision rows, which are appended to a per‑user file on disk and
+  read back through a memory map, so the ranking matches float32 search.
+  Such a file is only ever appended to; when it has to be rewritten or the
+  user's notes are dropped, a new file replaces it and the old one is
+  deleted once no snapshot still reading it is alive.
+
+* **Column‑oriented chunks** – Rather than one ``str`` and one ``dict`` per
+  chunk, a snapshot keeps all chunk texts in a single UTF‑8 byte arena with
+  an ``int64`` offsets array, plus ``int32`` columns for document id, page
+  and position within the document.  A user's notes are a handful of
+  objects regardless of chunk count, which keeps memory and garbage
+  collection overhead flat; passages are decoded only for the rows a
+  search actually returns.
+
+* **Shared corpora** – When a whole class uploads the same syllabus, it is
+  ingested once into a named corpus that every student subscribes to.
+  Corpora are reference counted by their subscribers and searched alongside
+  a user's private notes without copying, so memory scales with distinct
+  material rather than with the number of students.
+"""
+
+from __future__ import annotations
+
+import gc
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+
+###############################################################################
+# Quantisation helpers
+###############################################################################
+
+# Supported in‑memory precisions for the embedding matrix.
+PRECISIONS = ("float32", "float16", "int8")
+
+# Default number of first‑pass candidates rescored exactly when embeddings are
+# stored in a compact precision.
+DEFAULT_RESCORE_CANDIDATES = 32
+
+# Compact matrices are upcast to float32 in blocks of this many rows while
+# scoring, so a search never materialises a full float32 copy.
+_SCORE_BLOCK_ROWS = 4096
+
+
+def _quantize(rows: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Convert float32 rows to the requested precision.
+
+    Args:
+        rows: A ``(n, d)`` float32 matrix of normalised embeddings.
+        precision: One of :data:`PRECISIONS`.
+
+    Returns:
+        The compact matrix and, for int8, the per‑row float32 scales
+        (``None`` otherwise).
+    """
+    if precision == "float32":
+        return rows, None
+    if precision == "float16":
+        return rows.astype(np.float16), None
+    if precision == "int8":
+        scales = np.abs(rows).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.rint(rows / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"Unsupported embedding precision: {precision!r}")
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` largest scores, sorted by descending score."""
+    n = len(scores)
+    if k < n:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(n)
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+###############################################################################
+# Snapshots
+###############################################################################
+
+def _column(values: Any, dtype: Any = np.int32) -> np.ndarray:
+    """Build a read‑only NumPy column."""
+    array = np.asarray(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+class NoteSnapshot:
+    """An immutable, column‑oriented view of one user's notes.
+
+    Row ``i`` of every column describes the same chunk.
+
+    Attributes:
+        embeddings: A read‑only ``(n, d)`` matrix of normalised embeddings,
+            one row per chunk, in float32, float16 or int8.
+        text_buffer: All chunk texts concatenated as UTF‑8.
+        offsets: ``n + 1`` int64 offsets; chunk ``i`` is
+            ``text_buffer[offsets[i]:offsets[i + 1]]``.
+        document_ids: int32 id of the upload each chunk came from.
+        pages: int32 page number of each chunk's first word (1‑based), or
+            ``-1`` when the source has no pages.
+        positions: int32 index of each chunk within its document.
+        version: Monotonically increasing counter bumped on every publish.
+        scales: Per‑row float32 scales for int8 embeddings, else ``None``.
+        full_vectors: Path of the append‑only float32 file used for exact
+            rescoring of compact embeddings, else ``None``.  The file holds
+            at least this snapshot's rows and stays on disk while the
+            snapshot is alive.
+    """
+
+    __slots__ = (
+        "embeddings",
+        "text_buffer",
+        "offsets",
+        "document_ids",
+        "pages",
+        "positions",
+        "version",
+        "scales",
+        "full_vectors",
+        "__weakref__",
+    )
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        text_buffer: bytes,
+        offsets: np.ndarray,
+        document_ids: np.ndarray,
+        pages: np.ndarray,
+        positions: np.ndarray,
+        version: int,
+        scales: Optional[np.ndarray] = None,
+        full_vectors: Optional[str] = None,
+    ) -> None:
+        embeddings.flags.writeable = False
+        if scales is not None:
+            scales.flags.writeable = False
+        self.embeddings = embeddings
+        self.text_buffer = text_buffer
+        self.offsets = _column(offsets, np.int64)
+        self.document_ids = _column(document_ids)
+        self.pages = _column(pages)
+        self.positions = _column(positions)
+        self.version = version
+        self.scales = scales
+        self.full_vectors = full_vectors
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def text_bytes(self) -> int:
+        """UTF‑8 size of all chunk texts."""
+        return len(self.text_buffer)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate number of bytes held in RAM by this snapshot."""
+        columns = (self.embeddings, self.offsets, self.document_ids, self.pages, self.positions)
+        scale_bytes = int(self.scales.nbytes) if self.scales is not None else 0
+        return sum(int(c.nbytes) for c in columns) + scale_bytes + self.text_bytes
+
+    def memory_breakdown(self) -> Dict[str, int]:
+        """Split :attr:`nbytes` into embeddings, texts and per‑chunk metadata."""
+        scale_bytes = int(self.scales.nbytes) if self.scales is not None else 0
+        metadata = (self.offsets, self.document_ids, self.pages, self.positions)
+        return {
+            "embedding_bytes": int(self.embeddings.nbytes) + scale_bytes,
+            "text_bytes": self.text_bytes,
+            "metadata_bytes": sum(int(c.nbytes) for c in metadata),
+        }
+
+    def text(self, row: int) -> str:
+        """Decode the text of a single chunk."""
+        return self.text_buffer[self.offsets[row] : self.offsets[row + 1]].decode("utf-8")
+
+    def passages(self, rows: Sequence[int]) -> List[str]:
+        """Decode the texts of the given chunks, in order."""
+        return [self.text(row) for row in rows]
+
+    def iter_texts(self) -> Iterator[str]:
+        """Yield every chunk text in insertion order."""
+        for row in range(len(self)):
+            yield self.text(row)
+
+    def metadata(self, row: int) -> Dict[str, int]:
+        """Return the document id, page and position of a chunk."""
+        return {
+            "document_id": int(self.document_ids[row]),
+            "page": int(self.pages[row]),
+            "position": int(self.positions[row]),
+        }
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Score every row against ``query`` using the stored precision."""
+        if self.embeddings.dtype == np.float32:
+            return self.embeddings @ query
+        n = len(self)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _SCORE_BLOCK_ROWS):
+            block = self.embeddings[start : start + _SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start : start + _SCORE_BLOCK_ROWS] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def _exact_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Read full‑precision rows for rescoring from the on‑disk file."""
+        shape = (len(self), self.embeddings.shape[1])
+        vectors = np.memmap(self.full_vectors, dtype=np.float32, mode="r", shape=shape)
+        try:
+            return np.array(vectors[rows])
+        finally:
+            del vectors
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int = 3,
+        candidates: int = DEFAULT_RESCORE_CANDIDATES,
+        rescore: bool = True,
+    ) -> List[Tuple[float, int]]:
+        """Return the ``k`` best ``(score, row)`` pairs for a query.
+
+        Embeddings are normalised, so the dot product is the cosine
+        similarity.  For compact embeddings the best ``candidates`` rows of
+        the first pass are rescored against their full‑precision vectors.
+        Results are sorted by descending score.
+
+        Args:
+            query_embedding: A normalised query vector of dimension ``d``.
+            k: Number of results to return.
+            candidates: Size of the first‑pass candidate set to rescore.
+            rescore: Set to False to return first‑pass scores only.
+
+        Returns:
+            A list of at most ``k`` ``(score, row)`` tuples.
+        """
+        n = len(self)
+        if n == 0 or k <= 0:
+            return []
+        query = query_embedding.astype(np.float32, copy=False)
+        scores = self._approximate_scores(query)
+        if not rescore or self.full_vectors is None:
+            return [(float(scores[i]), int(i)) for i in _top_indices(scores, k)]
+        pool = _top_indices(scores, max(k, candidates))
+        exact = self._exact_rows(pool) @ query
+        order = np.argsort(-exact, kind="stable")[:k]
+        return [(float(exact[i]), int(pool[i])) for i in order]
+
+
+_EMPTY_SNAPSHOT = NoteSnapshot(
+    np.zeros((0, 0), dtype=np.float32),
+    b"",
+    np.zeros(1, dtype=np.int64),
+    np.zeros(0, dtype=np.int32),
+    np.zeros(0, dtype=np.int32),
+    np.zeros(0, dtype=np.int32),
+    0,
+)
+
+
+class QuotaExceededError(ValueError):
+    """Raised when an append would take a user past their chunk quota."""
+
+
+###############################################################################
+# On‑disk format for cold users
+###############################################################################
+
+def _write_snapshot(path: str, snapshot: NoteSnapshot) -> None:
+    """Write a snapshot to ``path`` atomically as an uncompressed ``.npz``.
+
+    The columns are written as they are held in memory and embeddings keep
+    their stored precision; the full‑precision rescoring file, if any,
+    already lives on disk and is not duplicated.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            embeddings=snapshot.embeddings,
+            scales=snapshot.scales if snapshot.scales is not None else np.zeros(0, np.float32),
+            text_buffer=np.frombuffer(snapshot.text_buffer, dtype=np.uint8),
+            offsets=snapshot.offsets,
+            document_ids=snapshot.document_ids,
+            pages=snapshot.pages,
+            positions=snapshot.positions,
+            version=np.int64(snapshot.version),
+        )
+    os.replace(tmp_path, path)
+
+
+def _read_snapshot(path: str, full_vectors: Optional[str] = None) -> NoteSnapshot:
+    """Load a snapshot previously written by :func:`_write_snapshot`."""
+    with np.load(path) as data:
+        embeddings = np.array(data["embeddings"])
+        scales = np.array(data["scales"]) if data["embeddings"].dtype == np.int8 else None
+        return NoteSnapshot(
+            embeddings,
+            data["text_buffer"].tobytes(),
+            data["offsets"],
+            data["document_ids"],
+            data["pages"],
+            data["positions"],
+            int(data["version"]),
+            scales=scales,
+            full_vectors=full_vectors if embeddings.dtype != np.float32 else None,
+        )
+
+
+###############################################################################
+# Store
+###############################################################################
+
+# Snapshots are keyed by an ``int`` user id for private notes or by a ``str``
+# corpus id for notes shared by a whole class.
+NoteKey = Union[int, str]
+
+# Corpus ids end up in file names, so keep them to a safe alphabet.
+_CORPUS_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def validate_corpus_id(corpus_id: str) -> str:
+    """Return ``corpus_id`` unchanged or raise ``ValueError`` if it is unsafe."""
+    if not isinstance(corpus_id, str) or not _CORPUS_ID_PATTERN.match(corpus_id):
+        raise ValueError(
+            "Corpus ids must be 1-64 characters of letters, digits, '.', '_' or '-'"
+        )
+    return corpus_id
+
+
+class NoteStore:
+    """Concurrency‑safe per‑user note store with copy‑on‑write snapshots.
+
+    Reads are lock free: :meth:`snapshot` returns whatever snapshot was last
+    published for the user.  Writes take a per‑user lock, build a new
+    snapshot from the old one and publish it atomically.
+
+    Besides private notes, the store holds shared corpora (e.g. a class
+    syllabus) that are ingested once and subscribed to by many users.  A
+    corpus is reference counted by its subscribers and freed when the last
+    one leaves; :meth:`search` ranks a user's private notes together with
+    all of their corpora without copying any vectors.
+
+    Args:
+        memory_budget_bytes: Optional cap on the bytes kept resident across
+            all users.  When exceeded, the least recently used users are
+            spilled to disk.  ``None`` keeps everything in RAM.
+        spill_dir: Directory for spilled users.  Defaults to a fresh
+            temporary directory when a budget is set.
+        max_chunks_per_user: Optional per‑user chunk quota enforced by
+            :meth:`append`.  Shared corpora are not counted.
+        precision: In‑memory embedding precision, one of
+            :data:`PRECISIONS`.  Compact precisions keep a float32 copy on
+            disk in ``spill_dir`` for exact rescoring.
+    """
+
+    def __init__(
+        self,
+        memory_budget_bytes: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        max_chunks_per_user: Optional[int] = None,
+        precision: str = "float32",
+    ) -> None:
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported embedding precision: {precision!r}")
+        self._snapshots: Dict[NoteKey, NoteSnapshot] = {}
+        self._locks: Dict[NoteKey, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_chunks_per_user = max_chunks_per_user
+        self.precision = precision
+        needs_disk = memory_budget_bytes is not None or precision != "float32"
+        if needs_disk and spill_dir is None:
+            spill_dir = tempfile.mkdtemp(prefix="study_buddy_notes_")
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        # key -> (path, version) of the copy on disk, if any
+        self._spilled: Dict[NoteKey, Tuple[str, int]] = {}
+        # key -> current float32 rescoring file.  Live snapshots per file are
+        # counted so retired files are unlinked only once nothing reads them.
+        self._vector_files: Dict[NoteKey, str] = {}
+        self._vector_file_refs: Dict[str, int] = {}
+        self._retired_vector_files: Set[str] = set()
+        self._vector_files_lock = threading.RLock()
+        self._vector_file_generation = itertools.count()
+        self._last_access: Dict[NoteKey, float] = {}
+        # Shared corpora: subscribers per corpus (the reference count) and the
+        # content hashes of documents already ingested into each corpus.
+        self._subscriptions_lock = threading.Lock()
+        self._subscribers: Dict[str, Set[int]] = {}
+        self._user_corpora: Dict[int, Tuple[str, ...]] = {}
+        self._corpus_documents: Dict[str, Set[str]] = {}
+        # The user whose upload created each corpus; only they may add to it
+        self._corpus_owners: Dict[str, int] = {}
+        # Accounting for resident memory and tiering metrics
+        self._stats_lock = threading.Lock()
+        self._resident_bytes = 0
+        self._evictions = 0
+        self._cold_loads = 0
+        self._cold_load_seconds_total = 0.0
+        self._cold_load_seconds_max = 0.0
+
+    def _lock_for(self, key: NoteKey) -> threading.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(key, threading.Lock())
+        return lock
+
+    def _publish(self, key: NoteKey, snapshot: Optional[NoteSnapshot]) -> None:
+        """Swap in a new snapshot for ``key``.  Caller holds the key's lock."""
+        previous = self._snapshots.get(key)
+        if snapshot is None:
+            self._snapshots.pop(key, None)
+        else:
+            self._snapshots[key] = snapshot
+        delta = (snapshot.nbytes if snapshot is not None else 0) - (
+            previous.nbytes if previous is not None else 0
+        )
+        with self._stats_lock:
+            self._resident_bytes += delta
+
+    def _file_stem(self, key: NoteKey) -> str:
+        return f"corpus_{key}" if isinstance(key, str) else f"notes_{key}"
+
+    def _spill_path(self, key: NoteKey) -> str:
+        return os.path.join(self.spill_dir or "", f"{self._file_stem(key)}.npz")
+
+    def _append_full_vectors(self, key: NoteKey, current: NoteSnapshot, rows: np.ndarray) -> str:
+        """Add float32 rows to the key's rescoring file and return its path.
+
+        Caller holds the key's lock.  Appending past the rows of older
+        snapshots leaves them intact, so the file is extended in place.  If
+        it does not end exactly after ``current``'s rows (an interrupted
+        append), those rows are copied into a new file instead of truncating
+        one that readers may have mapped.
+        """
+        expected = len(current) * rows.shape[1] * rows.itemsize
+        data = np.ascontiguousarray(rows, dtype=np.float32).tobytes()
+        path = self._vector_files.get(key)
+        if path is not None:
+            with open(path, "ab") as f:
+                if f.tell() == expected:
+                    f.write(data)
+                    return path
+        new_path = os.path.join(
+            self.spill_dir or "",
+            f"{self._file_stem(key)}.{next(self._vector_file_generation)}.f32",
+        )
+        with open(new_path, "wb") as out:
+            if expected:
+                with open(path, "rb") as old:
+                    remaining = expected
+                    while remaining:
+                        block = old.read(min(remaining, 1 << 20))
+                        if not block:
+                            raise OSError(f"Rescoring file {path} is shorter than its snapshot")
+                        out.write(block)
+                        remaining -= len(block)
+            out.write(data)
+        self._vector_files[key] = new_path
+        if path is not None:
+            self._retire_vector_file(path)
+        return new_path
+
+    def _track(self, snapshot: NoteSnapshot) -> NoteSnapshot:
+        """Count ``snapshot`` as a reader of its rescoring file until it is freed."""
+        path = snapshot.full_vectors
+        if path is not None:
+            with self._vector_files_lock:
+                self._vector_file_refs[path] = self._vector_file_refs.get(path, 0) + 1
+            weakref.finalize(snapshot, self._release_vector_file, path)
+        return snapshot
+
+    def _release_vector_file(self, path: str) -> None:
+        with self._vector_files_lock:
+            self._vector_file_refs[path] -= 1
+            if self._vector_file_refs[path]:
+                return
+            del self._vector_file_refs[path]
+            if path not in self._retired_vector_files:
+                return
+            self._retired_vector_files.discard(path)
+        _unlink(path)
+
+    def _retire_vector_file(self, path: str) -> None:
+        """Delete a replaced rescoring file once no snapshot reads it."""
+        with self._vector_files_lock:
+            if self._vector_file_refs.get(path):
+                self._retired_vector_files.add(path)
+                return
+        _unlink(path)
+
+    def _load_cold(self, key: NoteKey) -> NoteSnapshot:
+        """Bring a spilled key back into RAM.  Caller holds the key's lock."""
+        path, _ = self._spilled[key]
+        started = time.perf_counter()
+        snapshot = self._track(_read_snapshot(path, self._vector_files.get(key)))
+        elapsed = time.perf_counter() - started
+        self._publish(key, snapshot)
+        with self._stats_lock:
+            self._cold_loads += 1
+            self._cold_load_seconds_total += elapsed
+            self._cold_load_seconds_max = max(self._cold_load_seconds_max, elapsed)
+        return snapshot
+
+    def _current(self, key: NoteKey) -> NoteSnapshot:
+        """Resident snapshot for ``key``, loading it if cold.  Caller holds the key's lock."""
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+        if key in self._spilled:
+            return self._load_cold(key)
+        return _EMPTY_SNAPSHOT
+
+    def _enforce_budget(self, keep: NoteKey) -> None:
+        """Spill least recently used keys until the budget is respected.
+
+        Victims whose lock is busy (an upload or cold load in progress) are
+        skipped rather than waited on, and ``keep`` is never evicted.
+        """
+        if self.memory_budget_bytes is None or self._resident_bytes <= self.memory_budget_bytes:
+            return
+        candidates = sorted(
+            (key for key in list(self._snapshots.keys()) if key != keep),
+            key=lambda key: self._last_access.get(key, 0.0),
+        )
+        for victim in candidates:
+            if self._resident_bytes <= self.memory_budget_bytes:
+                break
+            lock = self._lock_for(victim)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                snapshot = self._snapshots.get(victim)
+                if snapshot is None:
+                    continue
+                spilled = self._spilled.get(victim)
+                if spilled is None or spilled[1] != snapshot.version:
+                    path = self._spill_path(victim)
+                    _write_snapshot(path, snapshot)
+                    self._spilled[victim] = (path, snapshot.version)
+                self._publish(victim, None)
+                with self._stats_lock:
+                    self._evictions += 1
+            finally:
+                lock.release()
+
+    def snapshot(self, key: NoteKey) -> NoteSnapshot:
+        """Return the current snapshot for a user or corpus (empty if none).
+
+        Resident keys are served without locking.  Keys that were spilled to
+        disk are loaded back first, which counts as a cold load.
+        """
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            if key not in self._spilled:
+                return _EMPTY_SNAPSHOT
+            with self._lock_for(key):
+                snapshot = self._current(key)
+            self._last_access[key] = time.monotonic()
+            self._enforce_budget(keep=key)
+            return snapshot
+        self._last_access[key] = time.monotonic()
+        return snapshot
+
+    def _append(
+        self,
+        key: NoteKey,
+        embeddings: Sequence[np.ndarray],
+        texts: Sequence[str],
+        pages: Optional[Sequence[int]],
+        quota: Optional[int],
+    ) -> int:
+        """Append one document to ``key`` and publish a new snapshot."""
+        if len(embeddings) != len(texts) or (pages is not None and len(pages) != len(texts)):
+            raise ValueError("embeddings, texts and pages must have the same length")
+        with self._lock_for(key):
+            current = self._current(key)
+            if not texts:
+                return len(current)
+            if quota is not None and len(current) + len(texts) > quota:
+                raise QuotaExceededError(
+                    f"User {key} would exceed the quota of {quota} note chunks"
+                )
+            new_rows = np.asarray(np.vstack(embeddings), dtype=np.float32)
+            full_vectors = None
+            if self.precision != "float32":
+                full_vectors = self._append_full_vectors(key, current, new_rows)
+            compact, new_scales = _quantize(new_rows, self.precision)
+            if len(current):
+                matrix = np.concatenate([current.embeddings, compact], axis=0)
+                scales = (
+                    np.concatenate([current.scales, new_scales])
+                    if new_scales is not None
+                    else None
+                )
+            else:
+                matrix = compact.copy()
+                scales = new_scales
+            encoded = [t.encode("utf-8") for t in texts]
+            lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+            offsets = np.concatenate([current.offsets, current.offsets[-1] + np.cumsum(lengths)])
+            document_id = int(current.document_ids.max()) + 1 if len(current) else 0
+            count = len(texts)
+            published = NoteSnapshot(
+                matrix,
+                current.text_buffer + b"".join(encoded),
+                offsets,
+                np.concatenate([current.document_ids, np.full(count, document_id, np.int32)]),
+                np.concatenate(
+                    [current.pages, np.asarray(pages if pages is not None else [-1] * count, np.int32)]
+                ),
+                np.concatenate([current.positions, np.arange(count, dtype=np.int32)]),
+                current.version + 1,
+                scales=scales,
+                full_vectors=full_vectors,
+            )
+            self._publish(key, self._track(published))
+        self._last_access[key] = time.monotonic()
+        self._enforce_budget(keep=key)
+        return len(published)
+
+    def append(
+        self,
+        user_id: int,
+        embeddings: Sequence[np.ndarray],
+        texts: Sequence[str],
+        pages: Optional[Sequence[int]] = None,
+    ) -> int:
+        """Append one document's chunks to a user's private notes.
+
+        The chunks are given the next document id for the user and
+        positions ``0..n-1``, and a new snapshot is published.
+
+        Args:
+            user_id: The owner of the notes.
+            embeddings: One normalised embedding per chunk.
+            texts: The chunk texts, aligned with ``embeddings``.
+            pages: Optional page number for each chunk; ``-1`` if omitted.
+
+        Returns:
+            The total number of chunks stored for the user afterwards.
+
+        Raises:
+            QuotaExceededError: If the user would exceed
+                ``max_chunks_per_user``.
+        """
+        return self._append(user_id, embeddings, texts, pages, self.max_chunks_per_user)
+
+    def _drop(self, key: NoteKey) -> None:
+        """Remove a key from RAM and disk.  Caller holds the key's lock."""
+        self._publish(key, None)
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            # Only cold loads read the spill file, and they hold the lock
+            _unlink(spilled[0])
+        vector_file = self._vector_files.pop(key, None)
+        if vector_file is not None:
+            # Searches may still be reading older snapshots
+            self._retire_vector_file(vector_file)
+        self._last_access.pop(key, None)
+
+    def clear(self, user_id: int) -> None:
+        """Remove a user's private notes, including any files on disk.
+
+        Subscriptions to shared corpora are left untouched.
+        """
+        with self._lock_for(user_id):
+            self._drop(user_id)
+
+    ###########################################################################
+    # Shared corpora
+    ###########################################################################
+
+    def subscribe(self, user_id: int, corpus_id: str) -> int:
+        """Reference a shared corpus from a user's notes.
+
+        Subscribing to a corpus that has not been ingested yet is allowed;
+        its chunks become visible as soon as they are appended.
+
+        Returns:
+            The corpus's reference count afterwards.
+        """
+        validate_corpus_id(corpus_id)
+        with self._subscriptions_lock:
+            subscribers = self._subscribers.setdefault(corpus_id, set())
+            if user_id not in subscribers:
+                subscribers.add(user_id)
+                self._user_corpora[user_id] = self._user_corpora.get(user_id, ()) + (corpus_id,)
+            return len(subscribers)
+
+    def unsubscribe(self, user_id: int, corpus_id: str) -> int:
+        """Drop a user's reference to a corpus, freeing it at zero.
+
+        Returns:
+            The corpus's reference count afterwards.
+        """
+        with self._subscriptions_lock:
+            subscribers = self._subscribers.get(corpus_id)
+            if subscribers is None or user_id not in subscribers:
+                return len(subscribers or ())
+            subscribers.discard(user_id)
+            remaining = tuple(c for c in self._user_corpora.get(user_id, ()) if c != corpus_id)
+            if remaining:
+                self._user_corpora[user_id] = remaining
+            else:
+                self._user_corpora.pop(user_id, None)
+            if subscribers:
+                return len(subscribers)
+            # Last reference gone: free the corpus while still holding the
+            # subscriptions lock so a concurrent subscribe cannot race it.
+            del self._subscribers[corpus_id]
+            self._corpus_documents.pop(corpus_id, None)
+            self._corpus_owners.pop(corpus_id, None)
+            with self._lock_for(corpus_id):
+                self._drop(corpus_id)
+            return 0
+
+    def subscriptions(self, user_id: int) -> Tuple[str, ...]:
+        """Return the corpora a user is subscribed to."""
+        return self._user_corpora.get(user_id, ())
+
+    def corpus_owner(self, corpus_id: str) -> Optional[int]:
+        """Return the user who created a corpus, or ``None`` if it has no owner yet."""
+        return self._corpus_owners.get(corpus_id)
+
+    def has_document(self, corpus_id: str, content_hash: str) -> bool:
+        """Return True if a document with this content hash is in the corpus."""
+        return content_hash in self._corpus_documents.get(corpus_id, ())
+
+    def append_corpus(
+        self,
+        corpus_id: str,
+        embeddings: Sequence[np.ndarray],
+        texts: Sequence[str],
+        pages: Optional[Sequence[int]] = None,
+        content_hash: Optional[str] = None,
+        writer: Optional[int] = None,
+    ) -> int:
+        """Append one document to a shared corpus.
+
+        Args:
+            corpus_id: The corpus to extend.
+            embeddings: One normalised embedding per chunk.
+            texts: The chunk texts, aligned with ``embeddings``.
+            pages: Optional page number for each chunk.
+            content_hash: Optional hash of the source file.  A document whose
+                hash is already in the corpus is not stored again.
+            writer: The uploading user.  A corpus without an owner becomes
+                theirs; ``None`` (an administrator) may write to any corpus.
+
+        Returns:
+            The total number of chunks in the corpus afterwards.
+
+        Raises:
+            PermissionError: If ``writer`` does not own the corpus.
+        """
+        validate_corpus_id(corpus_id)
+        if writer is not None:
+            with self._subscriptions_lock:
+                owner = self._corpus_owners.setdefault(corpus_id, writer)
+            if owner != writer:
+                raise PermissionError(f"Corpus {corpus_id!r} belongs to another user")
+        with self._lock_for(corpus_id):
+            if content_hash is not None:
+                documents = self._corpus_documents.setdefault(corpus_id, set())
+                if content_hash in documents:
+                    return len(self._current(corpus_id))
+                documents.add(content_hash)
+        try:
+            return self._append(corpus_id, embeddings, texts, pages, None)
+        except Exception:
+            if content_hash is not None:
+                self._corpus_documents.get(corpus_id, set()).discard(content_hash)
+            raise
+
+    def views(self, user_id: int) -> List[NoteSnapshot]:
+        """Return the non‑empty snapshots visible to a user.
+
+        The user's private notes come first, followed by each subscribed
+        corpus.  The snapshots are shared, not copied.
+        """
+        keys: List[NoteKey] = [user_id, *self.subscriptions(user_id)]
+        return [s for s in (self.snapshot(key) for key in keys) if len(s)]
+
+    def search(
+        self,
+        user_id: int,
+        query_embedding: np.ndarray,
+        k: int = 3,
+        candidates: int = DEFAULT_RESCORE_CANDIDATES,
+    ) -> List[Tuple[float, NoteSnapshot, int]]:
+        """Rank a user's private notes and subscribed corpora together.
+
+        Each visible snapshot is searched on its own and the per‑snapshot
+        top‑``k`` lists are merged, so shared corpora are never copied into
+        the user's notes.
+
+        Returns:
+            At most ``k`` ``(score, snapshot, row)`` tuples, best first.
+        """
+        hits: List[Tuple[float, NoteSnapshot, int]] = []
+        for snapshot in self.views(user_id):
+            hits.extend(
+                (score, snapshot, row)
+                for score, row in snapshot.search(query_embedding, k, candidates)
+            )
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return hits[:k]
+
+    def users(self) -> List[int]:
+        """Return the ids of all users that have private notes, resident or spilled."""
+        keys = set(self._snapshots.keys()) | set(self._spilled.keys())
+        return [key for key in keys if isinstance(key, int)]
+
+    def corpora(self) -> Dict[str, int]:
+        """Return each shared corpus with its reference count."""
+        with self._subscriptions_lock:
+            return {corpus_id: len(users) for corpus_id, users in self._subscribers.items()}
+
+    def is_resident(self, key: NoteKey) -> bool:
+        """Return True if the user's or corpus's notes are currently held in RAM."""
+        return key in self._snapshots
+
+    def stats(self) -> Dict[str, Any]:
+        """Return tiering and sharing metrics for monitoring.
+
+        Returns:
+            A dictionary with resident bytes, users and chunks, cold users, the
+            number of evictions and cold loads, cold‑load latency, and the
+            number of shared corpora and subscriptions.
+        """
+        corpora = self.corpora()
+        with self._stats_lock:
+            cold_loads = self._cold_loads
+            return {
+                "resident_bytes": self._resident_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_users": len(self._snapshots),
+                "resident_chunks": sum(len(snapshot) for snapshot in list(self._snapshots.values())),
+                "cold_users": len(set(self._spilled.keys()) - set(self._snapshots.keys())),
+                "evictions": self._evictions,
+                "cold_loads": cold_loads,
+                "cold_load_seconds_total": self._cold_load_seconds_total,
+                "cold_load_seconds_avg": (
+                    self._cold_load_seconds_total / cold_loads if cold_loads else 0.0
+                ),
+                "cold_load_seconds_max": self._cold_load_seconds_max,
+                "shared_corpora": len(corpora),
+                "corpus_subscriptions": sum(corpora.values()),
+            }
+
+    def memory_report(self) -> List[Dict[str, Any]]:
+        """Describe the memory held for every user and shared corpus.
+
+        Spilled entries are not loaded; they report zero resident bytes and
+        the size of their files on disk instead.
+
+        Returns:
+            One dictionary per user or corpus with its ``key``, ``kind``
+            (``user`` or ``corpus``), ``resident`` flag, ``chunks``, the
+            resident ``embedding_bytes``, ``text_bytes`` and
+            ``metadata_bytes``, ``disk_bytes`` and, for corpora, the number
+            of ``subscribers``.  Sorted by resident bytes, largest first.
+        """
+        corpora = self.corpora()
+        keys = set(self._snapshots.keys()) | set(self._spilled.keys()) | set(corpora)
+        report: List[Dict[str, Any]] = []
+        for key in keys:
+            snapshot = self._snapshots.get(key)
+            entry: Dict[str, Any] = {
+                "key": key,
+                "kind": "user" if isinstance(key, int) else "corpus",
+                "resident": snapshot is not None,
+                "chunks": len(snapshot) if snapshot is not None else None,
+                "embedding_bytes": 0,
+                "text_bytes": 0,
+                "metadata_bytes": 0,
+            }
+            if snapshot is not None:
+                entry.update(snapshot.memory_breakdown())
+            disk_bytes = 0
+            spilled = self._spilled.get(key)
+            paths = [spilled[0] if spilled else None, self._vector_files.get(key)]
+            for path in paths:
+                if path and os.path.exists(path):
+                    disk_bytes += os.path.getsize(path)
+            entry["disk_bytes"] = disk_bytes
+            if entry["kind"] == "corpus":
+                entry["subscribers"] = corpora.get(key, 0)
+            report.append(entry)
+        report.sort(
+            key=lambda e: e["embedding_bytes"] + e["text_bytes"] + e["metadata_bytes"],
+            reverse=True,
+        )
+        return report
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._snapshots or key in self._spilled
+
+    def __len__(self) -> int:
+        return len(self.users())
+
+
+###############################################################################
+# Quantisation report
+###############################################################################
+
+def measure_quantization(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int = 3,
+    candidates: int = DEFAULT_RESCORE_CANDIDATES,
+) -> Dict[str, Dict[str, float]]:
+    """Compare memory and recall@k of each precision against float32.
+
+    The float32 ranking (what ``retrieve_context`` returned before compact
+    storage existed) is the ground truth.  For each compact precision the
+    report gives the in‑RAM embedding bytes, the reduction factor and
+    recall@k both for the first pass alone and after exact rescoring.
+
+    Args:
+        embeddings: A ``(n, d)`` matrix of normalised embeddings.
+        queries: A ``(q, d)`` matrix of normalised query embeddings.
+        k: Number of results per query.
+        candidates: First‑pass candidates rescored exactly.
+
+    Returns:
+        A mapping from precision name to its metrics.
+    """
+    rows = list(np.asarray(embeddings, dtype=np.float32))
+    texts = [""] * len(rows)
+    baseline_store = NoteStore()
+    baseline_store.append(0, rows, texts)
+    baseline = baseline_store.snapshot(0)
+    truth = [{row for _, row in baseline.search(q, k)} for q in queries]
+    baseline_bytes = int(baseline.embeddings.nbytes)
+    report: Dict[str, Dict[str, float]] = {}
+    for precision in PRECISIONS:
+        with tempfile.TemporaryDirectory(prefix="study_buddy_quant_") as tmp:
+            store = NoteStore(spill_dir=tmp, precision=precision)
+            store.append(0, rows, texts)
+            snapshot = store.snapshot(0)
+            embedding_bytes = int(snapshot.embeddings.nbytes) + (
+                int(snapshot.scales.nbytes) if snapshot.scales is not None else 0
+            )
+            first_pass = rescored = 0
+            for q, expected in zip(queries, truth):
+                first_pass += len(expected & {r for _, r in snapshot.search(q, k, rescore=False)})
+                rescored += len(expected & {r for _, r in snapshot.search(q, k, candidates)})
+            total = max(sum(len(t) for t in truth), 1)
+            report[precision] = {
+                "embedding_bytes": embedding_bytes,
+                "bytes_per_chunk": embedding_bytes / max(len(rows), 1),
+                "reduction": baseline_bytes / embedding_bytes if embedding_bytes else 1.0,
+                "recall_at_k_first_pass": first_pass / total,
+                "recall_at_k_rescored": rescored / total,
+            }
+            store.clear(0)
+    return report
+
+
+def measure_chunk_memory(texts: Sequence[str], dim: int = 384) -> Dict[str, Dict[str, float]]:
+    """Compare per‑chunk memory of the legacy layout and the column store.
+
+    The legacy layout is the original ``List[Dict[str, Any]]`` with one
+    ``{"embedding": ndarray, "text": str}`` dict per chunk.  Live bytes and
+    live allocation blocks (roughly, heap objects the allocator and garbage
+    collector have to manage) are measured with :mod:`tracemalloc`.
+
+    Args:
+        texts: Chunk texts to store.
+        dim: Embedding dimension (384 for MiniLM).
+
+    Returns:
+        ``{"legacy": {...}, "columnar": {...}}`` with ``bytes_per_chunk``
+        and ``allocations_per_chunk`` for each layout.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(texts), dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Source strings are built outside the measurement so both layouts pay
+    # for their own copies of the text.
+    sources = [t.encode("utf-8") for t in texts]
+    count = max(len(texts), 1)
+
+    def measure(build: Any) -> Dict[str, float]:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            held = build()
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        finally:
+            tracemalloc.stop()
+        del held
+        return {
+            "bytes_per_chunk": current / count,
+            "allocations_per_chunk": blocks / count,
+        }
+
+    def legacy() -> Any:
+        return [
+            {"embedding": vectors[i].copy(), "text": sources[i].decode("utf-8")}
+            for i in range(len(sources))
+        ]
+
+    def columnar() -> Any:
+        store = NoteStore()
+        store.append(0, vectors, [b.decode("utf-8") for b in sources])
+        return store
+
+    return {"legacy": measure(legacy), "columnar": measure(columnar)}
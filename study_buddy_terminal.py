@@ -15,14 +15,24 @@ implements the following features:
   Hugging Face model trained on the Emotion dataset【570093660071415†L602-L633】.  The detected
   emotion influences the AI's tone through predefined guidance phrases.
 
+* **Shared models** – If the local inference service is running
+  (``python study_buddy_inference.py serve``) the script uses its models
+  over a Unix socket and starts in milliseconds; otherwise it loads the
+  models itself.
+
 * **Note upload and retrieval** – You can upload a PDF, DOCX or plain
   text file by entering its path.  The script extracts text from the
   document, chunks it, computes sentence embeddings and stores them in
   memory.  When asking questions, the AI retrieves the most relevant
   passages to include as context.
 
+* **Batch mode** – ``--batch`` answers a file of questions without
+  prompting, for evaluating the pipeline over a question set or measuring
+  its offline throughput (see below).
+
 Run the script with a valid Google Gemini API key set in your `.env` file
-or environment.  Example:
+or environment (or with ``STUDY_BUDDY_LLM=fake`` for the offline stand‑in
+from ``study_buddy_llm.py``).  Example:
 
 ```
 pip install transformers sentence-transformers pdfplumber docx2txt python-dotenv google-generativeai
@@ -39,59 +49,91 @@ Commands supported in the chat loop:
   * `/exit` – Exit to persona selection.
   * `/quit` – Exit the program.
 
+Batch mode reads one JSON object per line from a file, or from stdin with
+``--batch -``: ``{"id": ..., "question": "...", "mode": "3", "use_notes":
+true}`` where only ``question`` is required (a bare JSON string works
+too).  The ``--notes`` files are ingested first.  Questions are taken in
+groups of ``--batch-size``: each group's emotions are classified and its
+questions embedded and matched against the notes in one model call per
+stage, and up to ``--concurrency`` Gemini calls run at once while the next
+group is prepared.  Each question is answered on its own, without the
+previous ones as history.  One JSON result per line goes to ``--output``
+(default stdout), in completion order:
+
+```
+{"id": 7, "question": "...", "mode": "1", "emotion": "fear",
+ "context": [{"chunk": 12, "score": 0.61}, ...], "answer": "...", "error": null,
+ "batch_size": 32, "timings_ms": {"emotion": ..., "embed": ..., "retrieve": ...,
+ "queue": ..., "llm": ..., "total": ...}}
+```
+
+``emotion``, ``embed`` and ``retrieve`` are the wall time of the whole
+group's call; ``queue`` is the wait for a free LLM slot and ``total`` runs
+from the start of the group to the answer.  A summary with throughput and
+latency percentiles is printed to stderr at the end.
+
+```
+python study_buddy_terminal.py --batch questions.jsonl --notes notes.pdf --output results.jsonl
+STUDY_BUDDY_LLM=fake python study_buddy_terminal.py --batch - --notes notes.txt --concurrency 32 < questions.jsonl
+```
+
 """
 
 from __future__ import annotations
 
+import argparse
 import os
 import sys
 import json
 import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, TextIO, Tuple
 
 from dotenv import load_dotenv
 import numpy as np
 import pdfplumber
 import docx2txt
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer
-import google.generativeai as genai
+
+from study_buddy_benchmark import summarize
+from study_buddy_inference import load_models
+from study_buddy_llm import load_llm_client
 
 ###############################################################################
 # Load environment variables and configure Gemini
 ###############################################################################
 
+# Status messages go to stderr so batch results can be piped from stdout
 load_dotenv()
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    print("❌ GEMINI_API_KEY not found. Please create a .env file with GEMINI_API_KEY=<your-key>.")
+if not GEMINI_API_KEY and os.environ.get("STUDY_BUDDY_LLM", "gemini").lower() == "gemini":
+    print("❌ GEMINI_API_KEY not found. Please create a .env file with GEMINI_API_KEY=<your-key>.", file=sys.stderr)
     sys.exit(1)
 
 try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Use the flash model for lower latency
-    gen_model = genai.GenerativeModel("models/gemini-2.5-flash")
-    print("✅ Gemini configured successfully!")
+    # Gemini flash by default; STUDY_BUDDY_LLM=fake for offline runs
+    llm_client = load_llm_client(GEMINI_API_KEY)
+    print(f"✅ LLM configured successfully ({llm_client.name})!", file=sys.stderr)
 except Exception as e:
-    print(f"❌ Failed to configure Gemini: {e}")
+    print(f"❌ Failed to configure the LLM: {e}", file=sys.stderr)
     sys.exit(1)
 
 ###############################################################################
 # Initialise models: emotion classifier and sentence embeddings
 ###############################################################################
 
-print("🔄 Loading models…")
+# Connects to the local inference service (study_buddy_inference.py) when it
+# is running, which takes milliseconds; otherwise loads the models here.
+print("🔄 Loading models…", file=sys.stderr)
 try:
-    emotion_classifier = pipeline(
-        "text-classification",
-        model="bhadresh-savani/distilbert-base-uncased-emotion",
-        return_all_scores=True,
-    )
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-    print("✅ Models loaded.")
+    emotion_classifier, embedding_model, inference_client = load_models()
+    if inference_client is not None:
+        print(f"✅ Using the inference service on {inference_client.socket_path}.", file=sys.stderr)
+    else:
+        print("✅ Models loaded.", file=sys.stderr)
 except Exception as e:
-    print(f"❌ Error loading models: {e}")
+    print(f"❌ Error loading models: {e}", file=sys.stderr)
     sys.exit(1)
 
 ###############################################################################
@@ -222,14 +264,14 @@ def retrieve_context(user_id: int, question: str, k: int = 3) -> List[str]:
     return [text for _, text in sims[:k]]
 
 
-def generate_reply(
+def build_prompt(
     user_message: str,
     personality_mode: str,
     conversation: List[Dict[str, Any]],
     emotion: str,
     context_passages: Optional[List[str]] = None,
 ) -> str:
-    """Construct a prompt and query Gemini for a reply."""
+    """Combine the persona, emotion guidance, history and notes into a prompt."""
     persona = PERSONALITY_MODES.get(personality_mode, PERSONALITY_MODES["1"])
     recent = conversation[-10:] if len(conversation) > 10 else conversation
     context_lines = []
@@ -255,9 +297,20 @@ def generate_reply(
         f"Respond naturally as {persona.name}, maintaining continuity of the conversation."
         f"{notes_section}"
     )
+    return prompt
+
+
+def generate_reply(
+    user_message: str,
+    personality_mode: str,
+    conversation: List[Dict[str, Any]],
+    emotion: str,
+    context_passages: Optional[List[str]] = None,
+) -> str:
+    """Construct a prompt and query Gemini for a reply."""
+    prompt = build_prompt(user_message, personality_mode, conversation, emotion, context_passages)
     try:
-        response = gen_model.generate_content(prompt)
-        return response.text
+        return llm_client.generate(prompt)
     except Exception as e:
         return f"Error generating response: {e}"
 
@@ -273,7 +326,7 @@ def load_notes(user_id: int, path: str) -> int:
         Number of chunks stored.
     """
     if not os.path.isfile(path):
-        print(f"❌ File not found: {path}")
+        print(f"❌ File not found: {path}", file=sys.stderr)
         return 0
     ext = os.path.splitext(path.lower())[1]
     text = ""
@@ -288,17 +341,18 @@ def load_notes(user_id: int, path: str) -> int:
             with open(path, "r", encoding="utf-8", errors="ignore") as f:
                 text = f.read()
     except Exception as e:
-        print(f"❌ Failed to extract text: {e}")
+        print(f"❌ Failed to extract text: {e}", file=sys.stderr)
         return 0
     words = text.split()
     chunk_size = 500
     chunks = [" ".join(words[i : i + chunk_size]) for i in range(0, len(words), chunk_size)]
+    chunks = [chunk for chunk in chunks if chunk.strip()]
+    # One batched call instead of one per chunk
+    vectors = embedding_model.encode(chunks, convert_to_numpy=True) if chunks else []
     stored = []
-    for chunk in chunks:
-        if not chunk.strip():
-            continue
-        emb = embed_text(chunk)
-        stored.append({"embedding": emb, "text": chunk})
+    for chunk, vec in zip(chunks, vectors):
+        norm = np.linalg.norm(vec)
+        stored.append({"embedding": vec / norm if norm > 0 else vec, "text": chunk})
     existing = vector_store.get(user_id, [])
     existing.extend(stored)
     vector_store[user_id] = existing
@@ -387,8 +441,261 @@ def chat_loop(user_id: int, session_id: str, mode: str) -> None:
         print(f"{persona.emoji} {persona.name}: {response}\n")
 
 
+###############################################################################
+# Batch mode
+###############################################################################
+
+def read_questions(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Yield one question record per non‑empty JSONL line.
+
+    Lines that are not valid JSON or have no ``question`` yield a record
+    with an ``error`` instead, so they show up in the results.
+    """
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield {"id": number, "error": f"Invalid JSON: {e}"}
+            continue
+        if isinstance(item, str):
+            item = {"question": item}
+        if not isinstance(item, dict) or not str(item.get("question") or "").strip():
+            yield {"id": number, "error": "Expected a question"}
+            continue
+        yield {
+            "id": item.get("id", number),
+            "question": str(item["question"]).strip(),
+            "mode": str(item.get("mode") or ""),
+            "use_notes": bool(item.get("use_notes", True)),
+        }
+
+
+def _groups(items: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    group: List[Dict[str, Any]] = []
+    for item in items:
+        group.append(item)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def classify_emotions(texts: List[str]) -> List[str]:
+    """Return the top emotion label of each text, in one classifier call."""
+    try:
+        preds = emotion_classifier(texts, batch_size=len(texts))
+    except Exception:
+        return ["joy"] * len(texts)
+    return [max(scores, key=lambda x: x["score"])["label"].lower() if scores else "joy" for scores in preds]
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Return the normalised embeddings of the texts, one row each."""
+    matrix = np.asarray(embedding_model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def _prepare_group(
+    group: List[Dict[str, Any]], mode: str, notes: List[Dict[str, Any]], notes_matrix: Optional[np.ndarray], k: int
+) -> List[Tuple[Dict[str, Any], str]]:
+    """Run the batched stages for a group and build each question's prompt."""
+    started = time.perf_counter()
+    valid = [record for record in group if "error" not in record]
+    for record in valid:
+        record.update(started=started, batch_size=len(valid), timings_ms={})
+    if not valid:
+        return []
+    texts = [record["question"] for record in valid]
+
+    t0 = time.perf_counter()
+    emotions = classify_emotions(texts)
+    emotion_ms = (time.perf_counter() - t0) * 1000.0
+
+    embed_ms = retrieve_ms = 0.0
+    top: List[List[Tuple[int, float]]] = [[] for _ in valid]
+    wanted = [i for i, record in enumerate(valid) if record["use_notes"]]
+    if notes_matrix is not None and wanted:
+        t0 = time.perf_counter()
+        queries = embed_texts([texts[i] for i in wanted])
+        embed_ms = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        # One matrix product scores every question against every chunk
+        scores = queries @ notes_matrix.T
+        count = min(k, notes_matrix.shape[0])
+        best = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        for row, i in enumerate(wanted):
+            ranked = sorted(best[row], key=lambda j: -scores[row, j])
+            top[i] = [(int(j), float(scores[row, j])) for j in ranked]
+        retrieve_ms = (time.perf_counter() - t0) * 1000.0
+
+    prepared = []
+    for record, emotion, hits in zip(valid, emotions, top):
+        record["mode"] = record["mode"] if record["mode"] in PERSONALITY_MODES else mode
+        record["emotion"] = emotion
+        record["context"] = [{"chunk": j, "score": round(score, 4)} for j, score in hits]
+        record["timings_ms"].update(emotion=emotion_ms, embed=embed_ms, retrieve=retrieve_ms)
+        passages = [notes[j]["text"] for j, _ in hits]
+        conversation = [{"text": record["question"], "is_user": True}]
+        prompt = build_prompt(record["question"], record["mode"], conversation, emotion, passages or None)
+        prepared.append((record, prompt))
+    return prepared
+
+
+def _answer(record: Dict[str, Any], prompt: str, submitted: float) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    record["timings_ms"]["queue"] = (t0 - submitted) * 1000.0
+    try:
+        record["answer"] = llm_client.generate(prompt)
+    except Exception as e:
+        record["error"] = str(e) or type(e).__name__
+    record["timings_ms"]["llm"] = (time.perf_counter() - t0) * 1000.0
+    return record
+
+
+_RESULT_FIELDS = ("id", "question", "mode", "emotion", "context", "answer", "error", "batch_size")
+
+
+def run_batch(
+    questions: TextIO,
+    output: TextIO,
+    user_id: int,
+    mode: str = "1",
+    concurrency: int = 8,
+    batch_size: int = 32,
+    k: int = 3,
+) -> Dict[str, Any]:
+    """Answer every question from ``questions`` and write JSONL to ``output``.
+
+    Args:
+        questions: JSONL stream of questions (see the module docstring).
+        output: Stream that receives one JSON result per line.
+        user_id: Whose notes in :data:`vector_store` to retrieve from.
+        mode: Persona for questions that do not name one.
+        concurrency: Maximum LLM calls in flight.
+        batch_size: Questions per classifier/embedder call.
+        k: Note chunks retrieved per question.
+
+    Returns:
+        Counts, wall time and latency summaries for the run.
+    """
+    notes = vector_store.get(user_id, [])
+    notes_matrix = np.stack([entry["embedding"] for entry in notes]).astype(np.float32) if notes else None
+    llm_samples: List[float] = []
+    total_samples: List[float] = []
+    errors = 0
+    written = 0
+
+    def write(record: Dict[str, Any]) -> None:
+        nonlocal errors, written
+        timings = record.get("timings_ms")
+        if timings is not None:
+            timings["total"] = (time.perf_counter() - record["started"]) * 1000.0
+            total_samples.append(timings["total"] / 1000.0)
+            if "llm" in timings:
+                llm_samples.append(timings["llm"] / 1000.0)
+            timings = {stage: round(ms, 3) for stage, ms in timings.items()}
+        result = {key: record.get(key) for key in _RESULT_FIELDS}
+        result["timings_ms"] = timings
+        errors += result["error"] is not None
+        written += 1
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    def collect(pending: "set[Future]", block: bool) -> "set[Future]":
+        if not pending:
+            return pending
+        done, pending = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            write(future.result())
+        return pending
+
+    run_started = time.perf_counter()
+    pending: "set[Future]" = set()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="study-buddy-llm") as pool:
+        for group in _groups(read_questions(questions), batch_size):
+            prepared = _prepare_group(group, mode, notes, notes_matrix, k)
+            for record in group:
+                if "error" in record:
+                    write(record)
+            for record, prompt in prepared:
+                # Keep a bounded queue so a large input is not read ahead
+                while len(pending) >= 2 * concurrency:
+                    pending = collect(pending, block=True)
+                pending.add(pool.submit(_answer, record, prompt, time.perf_counter()))
+            pending = collect(pending, block=False)
+        while pending:
+            pending = collect(pending, block=True)
+    output.flush()
+    wall = time.perf_counter() - run_started
+    return {
+        "questions": written,
+        "errors": errors,
+        "wall_s": wall,
+        "questions_per_s": written / wall if wall > 0 else 0.0,
+        "llm": summarize(llm_samples, wall),
+        "total": summarize(total_samples, wall),
+    }
+
+
+def batch_main(args: argparse.Namespace) -> None:
+    """Ingest the notes, answer the questions and print a summary."""
+    for path in args.notes:
+        chunks = load_notes(args.user_id, path)
+        print(f"📄 Stored {chunks} chunks from {path}", file=sys.stderr)
+    questions = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+    output = sys.stdout if args.output in (None, "-") else open(args.output, "w", encoding="utf-8")
+    try:
+        summary = run_batch(
+            questions,
+            output,
+            args.user_id,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            k=args.top_k,
+        )
+    finally:
+        if questions is not sys.stdin:
+            questions.close()
+        if output is not sys.stdout:
+            output.close()
+    llm, total = summary["llm"], summary["total"]
+    print(
+        f"✅ {summary['questions']} questions in {summary['wall_s']:.1f}s "
+        f"({summary['questions_per_s']:.1f}/s), {summary['errors']} errors",
+        file=sys.stderr,
+    )
+    for name, stats in (("llm", llm), ("total", total)):
+        if stats.get("n"):
+            print(
+                f"   {name:<5} p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms, "
+                f"max {stats['max_ms']:.0f} ms",
+                file=sys.stderr,
+            )
+
+
 def main() -> None:
     """Main entry point for the terminal UI."""
+    parser = argparse.ArgumentParser(description="Study Buddy AI – Terminal Edition")
+    parser.add_argument("--batch", metavar="QUESTIONS", help="Answer a JSONL file of questions ('-' for stdin)")
+    parser.add_argument("--notes", nargs="*", default=[], help="Note files to ingest first (batch mode)")
+    parser.add_argument("--output", help="JSONL results file (default: stdout)")
+    parser.add_argument("--mode", default="1", choices=sorted(PERSONALITY_MODES), help="Default persona")
+    parser.add_argument("--user-id", type=int, default=1, help="User the notes belong to")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM calls in flight")
+    parser.add_argument("--batch-size", type=int, default=32, help="Questions per model call")
+    parser.add_argument("--top-k", type=int, default=3, help="Note chunks per question")
+    args = parser.parse_args()
+    if args.concurrency < 1 or args.batch_size < 1 or args.top_k < 1:
+        parser.error("--concurrency, --batch-size and --top-k must be at least 1")
+    if args.batch:
+        batch_main(args)
+        return
+
     print("\n🎓 Study Buddy AI – Terminal Edition")
     print("=" * 60)
     while True:
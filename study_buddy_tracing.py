@@ -0,0 +1,382 @@
+"""
+Study Buddy Tracing
+===================
+
+Lightweight per‑request span tracing written to a local JSONL file.
+
+Histograms (``study_buddy_metrics.py``) say *that* requests are slow; a
+trace says *why one particular request* was slow.  Each sampled request
+records a tree of spans – the request itself, then stages such as
+``classify``, ``embed_query``, ``search`` and ``generate`` in the Study
+Buddy API or ``bcrypt``, ``db`` and ``jwt`` in the auth API – with their
+offsets, durations and attributes (chunk counts, prompt sizes, ...).
+
+Usage inside an application::
+
+    tracer = Tracer.from_env()
+    app.middleware("http")(tracer.middleware)
+
+    with span("search", k=3) as s:
+        hits = store.search(...)
+        s.set(hits=len(hits))
+
+:func:`span` is a no‑op unless the current request was sampled, so
+instrumented code costs next to nothing on unsampled requests.  Spans
+opened in worker threads are attached to the right request because the
+current span lives in a context variable, which Starlette copies into its
+thread pool.
+
+Finished traces are appended, one JSON object per line, to a size‑rotated
+file.  Configuration comes from the environment:
+
+``STUDY_BUDDY_TRACE_SAMPLE_RATE``
+    Fraction of requests to trace, default ``0`` (tracing off).  A request
+    carrying the ``X-Study-Buddy-Trace: 1`` header is always traced while
+    tracing is configured.
+``STUDY_BUDDY_TRACE_FILE``
+    Output path, default ``traces.jsonl``.
+``STUDY_BUDDY_TRACE_MAX_MB`` / ``STUDY_BUDDY_TRACE_BACKUPS``
+    Rotate at this size (default ``10``) keeping this many old files
+    (default ``3``).
+
+Run this module to inspect a trace file::
+
+    python study_buddy_tracing.py traces.jsonl --top 10
+
+It prints the slowest traces and, for each, its critical path: the chain
+of spans that determined the end‑to‑end latency.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextvars
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_HEADER = "x-study-buddy-trace"
+
+
+###############################################################################
+# Spans
+###############################################################################
+
+class Span:
+    """A timed operation with attributes and child spans."""
+
+    __slots__ = ("name", "start", "end", "attributes", "children", "thread")
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.children: List["Span"] = []
+        self.thread = threading.current_thread().name
+
+    def set(self, **attributes: Any) -> None:
+        """Add or overwrite attributes."""
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        record: Dict[str, Any] = {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000.0, 3),
+            "duration_ms": round((end - self.start) * 1000.0, 3),
+            "thread": self.thread,
+        }
+        if self.attributes:
+            record["attributes"] = self.attributes
+        if self.children:
+            record["children"] = [
+                child.to_dict(origin) for child in sorted(self.children, key=lambda c: c.start)
+            ]
+        return record
+
+
+class _NoopSpan:
+    """Stand‑in yielded by :func:`span` when the request is not sampled."""
+
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Innermost open span of the current (sampled) request, or None
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "study_buddy_current_span", default=None
+)
+
+
+def tracing_active() -> bool:
+    """Return True if the current request is being traced."""
+    return _current_span.get() is not None
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Record a child span of the current span, if the request is sampled.
+
+    Yields an object with a ``set(**attributes)`` method for attributes that
+    are only known once the work is done.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield _NOOP_SPAN
+        return
+    child = Span(name, attributes)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set(error=type(e).__name__)
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def record_span(name: str, started: float, **attributes: Any) -> None:
+    """Record an already finished span that began at ``started``.
+
+    For work whose timing is taken by hand with ``time.perf_counter()``
+    rather than inside a ``with`` block.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(name, attributes)
+    child.start = started
+    child.finish()
+    parent.children.append(child)
+
+
+###############################################################################
+# Tracer
+###############################################################################
+
+class Tracer:
+    """Samples requests and writes their span trees to a rotating JSONL file.
+
+    Args:
+        path: Output file.
+        sample_rate: Fraction of requests to trace, in ``[0, 1]``.
+        max_bytes: Rotate the file once it exceeds this size.
+        backup_count: Number of rotated files to keep.
+        service: Name recorded in every trace, e.g. ``study-buddy``.
+    """
+
+    def __init__(
+        self,
+        path: str = "traces.jsonl",
+        sample_rate: float = 0.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 3,
+        service: str = "study-buddy",
+    ) -> None:
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.service = service
+        self.enabled = sample_rate > 0.0
+        self._handler: Optional[logging.Handler] = None
+        self._handler_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, service: str = "study-buddy") -> "Tracer":
+        """Create a tracer configured from ``STUDY_BUDDY_TRACE_*`` variables."""
+        return cls(
+            path=os.environ.get("STUDY_BUDDY_TRACE_FILE", "traces.jsonl"),
+            sample_rate=float(os.environ.get("STUDY_BUDDY_TRACE_SAMPLE_RATE", "0")),
+            max_bytes=int(float(os.environ.get("STUDY_BUDDY_TRACE_MAX_MB", "10")) * 1024 * 1024),
+            backup_count=int(os.environ.get("STUDY_BUDDY_TRACE_BACKUPS", "3")),
+            service=service,
+        )
+
+    def should_sample(self, forced: bool = False) -> bool:
+        if not self.enabled:
+            return False
+        return forced or random.random() < self.sample_rate
+
+    @contextmanager
+    def trace(self, name: str, forced: bool = False, **attributes: Any) -> Iterator[Any]:
+        """Trace the enclosed block as one request, if it is sampled."""
+        if not self.should_sample(forced):
+            yield _NOOP_SPAN
+            return
+        root = Span(name, attributes)
+        wall_start = time.time()
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.set(error=type(e).__name__)
+            raise
+        finally:
+            root.finish()
+            _current_span.reset(token)
+            self.export(root, wall_start)
+
+    def export(self, root: Span, wall_start: float) -> None:
+        """Append a finished trace to the JSONL file."""
+        record = {
+            "trace_id": uuid.uuid4().hex,
+            "service": self.service,
+            "timestamp": wall_start,
+            "duration_ms": round(((root.end or root.start) - root.start) * 1000.0, 3),
+            "root": root.to_dict(root.start),
+        }
+        try:
+            line = json.dumps(record, default=str)
+            self._file_handler().emit(logging.makeLogRecord({"msg": line}))
+        except Exception:
+            # Tracing must never break the request it observes
+            pass
+
+    def _file_handler(self) -> logging.Handler:
+        with self._handler_lock:
+            if self._handler is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    self.path,
+                    maxBytes=self.max_bytes,
+                    backupCount=self.backup_count,
+                    encoding="utf-8",
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._handler = handler
+            return self._handler
+
+    async def middleware(self, request: Any, call_next: Any) -> Any:
+        """Starlette/FastAPI HTTP middleware tracing each sampled request."""
+        if not self.enabled:
+            return await call_next(request)
+        forced = request.headers.get(TRACE_HEADER, "") in {"1", "true", "yes"}
+        name = f"{request.method} {request.url.path}"
+        with self.trace(name, forced=forced, method=request.method, path=request.url.path) as root:
+            response = await call_next(request)
+            root.set(status=response.status_code)
+            return response
+
+
+###############################################################################
+# Trace file analysis
+###############################################################################
+
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    """Read traces from ``path`` and its rotated backups (``path.1`` ...)."""
+    traces: List[Dict[str, Any]] = []
+    for name in [path] + sorted(glob.glob(path + ".*")):
+        try:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        traces.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            continue
+    return traces
+
+
+def critical_path(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the spans on the critical path below and including ``node``.
+
+    Walking back from the end of a span, the critical path repeatedly takes
+    the child that finished last before the cursor, then continues from that
+    child's start.  Children that overlap the chosen one (work done
+    concurrently) are skipped because they did not hold up the parent.
+    Each returned span carries a ``depth`` key for display.
+    """
+
+    def walk(span_node: Dict[str, Any], depth: int) -> List[Dict[str, Any]]:
+        path = [dict(span_node, depth=depth)]
+        children = span_node.get("children", [])
+        cursor = span_node["offset_ms"] + span_node["duration_ms"]
+        chosen: List[Dict[str, Any]] = []
+        remaining = sorted(children, key=lambda c: c["offset_ms"] + c["duration_ms"], reverse=True)
+        for child in remaining:
+            child_end = child["offset_ms"] + child["duration_ms"]
+            if child_end <= cursor + 1e-6:
+                chosen.append(child)
+                cursor = child["offset_ms"]
+        for child in reversed(chosen):
+            path.extend(walk(child, depth + 1))
+        return path
+
+    return walk(node, 0)
+
+
+def format_trace(trace: Dict[str, Any]) -> str:
+    """Render one trace with its critical path as text."""
+    root = trace["root"]
+    total = max(trace.get("duration_ms", root["duration_ms"]), 1e-9)
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace.get("timestamp", 0)))
+    status = root.get("attributes", {}).get("status", "")
+    lines = [
+        f"{trace['duration_ms']:10.1f} ms  {root['name']}  {status}  "
+        f"[{trace.get('service', '')} {when} {trace.get('trace_id', '')[:12]}]"
+    ]
+    for node in critical_path(root)[1:]:
+        attributes = node.get("attributes", {})
+        details = " ".join(f"{key}={value}" for key, value in attributes.items())
+        share = 100.0 * node["duration_ms"] / total
+        lines.append(
+            f"{node['duration_ms']:10.1f} ms {share:5.1f}%  "
+            f"{'  ' * node['depth']}{node['name']}  {details}".rstrip()
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Print the slowest traces from a Study Buddy trace file."
+    )
+    parser.add_argument("path", nargs="?", default=os.environ.get("STUDY_BUDDY_TRACE_FILE", "traces.jsonl"))
+    parser.add_argument("--top", type=int, default=10, help="Number of traces to print")
+    parser.add_argument("--name", help="Only traces whose root name contains this text")
+    parser.add_argument("--service", help="Only traces from this service")
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.path)
+    if args.name:
+        traces = [t for t in traces if args.name in t["root"]["name"]]
+    if args.service:
+        traces = [t for t in traces if t.get("service") == args.service]
+    if not traces:
+        print(f"No traces found in {args.path}")
+        return
+    traces.sort(key=lambda t: t["duration_ms"], reverse=True)
+    print(f"{len(traces)} traces; slowest {min(args.top, len(traces))} with critical paths:\n")
+    for trace in traces[: args.top]:
+        print(format_trace(trace))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Overload behaviour of ``study_buddy_llm.LLMScheduler``.
+
+A burst against a healthy provider is rejected locally (queue full, or no
+slot before the deadline).  Those rejections must not count as provider
+failures, or the circuit breaker would open and fail calls that the
+provider could have served.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+from study_buddy_llm import (
+    AIMDLimiter,
+    CircuitBreaker,
+    FakeLLMClient,
+    LLMDeadlineExceeded,
+    LLMScheduler,
+    LLMUnavailableError,
+)
+
+
+def _scheduler() -> LLMScheduler:
+    return LLMScheduler(
+        FakeLLMClient(latency_ms=200.0, distribution="constant"),
+        limiter=AIMDLimiter(initial=1.0, minimum=1.0, maximum=1.0),
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60.0),
+        max_queue=2,
+    )
+
+
+def test_queue_overflow_keeps_breaker_closed():
+    scheduler = _scheduler()
+
+    async def burst():
+        calls = [scheduler.generate(f"prompt {i}", timeout=5.0) for i in range(8)]
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(burst())
+    rejected = [r for r in results if isinstance(r, LLMUnavailableError)]
+    assert len(rejected) == 5
+    assert all(str(r) == "LLM queue is full" for r in rejected)
+    assert sum(isinstance(r, str) for r in results) == 3
+    assert scheduler.breaker.state == CircuitBreaker.CLOSED
+    assert scheduler.breaker.opens == 0
+
+
+def test_slot_wait_timeout_keeps_breaker_closed():
+    scheduler = _scheduler()
+
+    async def burst():
+        first = asyncio.ensure_future(scheduler.generate("slow", timeout=5.0))
+        await asyncio.sleep(0)
+        waiting = [scheduler.generate(f"prompt {i}", timeout=0.05) for i in range(2)]
+        results = await asyncio.gather(*waiting, return_exceptions=True)
+        return results, await first, await scheduler.generate("after", timeout=5.0)
+
+    results, first, after = asyncio.run(burst())
+    assert all(isinstance(r, LLMDeadlineExceeded) for r in results)
+    assert isinstance(first, str) and isinstance(after, str)
+    assert scheduler.breaker.state == CircuitBreaker.CLOSED
+    assert scheduler.breaker.opens == 0
@@ -0,0 +1,131 @@
+"""Concurrent reader/writer stress test for ``study_buddy_store.NoteStore``.
+
+Writers append documents while readers search and inspect snapshots.
+Every snapshot a reader sees must be internally consistent (one row per
+chunk in every column), and once the writers finish no chunk may be lost
+or duplicated.
+"""
+
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+
+from study_buddy_store import NoteStore
+
+DIM = 16
+WRITERS = 4
+DOCUMENTS_PER_WRITER = 40
+CHUNKS_PER_DOCUMENT = 3
+READERS = 4
+
+
+def _document(writer: int, number: int):
+    rng = np.random.default_rng(writer * 1000 + number)
+    rows = rng.standard_normal((CHUNKS_PER_DOCUMENT, DIM)).astype(np.float32)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    texts = [f"writer {writer} document {number} chunk {i}" for i in range(CHUNKS_PER_DOCUMENT)]
+    pages = [number + 1] * CHUNKS_PER_DOCUMENT
+    return list(rows), texts, pages
+
+
+def _check_snapshot(snapshot) -> None:
+    n = len(snapshot)
+    assert snapshot.embeddings.shape[0] == n or n == 0
+    assert len(snapshot.offsets) == n + 1
+    assert len(snapshot.document_ids) == n
+    assert len(snapshot.pages) == n
+    assert len(snapshot.positions) == n
+    assert snapshot.offsets[-1] == snapshot.text_bytes
+    if snapshot.scales is not None:
+        assert len(snapshot.scales) == n
+    # Chunks of one document are published together
+    for document_id in np.unique(snapshot.document_ids):
+        assert np.count_nonzero(snapshot.document_ids == document_id) == CHUNKS_PER_DOCUMENT
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"precision": "int8"},
+        {"precision": "float16", "memory_budget_bytes": 4096},
+    ],
+    ids=["float32", "int8-rescored", "float16-spilling"],
+)
+def test_concurrent_append_and_search(tmp_path, options):
+    store = NoteStore(spill_dir=str(tmp_path), **options)
+    user_ids = [1, 2]
+    stop = threading.Event()
+    errors = []
+
+    def write(writer: int) -> None:
+        try:
+            for number in range(DOCUMENTS_PER_WRITER):
+                rows, texts, pages = _document(writer, number)
+                store.append(user_ids[writer % len(user_ids)], rows, texts, pages)
+        except BaseException as exc:  # reported by the main thread
+            errors.append(exc)
+
+    def read(reader: int) -> None:
+        rng = np.random.default_rng(reader)
+        try:
+            while not stop.is_set():
+                user_id = user_ids[reader % len(user_ids)]
+                _check_snapshot(store.snapshot(user_id))
+                query = rng.standard_normal(DIM).astype(np.float32)
+                query /= np.linalg.norm(query)
+                for score, snapshot, row in store.search(user_id, query, k=3):
+                    _check_snapshot(snapshot)
+                    assert snapshot.text(row).startswith("writer ")
+                    assert -1.01 <= score <= 1.01
+        except BaseException as exc:
+            errors.append(exc)
+
+    readers = [threading.Thread(target=read, args=(i,)) for i in range(READERS)]
+    writers = [threading.Thread(target=write, args=(i,)) for i in range(WRITERS)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+    assert not errors, errors[0]
+
+    for user_id in user_ids:
+        snapshot = store.snapshot(user_id)
+        _check_snapshot(snapshot)
+        expected = sorted(
+            text
+            for writer in range(WRITERS)
+            if user_ids[writer % len(user_ids)] == user_id
+            for number in range(DOCUMENTS_PER_WRITER)
+            for text in _document(writer, number)[1]
+        )
+        assert sorted(snapshot.iter_texts()) == expected
+
+
+def test_rescoring_file_outlives_readers(tmp_path):
+    store = NoteStore(spill_dir=str(tmp_path), precision="int8")
+    rows, texts, pages = _document(0, 0)
+    store.append(1, rows, texts, pages)
+    held = store.snapshot(1)
+    path = held.full_vectors
+    expected = held.search(rows[0], k=1)
+
+    # An interrupted append leaves extra bytes; the next append must not
+    # truncate the file an older snapshot is reading
+    with open(path, "ab") as f:
+        f.write(b"\0" * 7)
+    store.append(1, *_document(0, 1))
+    assert store.snapshot(1).full_vectors != path
+    assert held.search(rows[0], k=1) == expected
+
+    store.clear(1)
+    assert held.search(rows[0], k=1) == expected
+    assert (tmp_path / path.rsplit("/", 1)[-1]).exists()
+    del held
+    assert not any(tmp_path.glob("*.f32"))